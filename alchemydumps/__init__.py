@@ -1,16 +1,23 @@
 # coding: utf-8
 
-from os import path as op, system
-from dataclasses import dataclass, field
-from typing import Any
+from contextlib import nullcontext
+from itertools import groupby, islice
+from os import getcwd, path as op
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict
 
 import click
-from sqlalchemy.exc import IntegrityError, InvalidRequestError
 
-from alchemydumps.autoclean import BackupAutoClean
+# Flask, SQLAlchemy and asyncio are only imported by the commands using them
+# (see the imports within functions), so listing and cleaning backups starts
+# without them
+from alchemydumps.autoclean import BackupAutoClean, RetentionPolicy
 from alchemydumps.backup import Backup
 from alchemydumps.confirm import Confirm
-from alchemydumps.database import AlchemyDumpsDatabase
+from alchemydumps.compression import NoCodec
+from alchemydumps.journal import Journal
+from alchemydumps.storage import LocalStorage
+from alchemydumps.stream import Digest, decode_frames, encode_frames
 
 
 # from unipath import Path
@@ -46,33 +53,358 @@ class AlchemyDumps(object):
         app.extensions["alchemydumps"] = _AlchemyDumpsConfig(db, basedir)
 
 
-@alchemydumps.command()
-def create():
-    """Create a backup based on SQLAlchemy mapped classes"""
+def get_backup() -> Backup:
+    """
+    Loads the settings and gets to the backup files, stopping the command
+    with a one-line error (rather than a traceback) on a wrong setting
+    """
+    try:
+        return Backup()
+    except ValueError as error:
+        raise click.ClickException(str(error))
 
-    # create backup files
-    alchemy = AlchemyDumpsDatabase()
-    data = alchemy.get_data()
-    backup = Backup()
-    for class_name in data.keys():
-        name = backup.get_name(class_name)
-        full_path = backup.target.create_file(name, data[class_name])
-        rows = len(alchemy.parse_data(data[class_name]))
-        if full_path:
-            print("==> {} rows from {} saved as {}".format(rows, class_name,
-                                                           full_path))
+
+def delete_files(backup, names, jobs=8):
+    """
+    Deletes backup files concurrently (in an event loop), then drops them
+    from the catalog
+    :param backup: Backup instance
+    :param names: file names to delete
+    :param jobs: (int) number of files deleted at the same time
+    """
+
+    from alchemydumps.async_storage import AsyncStorage, run
+
+    storage = AsyncStorage(backup.target, concurrency=max(jobs, 1))
+    try:
+        results = run(storage.delete_files(names))
+    finally:
+        storage.close()
+
+    for name, error in results:
+        if error is None:
+            backup.catalog.remove_file(name)
+            print("    {} deleted.".format(name))
         else:
-            print(
-                "==> Error creating {} at {}".format(name, backup.target.path))
+            print("    {} could not be deleted ({}).".format(name, error))
+    backup.catalog.save()
+    backup.target.collect_garbage({
+        name: backup.catalog.get_details(name)
+        for name in backup.catalog.get_files()
+    })
+
+
+def get_selection(conf, include=(), exclude=(), where=(),
+                  columns=()) -> Dict:
+    """
+    Gets the classes, rows and columns to save from the settings (`include`,
+    `exclude`, `filters` and `columns`) and the options of `create`, which
+    replace the `include` list and the settings of the classes they name
+    :param conf: settings
+    :param include: class or table names (or globs) to save
+    :param exclude: class or table names (or globs) not to save
+    :param where: `Class:condition` strings
+    :param columns: `Class:column,column` strings
+    :return: (dict) keyword arguments of AlchemyDumpsDatabase
+    """
+    filters = dict(getattr(conf, "filters", None) or dict())
+    projections = dict(getattr(conf, "columns", None) or dict())
+    for option, settings in ((where, filters), (columns, projections)):
+        for value in option:
+            class_name, separator, setting = value.partition(":")
+            if not separator or not setting.strip():
+                raise click.BadParameter(
+                    "{!r} is not like `Class:...`".format(value))
+            settings[class_name.strip()] = setting.strip()
+    for class_name, names in projections.items():
+        if isinstance(names, str):
+            names = names.split(",")
+        projections[class_name] = [name.strip() for name in names]
+    return {
+        "include": list(include or getattr(conf, "include", None) or ()),
+        "do_not_backup": list(exclude) + list(
+            getattr(conf, "exclude", None) or ()),
+        "filters": filters,
+        "columns": projections,
+    }
+
+
+@alchemydumps.command()
+@click.option(
+    "-c",
+    "--chunk-size",
+    default=1000,
+    help="Number of rows loaded and serialized at a time",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    default=1,
+    help="Number of tables dumped concurrently",
+)
+@click.option(
+    "-f",
+    "--format",
+    "format_name",
+    default=None,
+    help="Backup format: pickle, msgpack or copy (defaults to the settings)",
+)
+@click.option(
+    "-i",
+    "--incremental",
+    is_flag=True,
+    default=False,
+    help="Only save rows changed since the last backup",
+)
+@click.option(
+    "-s",
+    "--snapshot",
+    "consistent",
+    is_flag=True,
+    default=False,
+    help="Read every table in one read-only repeatable read transaction",
+)
+@click.option(
+    "-p",
+    "--progress",
+    is_flag=True,
+    default=False,
+    help="Show a live status line (rows, MB, rows/s) on the terminal",
+)
+@click.option(
+    "--summary",
+    "summary_path",
+    default=None,
+    help="Write a JSON summary (timings, counters) to this file, - prints it",
+)
+@click.option(
+    "-r",
+    "--resume",
+    default=None,
+    help="ID of an interrupted backup to finish (only missing files are "
+         "saved)",
+)
+@click.option(
+    "-I",
+    "--include",
+    multiple=True,
+    help="Only save this mapped class or table (name or glob, repeatable)",
+)
+@click.option(
+    "-x",
+    "--exclude",
+    multiple=True,
+    help="Don't save this mapped class or table (name or glob, repeatable)",
+)
+@click.option(
+    "-w",
+    "--where",
+    multiple=True,
+    help="Only save the rows of a class matching a SQL condition, as "
+         "`Class:condition` (repeatable)",
+)
+@click.option(
+    "--columns",
+    multiple=True,
+    help="Only save some columns of a class (and its primary key), as "
+         "`Class:column,column` (repeatable, msgpack and copy formats)",
+)
+def create(chunk_size=1000, jobs=1, format_name=None, incremental=False,
+           consistent=False, progress=False, summary_path=None, resume=None,
+           include=(), exclude=(), where=(), columns=()):
+    """
+    Create a backup based on SQLAlchemy mapped classes. With `--incremental`
+    mapped classes declaring a `__alchemydumps_track__` column only get the
+    rows changed since the previous backup. With `--snapshot` all tables are
+    read from the same point in time, each one with a single streamed query.
+    Completed files are journaled, so `--resume ID` finishes an interrupted
+    backup with the same format, marks and segments. Classes, rows and
+    columns can be left out (settings `include`, `exclude`, `filters` and
+    `columns`, or the options of the same names): filters and columns are
+    applied by the database.
+    """
+
+    from alchemydumps.database import AlchemyDumpsDatabase
+    from alchemydumps.formats import get_format
+    from alchemydumps.metrics import Metrics, Progress, export_metrics
+    from alchemydumps.parallel import run_jobs
+
+    # create backup files, streaming each table chunk by chunk
+    metrics = Metrics("create")
+    backup = get_backup()
+    date_id = resume or backup.new_timestamp()
+    journal = Journal(backup.target, Journal.CREATE.format(date_id))
+    if resume:
+        if not journal.load():
+            print("==> No interrupted backup {} to resume.".format(resume))
+            return None
+        format_name = journal.get("options", "format")
+        selection = journal.get("options", "selection")
+    else:
+        selection = get_selection(backup.conf, include, exclude, where,
+                                  columns)
+    alchemy = AlchemyDumpsDatabase(chunk_size=chunk_size,
+                                   stream_results=consistent, metrics=metrics,
+                                   **selection)
+    if consistent and jobs > 1 and alchemy.get_dialect() != "postgresql":
+        print("==> Only PostgreSQL shares a snapshot between connections, "
+              "tables will be saved one at a time")
+        jobs = 1
+    backup_format = get_format(format_name or backup.conf.format)
+    if alchemy.columns and backup_format.name == "pickle":
+        raise click.UsageError("Only the msgpack and copy formats can save "
+                               "some of the columns of a class")
+    base_id, base_marks = None, dict()
+    if resume:
+        base_id = journal.get("options", "base_id")
+        base_marks = {
+            class_name: Journal.decode(mark)
+            for class_name, mark in journal.data.get("base_marks", {}).items()
+        }
+    elif incremental:
+        backup.files = tuple(backup.catalog.get_files())
+        base_id, base_marks = backup.get_last_marks()
+    journal.update("options", "format", backup_format.name)
+    journal.update("options", "selection", selection)
+    journal.update("options", "base_id", base_id)
+    for class_name, mark in base_marks.items():
+        journal.update("base_marks", class_name, Journal.encode(mark))
+    marks = dict()
+
+    split_rows = backup.conf.split_rows
+
+    snapshot_context = alchemy.export_snapshot() if jobs > 1 else nullcontext()
+    with snapshot_context as snapshot:
+        in_snapshot = (consistent and jobs == 1) or bool(snapshot)
+        if in_snapshot:  # marks and ranges are read in the snapshot as well
+            alchemy.begin_snapshot(snapshot)
+
+        # one task per table, or per primary key range of the large ones,
+        # skipping the files a resumed backup already saved
+        tasks, saved = list(), 0
+        total_rows = 0
+        models = alchemy.get_mapped_classes()
+        for model in models:
+            class_name = model.__name__
+            mark = journal.get("marks", class_name)
+            if mark is not None:
+                mark = Journal.decode(mark)
+            else:
+                mark = alchemy.get_mark(model)  # before reading any row
+            if mark is not None:
+                marks[class_name] = mark
+                journal.update("marks", class_name, Journal.encode(mark))
+            changes = alchemy.get_changes_criteria(
+                model, base_marks.get(class_name))
+            bounds = journal.get("bounds", class_name)
+            if bounds is not None:
+                bounds = [Journal.decode(bound) for bound in bounds]
+            if split_rows or progress:
+                count = alchemy.count_rows(
+                    model, changes + alchemy.get_filters(model))
+                total_rows += count
+                if bounds is None and split_rows and count > split_rows:
+                    segments = -(-count // split_rows)
+                    bounds = alchemy.split_bounds(model, segments)
+            bounds = bounds or list()
+            journal.update("bounds", class_name,
+                           [Journal.encode(bound) for bound in bounds])
+            ranges = alchemy.get_ranges(model, bounds)
+            parts = range(1, len(ranges) + 1) if len(ranges) > 1 else [None]
+            for criteria, part in zip(ranges, parts):
+                name = backup.get_name(class_name, date_id,
+                                       delta=bool(changes), part=part)
+                details = journal.get("files", name)
+                if details is not None:
+                    backup.catalog.add_file(date_id, name, **details)
+                    saved += 1
+                    continue
+                tasks.append((model, changes, criteria, name))
+        journal.save()  # the plan, then each file saved
+        if resume:
+            print("==> Resuming backup {}: {} files already saved".format(
+                date_id, saved))
+
+        def dump(task):
+            model, changes, criteria, name = task
+            if jobs > 1:  # each worker reads from the same point in time
+                alchemy.begin_snapshot(snapshot)
+            worker = replace(alchemy, row_counts=dict(), checksums=dict())
+            class_name = model.__name__
+            criteria = changes + criteria + alchemy.get_filters(model)
+            rows = metrics.timed("serialize", backup_format.dump(
+                worker, model, criteria=criteria), counter="bytes")
+            digest = Digest(encode_frames(rows))
+            with metrics.phase("store"):
+                full_path = backup.target.create_file(name, digest)
+            metrics.add("files")
+            count = worker.row_counts.get(class_name, 0)
+            checksum = worker.checksums.get(class_name)
+            subset = {  # so nobody mistakes them for the whole table
+                key: value.get(class_name)
+                for key, value in (("where", alchemy.filters),
+                                   ("columns", alchemy.columns))
+                if value.get(class_name)
+            }
+            backup.catalog.add_file(
+                date_id, name, size=digest.size, rows=count,
+                sha256=digest.hexdigest(),
+                checksum=checksum.hexdigest() if checksum else None,
+                **subset)
+            return name, full_path, count
+
+        status_line = Progress(metrics, len(tasks), total_rows, progress)
+        try:
+            with status_line:
+                for task, result in run_jobs(dump, tasks, jobs):
+                    class_name = task[0].__name__
+                    name, full_path, rows = result
+                    if full_path:
+                        journal.set("files", name,
+                                    backup.catalog.get_details(name))
+                        status_line.echo(
+                            "==> {} rows from {} saved as {}".format(
+                                rows, class_name, full_path))
+                    else:
+                        status_line.echo("==> Error creating {} at {}".format(
+                            name, backup.target.path))
+        except BaseException:
+            print("==> Backup {} interrupted, run `create --resume {}` to "
+                  "finish it".format(date_id, date_id))
+            raise
+        if in_snapshot:
+            alchemy.end_snapshot()
+
+    if marks:
+        backup.save_marks(date_id, marks, base_id)
+    backup.catalog.save()
+    journal.delete()
+    if base_id:
+        print("==> Changes since backup {} saved incrementally".format(
+            base_id))
+
+    print("==> {} tables saved in {:.2f}s ({})".format(
+        len(models), metrics.elapsed, metrics.describe()))
+    export_metrics(metrics, summary_path, backup.conf.metrics_textfile,
+                   backup.conf.statsd_address)
     backup.close_ftp()
 
 
 @alchemydumps.command()
-def history():
+@click.option(
+    "-r",
+    "--rescan",
+    is_flag=True,
+    default=False,
+    help="Rebuild the catalog from a listing of the backup directory",
+)
+def history(rescan=False):
     """List existing backups"""
 
-    backup = Backup()
-    backup.files = tuple(backup.target.get_files())
+    backup = get_backup()
+    if rescan:
+        backup.catalog.rebuild()
+    backup.files = tuple(backup.catalog.get_files())
 
     # if no files
     if not backup.files:
@@ -96,69 +428,347 @@ def history():
 @click.option(
     "-d",
     "--date",
-    # dest="date_id",
-    default=False,
+    "date_id",
+    default=None,
     help="The date part of a file from the AlchemyDumps folder")
-def restore(date_id):
-    """Restore a backup based on the date part of the backup files"""
+@click.option(
+    "-b",
+    "--batch-size",
+    default=1000,
+    help="Number of rows inserted per transaction",
+)
+@click.option(
+    "-u",
+    "--upsert",
+    is_flag=True,
+    default=False,
+    help="Update existing rows instead of retrying them one by one",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    default=1,
+    help="Number of tables restored concurrently",
+)
+@click.option(
+    "--fast",
+    is_flag=True,
+    default=False,
+    help="Bulk load with COPY (PostgreSQL) or LOAD DATA (MySQL), or tune "
+         "SQLite for bulk inserts",
+)
+@click.option(
+    "-p",
+    "--progress",
+    is_flag=True,
+    default=False,
+    help="Show a live status line (rows, MB, rows/s) on the terminal",
+)
+@click.option(
+    "--summary",
+    "summary_path",
+    default=None,
+    help="Write a JSON summary (timings, counters) to this file, - prints it",
+)
+@click.option(
+    "-r",
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Skip the files and rows committed by an interrupted restore of the "
+         "same backup",
+)
+@click.option(
+    "--low-memory",
+    is_flag=True,
+    default=False,
+    help="Restore each batch with a session of its own, closed after it",
+)
+@click.option(
+    "-m",
+    "--memory-limit",
+    type=int,
+    default=None,
+    help="Memory ceiling in MB: batches shrink to stay under it",
+)
+def restore(date_id, batch_size=1000, upsert=False, jobs=1, fast=False,
+            progress=False, summary_path=None, resume=False,
+            low_memory=False, memory_limit=None):
+    """
+    Restore a backup based on the date part of the backup files. The rows
+    committed from each file are journaled in the working directory, so
+    `--resume` continues an interrupted restore after its last batch.
+    """
+
+    from alchemydumps.database import AlchemyDumpsDatabase
+    from alchemydumps.formats import load_chunks
+    from alchemydumps.metrics import (Metrics, Progress, export_metrics,
+                                      get_peak_rss)
+    from alchemydumps.parallel import run_jobs
+
+    metrics = Metrics("restore")
+    backup = get_backup()
+    memory_limit = memory_limit or backup.conf.memory_limit
+    alchemy = AlchemyDumpsDatabase(
+        batch_size=batch_size, fast=fast, metrics=metrics,
+        low_memory=low_memory,
+        memory_limit=memory_limit * 2 ** 20 if memory_limit else None)
+    backup.files = tuple(backup.catalog.get_files())
+    if not backup.valid(date_id):
+        backup.close_ftp()
+        return None
+    journal = Journal(LocalStorage(getcwd(), codec=NoCodec(),
+                                   local_path=getcwd()),
+                      Journal.RESTORE.format(date_id), interval=1.0)
+    if resume and not journal.load():
+        print("==> No interrupted restore of {} to resume.".format(date_id))
+        return None
+
+    def load(mapped_class):
+        names = backup.find_chain(mapped_class.__name__, date_id)
+        if not names:
+            return backup.get_name(mapped_class.__name__, date_id), None
+
+        def load_file(name):
+            if journal.get("done", name):
+                return list()
+            restored = journal.get("rows", name, 0)
+
+            def checkpoint(count):
+                nonlocal restored
+                restored += count
+                journal.set("rows", name, restored, force=False)
+
+            with backup.target.open_file(name) as handler:
+                chunks = metrics.timed("read", decode_frames(handler),
+                                       counter="bytes")
+                rows = load_chunks(alchemy, mapped_class, chunks)
+                rows = islice(rows, restored, None)  # committed before
+                with metrics.phase("parse"):  # besides reading and inserting
+                    failed = list(alchemy.restore_rows(
+                        mapped_class, rows, upsert=upsert,
+                        checkpoint=checkpoint))
+            journal.set("done", name, True)
+            metrics.add("files")
+            return failed
+
+        # restore the full backup and then each incremental one, reading the
+        # file contents as a stream; segments of a backup (disjoint primary
+        # key ranges) are loaded concurrently
+        fails = list()
+        for _, segments in groupby(names, key=backup.get_timestamp):
+            segments = list(segments)
+            workers = jobs if len(segments) > 1 else 1
+            for _, failed in run_jobs(load_file, segments, workers):
+                fails.extend(failed)
+        return ", ".join(names), fails
+
+    # the catalog knows how many rows each file holds
+    levels = alchemy.get_levels()
+    try:
+        names = [name for level in levels for mapped_class in level
+                 for name in backup.find_chain(mapped_class.__name__, date_id)]
+    except ValueError as error:  # a backup of the chain was removed
+        raise click.ClickException(str(error))
+    total_rows = sum(backup.catalog.get_details(name).get("rows") or 0
+                     for name in names)
+
+    # loop through mapped classes, parents before the classes referencing them
+    status_line = Progress(metrics, len(names), total_rows, progress)
+    try:
+        with status_line:
+            for level in levels:
+                for mapped_class, (name, fails) in run_jobs(load, level, jobs):
+                    if fails is None:
+                        msg = "==> No file found for {} ({}{} does not exist)."
+                        status_line.echo(msg.format(mapped_class.__name__,
+                                                    backup.target.path, name))
+                        continue
+
+                    # print summary
+                    status = "partially" if len(fails) else "totally"
+                    status_line.echo("==> {} {} restored.".format(name,
+                                                                  status))
+                    for f in fails:
+                        status_line.echo("    Restore of {} failed.".format(f))
+    except BaseException:
+        journal.save()
+        print("==> Restore interrupted, run `restore -d {} --resume` to "
+              "continue it".format(date_id))
+        raise
+    journal.delete()
+
+    print("==> Restored in {:.2f}s ({})".format(metrics.elapsed,
+                                                metrics.describe()))
+    print("==> Peak memory: {:.1f} MB".format(get_peak_rss() / 2 ** 20))
+    export_metrics(metrics, summary_path, backup.conf.metrics_textfile,
+                   backup.conf.statsd_address)
+
+
+@alchemydumps.command()
+@click.option(
+    "-d",
+    "--date",
+    "date_id",
+    default=None,
+    help="The date part of a file from the AlchemyDumps folder (defaults to "
+         "the most recent backup)",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    default=4,
+    help="Number of files read concurrently",
+)
+@click.option(
+    "--against-db",
+    is_flag=True,
+    default=False,
+    help="Also compare row counts and checksums with the database tables",
+)
+def verify(date_id=None, jobs=4, against_db=False):
+    """
+    Check that the files of a backup can be read back and hold what was
+    saved (size, sha256, rows and row checksum recorded by `create`),
+    without restoring them
+    """
+
+    from alchemydumps.checksum import verify_file
+    from alchemydumps.database import AlchemyDumpsDatabase
+    from alchemydumps.parallel import run_jobs
+
+    backup = get_backup()
+    backup.files = tuple(backup.catalog.get_files())
+    date_id = date_id or next(iter(backup.catalog.get_timestamps()), None)
+    if not backup.valid(date_id):
+        return None
 
     alchemy = AlchemyDumpsDatabase()
-    backup = Backup()
-
-    # loop through mapped classes
-    for mapped_class in alchemy.get_mapped_classes():
-        class_name = mapped_class.__name__
-        name = backup.get_name(class_name, date_id)
-        if op.exists(op.join(backup.target.path, name)):
-
-            # read file contents
-            contents = backup.target.read_file(name)
-            fails = list()
-
-            # restore to the db
-            db = alchemy.db()
-            for row in alchemy.parse_data(contents):
-                try:
-                    db.session.merge(row)
-                    db.session.commit()
-                except (IntegrityError, InvalidRequestError):
-                    db.session.rollback()
-                    fails.append(row)
-
-            # print summary
-            status = "partially" if len(fails) else "totally"
-            print("==> {} {} restored.".format(name, status))
-            for f in fails:
-                print("    Restore of {} failed.".format(f))
+    tasks = list()
+    for model in alchemy.get_mapped_classes():
+        for delta in (False, True):
+            for name in backup.find_files(model.__name__, date_id, delta):
+                tasks.append((model, name))
+    checked = {name for _, name in tasks}
+    checked.add(backup.find_name(backup.MARKS, date_id))
+    for name in backup.by_timestamp(date_id):
+        if name not in checked:
+            print("==> {} skipped (no mapped class)".format(name))
+
+    def check(task):
+        model, name = task
+        try:
+            return verify_file(alchemy, backup.target, model, name,
+                               backup.catalog.get_details(name))
+        except Exception as error:  # unreadable: corrupted, truncated…
+            return ["unreadable ({})".format(error)], None
+
+    print("==> Verifying backup {} ({} files)".format(date_id, len(tasks)))
+    checksums, failed = dict(), 0
+    for (model, name), (problems, checksum) in run_jobs(check, tasks, jobs):
+        if problems:
+            failed += 1
+            print("    {} FAILED: {}".format(name, "; ".join(problems)))
+        else:
+            checksums[name] = checksum
+            print("    {} OK ({} rows)".format(name, checksum.rows))
+
+    if against_db:
+        compare_with_db(backup, alchemy, date_id, checksums, jobs)
+    backup.close_ftp()
+    if failed:
+        raise click.ClickException("{} of {} files failed verification".format(
+            failed, len(tasks)))
+
+
+def compare_with_db(backup, alchemy, date_id, checksums, jobs=4):
+    """
+    Compares the tables fully saved in a backup with the database: row
+    counts first, then (if they match) row checksums, reading primary key
+    ranges of each table concurrently
+    :param checksums: (dict) checksums of the verified files, by file name
+    """
+
+    from alchemydumps.checksum import RowChecksum
+    from alchemydumps.parallel import run_jobs
+
+    for model in alchemy.get_mapped_classes():
+        class_name = model.__name__
+        names = backup.find_files(class_name, date_id)
+        if not names or backup.find_files(class_name, date_id, delta=True):
+            continue  # incremental backups only hold the changed rows
+        if any(name not in checksums for name in names):
+            continue
+        if any(backup.catalog.get_details(name).get("where") or
+               backup.catalog.get_details(name).get("columns")
+               for name in names):
+            print("==> {} not compared (only some of its rows or columns "
+                  "were saved)".format(class_name))
+            continue
+        saved = checksums[names[0]]
+        for name in names[1:]:
+            saved = saved.combine(checksums[name])
+
+        count = alchemy.count_rows(model)
+        if count != saved.rows:
+            print("==> {} differs from the database: {} rows saved, {} in "
+                  "the database".format(class_name, saved.rows, count))
+            continue
+        ranges = alchemy.split_ranges(model, jobs)
+        current = RowChecksum.of(model)
+        for _, checksum in run_jobs(
+                lambda criteria: alchemy.checksum_rows(model, criteria),
+                ranges, jobs):
+            current = current.combine(checksum)
+        if current.total != saved.total:
+            print("==> {} differs from the database: same number of rows, "
+                  "different content".format(class_name))
         else:
-            system("ls alchemydumps-backups")
-            msg = "==> No file found for {} ({}{} does not exist)."
-            print(msg.format(class_name, backup.target.path, name))
+            print("==> {} matches the database ({} rows)".format(
+                class_name, count))
 
 
 @alchemydumps.command()
 @click.option(
     "-d",
     "--date",
-    # dest="date_id",
-    default=False,
+    "date_id",
+    default=None,
     help="The date part of a file from the AlchemyDumps folder",
 )
 @click.option(
     "-y",
     "--assume-yes",
-    # dest="assume_yes",
-    # action="store_true",
+    is_flag=True,
     default=False,
     help="Assume `yes` for all prompts",
 )
-def remove(date_id, assume_yes=False):
+@click.option(
+    "-j",
+    "--jobs",
+    default=8,
+    help="Number of files deleted concurrently",
+)
+def remove(date_id, assume_yes=False, jobs=8):
     """Remove a series of backup files based on the date part of the files"""
 
     # check if date/id is valid
-    backup = Backup()
+    backup = get_backup()
     if backup.valid(date_id):
 
+        # incremental backups based on it couldn't be restored any more
+        dependents = [
+            timestamp for timestamp in backup.get_timestamps()
+            if int(timestamp) > int(date_id) and
+            date_id in backup.get_bases([timestamp])
+        ]
+        if dependents:
+            backup.close_ftp()
+            raise click.ClickException(
+                "Backup {} is the base of the incremental backups {}: "
+                "remove them first".format(
+                    date_id, ", ".join(sorted(dependents, key=int))))
+
         # List files to be deleted
         delete_list = tuple(backup.by_timestamp(date_id))
         print("==> Do you want to delete the following files?")
@@ -168,9 +778,7 @@ def remove(date_id, assume_yes=False):
         # delete
         confirm = Confirm(assume_yes)
         if confirm.ask():
-            for name in delete_list:
-                backup.target.delete_file(name)
-                print("    {} deleted.".format(name))
+            delete_files(backup, delete_list, jobs)
     backup.close_ftp()
 
 
@@ -178,31 +786,46 @@ def remove(date_id, assume_yes=False):
 @click.option(
     "-y",
     "--assume-yes",
-    # dest="assume_yes",
-    # action="store_true",
+    is_flag=True,
     default=False,
     help="Assume `yes` for all prompts",
 )
-def autoclean(assume_yes=False):
+@click.option(
+    "-j",
+    "--jobs",
+    default=8,
+    help="Number of files deleted concurrently",
+)
+def autoclean(assume_yes=False, jobs=8):
     """
     Remove a series of backup files based on the following rules:
     * Keeps all the backups from the last 7 days
     * Keeps the most recent backup from each week of the last month
     * Keeps the most recent backup from each month of the last year
     * Keeps the most recent backup from each year of the remaining years
+    Setting any of keep_last, keep_hourly, keep_daily, keep_weekly,
+    keep_monthly or keep_yearly replaces these rules by a GFS policy.
+    The backups the incremental ones kept are based on are kept too.
     """
 
     # check if there are backups
-    backup = Backup()
-    backup.files = tuple(backup.target.get_files())
+    backup = get_backup()
+    backup.files = tuple(backup.catalog.get_files())
     if not backup.files:
         print("==> No backups found.")
         return None
 
     # get black and white list
-    cleaning = BackupAutoClean(backup.get_timestamps())
+    policy = RetentionPolicy.from_settings(backup.conf)
+    cleaning = BackupAutoClean(backup.get_timestamps(), policy=policy)
     white_list = cleaning.white_list
-    black_list = cleaning.black_list
+
+    # keep the backups the incremental ones kept are based on
+    bases = backup.get_bases(white_list)
+    if bases:
+        white_list = sorted(white_list + bases, key=int, reverse=True)
+    black_list = [date_id for date_id in cleaning.black_list
+                  if date_id not in bases]
     if not black_list:
         print("==> No backup to be deleted.")
         return None
@@ -228,7 +851,5 @@ def autoclean(assume_yes=False):
     # delete
     confirm = Confirm(assume_yes)
     if confirm.ask():
-        for name in delete_list:
-            backup.target.delete_file(name)
-            print("    {} deleted.".format(name))
+        delete_files(backup, delete_list, jobs)
     backup.close_ftp()
@@ -0,0 +1,73 @@
+# coding: utf-8
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from typing import Iterable, List, Tuple, Union
+
+from alchemydumps.storage import Storage
+from alchemydumps.utils import batched
+
+
+@dataclass
+class AsyncStorage(object):
+    """
+    Asynchronous interface to a storage: each call runs the blocking storage
+    method on a pool of `concurrency` threads, so many transfers or deletes
+    overlap their network latency. An FTP storage runs at most as many
+    commands at a time as its pool has sessions.
+    """
+
+    storage: Storage
+    concurrency: int = 8
+
+    def __post_init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args))
+
+    async def get_files(self) -> List[str]:
+        return await self.run(lambda: list(self.storage.get_files()))
+
+    async def create_file(self, name: str,
+                          contents: Union[bytes, Iterable[bytes]]) -> str:
+        return await self.run(self.storage.create_file, name, contents)
+
+    async def read_file(self, name: str) -> bytes:
+        return await self.run(self.storage.read_file, name)
+
+    async def delete_file(self, name: str) -> None:
+        return await self.run(self.storage.delete_file, name)
+
+    async def delete_files(self, names: Iterable[str]) -> List[Tuple]:
+        """
+        Deletes files concurrently
+        :param names: iterable of file names
+        :return: list of (name, exception or None) tuples, one per file
+        """
+        names = tuple(names)
+        if self.storage.delete_batch_size > 1:  # bulk delete requests
+            batches = batched(names, self.storage.delete_batch_size)
+            results = await asyncio.gather(
+                *(self.run(self.storage.delete_files, b) for b in batches))
+            return [result for batch in results for result in batch]
+
+        results = await asyncio.gather(
+            *(self.delete_file(name) for name in names),
+            return_exceptions=True,
+        )
+        return [
+            (name, result if isinstance(result, Exception) else None)
+            for name, result in zip(names, results)
+        ]
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+
+
+def run(coroutine):
+    """Runs a coroutine from a (synchronous) click command"""
+    return asyncio.run(coroutine)
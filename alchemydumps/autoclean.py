@@ -1,18 +1,166 @@
 # coding: utf-8
 
+from bisect import bisect_right
 from calendar import isleap, monthrange
-from datetime import date, datetime, timedelta
-from itertools import chain
+from dataclasses import dataclass, fields
+from datetime import date, timedelta
+from typing import List
+
+from alchemydumps.utils import get_numpy
+
+PERIODS = ("hourly", "daily", "weekly", "monthly", "yearly")
+
+
+def days_from_civil(year, month, day):
+    """
+    Number of days since 1970-01-01 of a (proleptic Gregorian) date, using
+    only integer arithmetic so it works on NumPy arrays as well as on ints
+    """
+    year = year - (month <= 2)
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * ((month + 9) % 12) + 2) // 5 + day - 1
+    day_of_era = (year_of_era * 365 + year_of_era // 4 - year_of_era // 100 +
+                  day_of_year)
+    return era * 146097 + day_of_era - 719468
+
+
+def civil_from_days(days):
+    """
+    Inverse of `days_from_civil`
+    :return: (tuple) year, month and day
+    """
+    days = days + 719468
+    era = days // 146097
+    day_of_era = days - era * 146097
+    year_of_era = (day_of_era - day_of_era // 1460 + day_of_era // 36524 -
+                   day_of_era // 146096) // 365
+    day_of_year = day_of_era - (365 * year_of_era + year_of_era // 4 -
+                                year_of_era // 100)
+    shifted_month = (5 * day_of_year + 2) // 153  # March is 0
+    day = day_of_year - (153 * shifted_month + 2) // 5 + 1
+    month = shifted_month + 3 - 12 * (shifted_month >= 10)
+    year = year_of_era + era * 400 + (month <= 2)
+    return year, month, day
+
+
+def civil_to_seconds(value):
+    """Converts a legacy %Y%m%d%H%M%S ID (as an integer) to epoch seconds"""
+    days = days_from_civil(
+        value // 10 ** 10, value // 10 ** 8 % 100, value // 10 ** 6 % 100)
+    return (days * 86400 + value // 10 ** 4 % 100 * 3600 +
+            value // 100 % 100 * 60 + value % 100)
+
+
+def parse_ids(ids: List[str]):
+    """
+    Parses backup IDs once, be them epoch seconds or legacy %Y%m%d%H%M%S
+    :param ids: (list) backup IDs (in string format)
+    :return: epoch seconds (a NumPy int64 array if NumPy is installed,
+    otherwise a list of ints)
+    """
+    numpy = get_numpy()
+    if numpy is None:
+        return [civil_to_seconds(int(value)) if len(value) == 14
+                else int(value) for value in ids]
+    values = numpy.array([int(value) for value in ids], dtype=numpy.int64)
+    legacy = values >= 10 ** 13
+    values[legacy] = civil_to_seconds(values[legacy])
+    return values
+
+
+def get_buckets(seconds, period: str):
+    """
+    Numbers the period (hour, day, week starting on Monday, month or year)
+    each timestamp falls in
+    :param seconds: epoch seconds (an int or a NumPy array)
+    :param period: (str) one of PERIODS
+    """
+    if period == "hourly":
+        return seconds // 3600
+    days = seconds // 86400
+    if period == "daily":
+        return days
+    if period == "weekly":
+        return (days + 3) // 7  # 1970-01-01 was a Thursday
+    year, month, _ = civil_from_days(days)
+    if period == "monthly":
+        return year * 12 + month - 1
+    return year
+
+
+def each(func, values):
+    """Applies `func` to a whole NumPy array, or to each item of a list"""
+    if isinstance(values, list):
+        return [func(value) for value in values]
+    return func(values)
+
+
+def first_of_periods(buckets) -> List[int]:
+    """
+    :param buckets: period numbers of timestamps sorted newest first
+    :return: (list) positions of the most recent timestamp of each period
+    """
+    if isinstance(buckets, list):
+        return [index for index, bucket in enumerate(buckets)
+                if not index or bucket != buckets[index - 1]]
+    if not len(buckets):
+        return []
+    changed = (buckets[1:] != buckets[:-1]).nonzero()[0] + 1
+    return [0] + changed.tolist()
+
+
+@dataclass
+class RetentionPolicy(object):
+    """
+    Grandfather-father-son retention: keeps the `last` most recent backups,
+    plus the most recent backup of each of the `hourly`, `daily`, `weekly`,
+    `monthly` and `yearly` most recent periods having backups
+    """
+
+    last: int = None
+    hourly: int = None
+    daily: int = None
+    weekly: int = None
+    monthly: int = None
+    yearly: int = None
+
+    @classmethod
+    def from_settings(cls, conf) -> "RetentionPolicy":
+        """Reads the `keep_*` settings (e.g. `keep_daily: 7`)"""
+        values = dict()
+        for field in fields(cls):
+            value = getattr(conf, "keep_" + field.name, None)
+            values[field.name] = None if value is None else int(value)
+        return cls(**values)
+
+    def is_empty(self) -> bool:
+        return all(getattr(self, f.name) is None for f in fields(self))
+
+    def select(self, seconds) -> List[int]:
+        """
+        :param seconds: epoch seconds sorted newest first
+        :return: (list) sorted positions of the timestamps to keep
+        """
+        keep = set(range(min(self.last or 0, len(seconds))))
+        for period in PERIODS:
+            count = getattr(self, period)
+            if count:
+                buckets = each(lambda s: get_buckets(s, period), seconds)
+                keep.update(first_of_periods(buckets)[:count])
+        return sorted(keep)
 
 
 class BackupAutoClean(object):
-    def __init__(self, dates=None, today=None):
+    def __init__(self, dates=None, today=None, policy=None):
         """
         :param dates: list of date ids (in string format)
         :param today: datetime object
+        :param policy: RetentionPolicy (defaults to the legacy rules)
         """
-        self.dates = sorted(dates, reverse=True) if dates else []
+        self.dates = list(dates) if dates else []
         self.today = today or date.today()
+        self.policy = policy
         self.white_list = list()
         self.black_list = list()
         self.run()  # feed self.white_list & self.black_list
@@ -33,64 +181,82 @@ class BackupAutoClean(object):
         last_day = first_day - timedelta(days=1)  # last year
         return 366 if isleap(last_day.year) else 365
 
-    def filter_dates(self, dates, period):
-        """
-        :param dates: list of ordered date ids (in string format)
-        :param period: a string for comparison (week, month or year)
-        :return: list of dates containing the most recent dates of each period
-        """
-        reference = datetime.strftime(self.today, "%Y%m%d%H%M%S")
-        method_mapping = {
-            "week": lambda obj: getattr(obj, "isocalendar")()[1],
-            "month": lambda obj: getattr(obj, "month"),
-            "year": lambda obj: getattr(obj, "year"),
-        }
-        for as_string in dates:
-            as_date = datetime.strptime(as_string, "%Y%m%d%H%M%S")
-            comparison = method_mapping.get(period)(as_date)
-            reference_as_date = datetime.strptime(reference, "%Y%m%d%H%M%S")
-            if comparison != method_mapping.get(period)(reference_as_date):
-                reference = as_string
-                yield as_string
+    def get_today(self) -> int:
+        """
+        :return: integer with the number of days since 1970-01-01 of today
+        """
+        return days_from_civil(
+            self.today.year, self.today.month, self.today.day)
+
+    def is_numbered_as_today(self, seconds: int, period: str) -> bool:
+        """
+        Checks if a timestamp falls in a week (month, year) with the same
+        number as today's, whatever its year
+        :param period: (str) weekly, monthly or yearly
+        """
+        number = {
+            "weekly": lambda day: day.isocalendar()[1],
+            "monthly": lambda day: day.month,
+            "yearly": lambda day: day.year,
+        }[period]
+        day = date(*civil_from_days(seconds // 86400))
+        return number(day) == number(self.today)
+
+    def keep_default(self, seconds) -> List[int]:
+        """
+        Legacy rules: keeps all the backups from the last 7 days, then the
+        most recent one of each week of the last month, of each month of the
+        last year and of each year before that
+        :param seconds: epoch seconds sorted newest first
+        :return: (list) sorted positions of the timestamps to keep
+        """
+        today = self.get_today()
+        limits = (
+            today - 7,
+            today - self.get_last_month_length(),
+            today - self.get_last_year_length(),
+        )
+
+        # timestamps are sorted, so each age range is a slice of them
+        ages = each(lambda s: -(s // 86400), seconds)  # ascending
+        ends = [bisect_right(ages, -limit) for limit in limits]
+        ends.append(len(seconds))
+
+        keep = list(range(ends[0]))
+        for start, end, period in zip(ends, ends[1:], PERIODS[2:]):
+            buckets = each(
+                lambda s: get_buckets(s, period), seconds[start:end])
+            first = first_of_periods(buckets)
+            # as they always did, the rules skip the most recent backup of a
+            # range when its week (month, year) number is the one of today,
+            # e.g. June 2017 when cleaning on June 7th, 2018
+            if first and self.is_numbered_as_today(int(seconds[start]),
+                                                    period):
+                first = first[1:]
+            keep.extend(start + index for index in first)
+        return keep
 
     def run(self):
         """
         Feeds `self.white_list` and `self.black_list` with the dates do be kept
-        and deleted (respectively)
-        """
-
-        # get last week, month and year dates
-        last_w = self.today - timedelta(days=7)
-        last_m = self.today - timedelta(days=self.get_last_month_length())
-        last_y = self.today - timedelta(days=self.get_last_year_length())
-
-        # create lists for each time period
-        backups_week = list()
-        backups_month = list()
-        backups_year = list()
-        backups_older = list()
-        for timestamp in self.dates:
-            datetime_ = datetime.strptime(timestamp, "%Y%m%d%H%M%S")
-            date_ = date(datetime_.year, datetime_.month, datetime_.day)
-            if date_ >= last_w:
-                backups_week.append(timestamp)
-            elif date_ >= last_m:
-                backups_month.append(timestamp)
-            elif date_ >= last_y:
-                backups_year.append(timestamp)
-            else:
-                backups_older.append(timestamp)
-
-        # feed white  list
-        self.white_list.extend(
-            chain(
-                backups_week,
-                self.filter_dates(backups_month, "week"),
-                self.filter_dates(backups_year, "month"),
-                self.filter_dates(backups_older, "year"),
-            )
-        )
+        and deleted (respectively), both sorted newest first
+        """
+        seconds = parse_ids(self.dates)
+        if not isinstance(seconds, list):  # a NumPy array
+            order = (-seconds).argsort(kind="stable")
+            seconds = seconds[order]
+        else:
+            order = sorted(range(len(seconds)), key=seconds.__getitem__,
+                           reverse=True)
+            seconds = [seconds[index] for index in order]
+        self.dates = [self.dates[index] for index in order]
+
+        if self.policy is None or self.policy.is_empty():
+            keep = self.keep_default(seconds)
+        else:
+            keep = self.policy.select(seconds)
 
-        # feed black list
-        diff_as_list = list(set(self.dates) - set(self.white_list))
-        self.black_list.extend(sorted(diff_as_list, reverse=True))
+        kept = set(keep)
+        self.white_list.extend(self.dates[index] for index in keep)
+        self.black_list.extend(date_id for index, date_id
+                               in enumerate(self.dates) if index not in kept)
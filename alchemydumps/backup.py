@@ -1,98 +1,160 @@
 # coding: utf-8
+import json
 from dataclasses import dataclass
-from ftplib import FTP, error_perm
-from re import search
-from typing import List, Union
+from datetime import date, datetime
+from decimal import Decimal
+from ftplib import all_errors
+from time import time
+from typing import Dict, List, Union
 
-from arrow import utcnow
-
-from alchemydumps.config import DefaultLoader, config
-from alchemydumps.storage import FtpStorage, LocalStorage
+from alchemydumps.catalog import Catalog
+from alchemydumps.compression import Codec, get_codec
+from alchemydumps.config import DefaultLoader, Settings
+from alchemydumps.ftp_pool import FtpPool, get_pool
+from alchemydumps.storage import (DedupStorage, FtpStorage, LocalStorage,
+                                  S3Storage, Storage, get_storage_class)
 
 
 @dataclass
 class Backup(object):
+    DELTA = "-delta"
+    SEGMENT = "-part"
+    MARKS = "_marks"
+    _index = None
+    _index_of = None
+
     settings_type: str = 'yaml'
     files: list = None
     storage: classmethod = None
     settings: classmethod = DefaultLoader
+    conf: Settings = None
 
     def __post_init__(self):
-        self.conf = self.settings()
-        self.target = self.get_target()
+        if self.conf is None:
+            self.conf = self.settings().load()
         self.ftp = self.ftp_connect()
+        self.target = self.get_target()
+        self.catalog = Catalog(self.target)
 
-    @config
-    def ftp_connect(self) -> Union[FTP, bool]:
-        if c.ftp_server and c.ftp_user:
+    def ftp_connect(self) -> Union[FtpPool, bool]:
+        """
+        Gets the (shared) pool of sessions to the FTP server, checking that
+        a session can be opened
+        """
+        c = self.conf
+        if c.storage in (None, "ftp", "dedup") and c.ftp_server and c.ftp_user:
+            pool = get_pool(c.ftp_server, c.ftp_user, c.ftp_password,
+                            c.ftp_path, tls=c.ftp_tls,
+                            size=c.ftp_pool_size or 4)
             try:
-                ftp = FTP(c.ftp_server, c.ftp_user, c.ftp_password)
-                return self.ftp_change_path(ftp, c.ftp_path)
-            except error_perm:
-                print("==> Couldn't connect to " + c.ftp_server)
+                with pool.session():
+                    pass
+            except all_errors as error:
+                print("==> Couldn't connect to {} ({})".format(c.ftp_server,
+                                                             error))
+                return False
+            return pool
         return False
 
-    @staticmethod
-    def ftp_change_path(ftp, path) -> Union[FTP, bool]:
+    def close_ftp(self) -> None:
         """
-        Changes path at FTP server
-        :param ftp: Python FTP class instance
-        :param path: (str) Path at the FTP server
-        :return: Python FTP class instance or False
+        Releases the FTP server: sessions stay in the pool for the next
+        backups of this process and are closed when it exits
         """
-        change_path = ftp.cwd(path)
-        if not change_path.startswith("250 "):
-            print("==> Path doesn't exist: " + path)
-            ftp.quit()
-            return False
-        return ftp
+        self.ftp = False
 
-    def close_ftp(self) -> None:
+    def get_codec(self) -> Codec:
+        return get_codec(
+            self.conf.compression,
+            level=self.conf.compression_level,
+            threads=self.conf.compression_threads,
+        )
+
+    def get_storage_name(self) -> str:
+        """
+        Gets the name of the storage of the backup files: the `storage`
+        setting or, when it's not set (or set to dedup, which only adds a
+        layer), the FTP server if it's connected or else the S3 bucket if
+        there's one, as in the first versions
+        """
+        c = self.conf
+        if c.storage and c.storage != "dedup":
+            return c.storage
         if self.ftp:
-            self.ftp.quit()
+            return "ftp"
+        return "s3" if c.s3_bucket_name else "local"
 
-    @config
-    def get_target(self) -> Union[FtpStorage, LocalStorage]:
-        if type(self.storage) == FTP:
-            return FtpStorage(self.ftp, backup_path=c.ftp_path)
+    def get_target(self) -> Storage:
+        """
+        :raise ValueError: when the storage chosen can't be used
+        """
+        c = self.conf
+        storage_class = get_storage_class(self.get_storage_name())
+        if storage_class is FtpStorage:
+            if not self.ftp:
+                raise ValueError("No FTP server to store the backups in "
+                                 "(see ftp_server and ftp_user)")
+            blocksize = c.ftp_blocksize or 8192
+            target = FtpStorage(backup_path=c.ftp_path, pool=self.ftp,
+                                codec=self.get_codec(), blocksize=blocksize)
+        elif storage_class is S3Storage:
+            if not c.s3_bucket_name:
+                raise ValueError("No S3 bucket to store the backups in "
+                                 "(see s3_bucket_name)")
+            part_size = c.s3_part_size or 8 * 2 ** 20
+            target = S3Storage(backup_path=c.s3_bucket_path or "",
+                               prefix=str(c.prefix), codec=self.get_codec(),
+                               bucket=c.s3_bucket_name,
+                               endpoint_url=c.s3_bucket_domain or None,
+                               part_size=part_size,
+                               jobs=c.s3_jobs or 4)
         else:
-            return LocalStorage(backup_path=c.local_dir)
+            target = LocalStorage(backup_path=c.local_path,
+                                  local_path=c.local_path,
+                                  codec=self.get_codec())
+        if c.deduplicate or c.storage == "dedup":
+            return DedupStorage(target.backup_path, inner=target,
+                                codec=target.codec)
+        return target
 
     @staticmethod
     def get_timestamp(name):
-        pattern = r"(.*)(-)(?P<timestamp>[\d]{10})(-)(.*)"
-        match = search(pattern, name)
-        return match.group("timestamp") if match else False
+        return Storage.get_timestamp(name)
 
-    def get_timestamps(self, files: List) -> List:
+    def get_index(self) -> Dict:
+        """
+        Groups the backup files by timestamp (the files come from the catalog
+        unless `self.files` is set); the index is built once per list of files
+        """
+        if not self.files:
+            self.files = tuple(self.catalog.get_files())
+        elif not isinstance(self.files, (tuple, list)):
+            self.files = tuple(self.files)
+
+        if self._index_of is not self.files:
+            index = dict()
+            for name in self.files:
+                timestamp = self.target.get_timestamp(name)
+                if timestamp:
+                    index.setdefault(timestamp, list()).append(name)
+            self._index, self._index_of = index, self.files
+        return self._index
+
+    def get_timestamps(self, files: List = None) -> List:
         """
         Gets the different existing timestamp numeric IDs
         :param files: (list) List of backup file names
         :return: (list) Existing timestamps in backup directory
         """
-        if not self.files:
-            self.files = tuple(self.target.get_files())
-
-        different_timestamps = list()
-        for name in self.files:
-            timestamp = self.target.get_timestamp(name)
-            if timestamp and timestamp not in different_timestamps:
-                different_timestamps.append(timestamp)
-        return different_timestamps
+        return list(self.get_index())
 
     def by_timestamp(self, timestamp):
         """
         Gets the list of all backup files with a given timestamp
         :param timestamp: (str) Timestamp to be used as filter
-        :param files: (list) List of backup file names
         :return: (list) The list of backup file names matching the timestamp
         """
-        if not self.files:
-            self.files = tuple(self.target.get_files())
-
-        for name in self.files:
-            if timestamp == self.target.get_timestamp(name):
-                yield name
+        yield from self.get_index().get(timestamp, tuple())
 
     def valid(self, timestamp):
         """Check backup files for the given timestamp"""
@@ -101,13 +163,192 @@ class Backup(object):
         print('==> Invalid id. Use "history" to list existing downloads')
         return False
 
-    def get_name(self, class_name, timestamp=None):
+    @staticmethod
+    def new_timestamp() -> str:
+        """Gets the timestamp ID shared by all the files of a new backup"""
+        return str(int(time()))
+
+    def get_name(self, class_name, timestamp=None, delta=False, part=None):
         """
         Gets a backup file name given the timestamp and the name of the
-        SQLAlchemy mapped class.
+        SQLAlchemy mapped class. Incremental (`delta`) backups of a class get
+        a `-delta` suffix and each segment of a class split in primary key
+        ranges a `-partNNNN` one.
         """
-        timestamp = timestamp or utcnow().timestamp
-        return "{}-{}-{}.gz".format(c.prefix, timestamp, class_name)
+        timestamp = timestamp or self.new_timestamp()
+        suffix = self.DELTA if delta else ""
+        if part is not None:
+            suffix += "{}{:04d}".format(self.SEGMENT, part)
+        extension = self.target.codec.extension
+        return "{}-{}-{}{}{}".format(self.conf.prefix, timestamp, class_name,
+                                     suffix, extension)
+
+    def find_name(self, class_name, timestamp, delta=False):
+        """
+        Gets the name of the existing backup file of a SQLAlchemy mapped class
+        for a given timestamp, whatever the codec (extension) it was saved
+        with, or None if there is no such file.
+        """
+        suffix = self.DELTA if delta else ""
+        stem = "{}-{}-{}{}.".format(self.conf.prefix, timestamp, class_name,
+                                    suffix)
+        for name in self.by_timestamp(timestamp):
+            if name.startswith(stem):
+                return name
+        return None
+
+    def find_files(self, class_name, timestamp, delta=False) -> List:
+        """
+        Gets the backup files of a SQLAlchemy mapped class for a given
+        timestamp: its single file, its segments (in order) or an empty list
+        """
+        name = self.find_name(class_name, timestamp, delta)
+        if name:
+            return [name]
+        suffix = self.DELTA if delta else ""
+        stem = "{}-{}-{}{}{}".format(self.conf.prefix, timestamp, class_name,
+                                     suffix, self.SEGMENT)
+        return sorted(
+            name for name in self.by_timestamp(timestamp)
+            if name.startswith(stem)
+        )
+
+    def find_chain(self, class_name, timestamp):
+        """
+        Gets the backup files needed to restore a SQLAlchemy mapped class as
+        it was at a given timestamp: the most recent full backup up to that
+        timestamp followed by the incremental ones created after it (oldest
+        first, the segments of each backup in order), or an empty list if
+        there is no backup of the class. Each incremental backup follows the
+        backup its marks name as its base (older ones, which don't name it,
+        follow the previous backup of the class).
+        :raise ValueError: if a backup the chain needs was removed
+        """
+        chain = list()
+        previous = sorted(
+            (t for t in self.get_timestamps() if int(t) <= int(timestamp)),
+            key=int, reverse=True)
+        base = None
+        for timestamp_ in previous:
+            if base is not None and timestamp_ != base:
+                if int(timestamp_) < int(base):
+                    break  # the base was removed
+                continue
+            names = self.find_files(class_name, timestamp_)
+            if names:
+                chain.append(names)
+                return [name for names in reversed(chain) for name in names]
+            deltas = self.find_files(class_name, timestamp_, delta=True)
+            if deltas:
+                chain.append(deltas)
+                base = self.get_base(timestamp_)
+            elif base is not None:
+                break  # the base has no file of the class any more
+        if not chain:
+            return list()
+        raise ValueError(
+            "The backups of {} up to {} can't be restored: {} is missing "
+            "(removed?)".format(class_name, timestamp,
+                                "backup {}".format(base) if base else
+                                "the full backup they are based on"))
+
+    def save_marks(self, timestamp, marks: Dict, base=None) -> str:
+        """
+        Saves the high-water marks of the tracking columns (per mapped class
+        name) along with the backup files of a given timestamp, and the
+        timestamp of the backup an incremental one is based on
+        """
+        encoded = {
+            class_name: _encode_mark(mark)
+            for class_name, mark in marks.items()
+        }
+        contents = json.dumps({"version": 2, "base": base,
+                               "marks": encoded}).encode("utf-8")
+        name = self.get_name(self.MARKS, timestamp)
+        path = self.target.create_file(name, contents)
+        self.catalog.add_file(timestamp, name, size=len(contents))
+        return path
+
+    def read_marks(self, timestamp):
+        """
+        Reads the marks file of a backup
+        :return: (tuple) timestamp of the base backup (None for full backups
+        and the ones saved before it was recorded) and dict of marks, or None
+        if the backup has no marks
+        """
+        name = self.find_name(self.MARKS, timestamp)
+        if not name:
+            return None
+        data = json.loads(self.target.read_file(name).decode("utf-8"))
+        base, marks = None, data
+        if data.get("version") == 2:
+            base, marks = data["base"], data["marks"]
+        return base, {
+            class_name: _decode_mark(mark)
+            for class_name, mark in marks.items()
+        }
+
+    def get_base(self, timestamp):
+        """Gets the timestamp of the backup an incremental one is based on"""
+        saved = self.read_marks(timestamp)
+        return saved[0] if saved else None
+
+    def get_bases(self, timestamps) -> List:
+        """
+        Gets the backups the incremental ones among `timestamps` are based
+        on, and the backups those are based on, and so on (older incremental
+        backups, which don't name their base, are based on the previous one)
+        :param timestamps: backup IDs
+        :return: (list) IDs of the existing backups needed, not in
+        `timestamps`, most recent first
+        """
+        existing = sorted(self.get_timestamps(), key=int)
+        pending, seen = list(timestamps), set(timestamps)
+        bases = list()
+        while pending:
+            timestamp = pending.pop()
+            if not any(self.DELTA in name
+                       for name in self.by_timestamp(timestamp)):
+                continue
+            base = self.get_base(timestamp)
+            if base is None and timestamp in existing:
+                position = existing.index(timestamp)
+                base = existing[position - 1] if position else None
+            if base is not None and base in existing and base not in seen:
+                seen.add(base)
+                bases.append(base)
+                pending.append(base)
+        return sorted(bases, key=int, reverse=True)
+
+    def get_last_marks(self):
+        """
+        Gets the most recent backup with high-water marks
+        :return: (tuple) timestamp and dict of marks, or (None, {})
+        """
+        for timestamp in sorted(self.get_timestamps(), key=int, reverse=True):
+            saved = self.read_marks(timestamp)
+            if saved:
+                return timestamp, saved[1]
+        return None, dict()
+
+
+def _encode_mark(value) -> Dict:
+    """Encodes a high-water mark as JSON, keeping dates and decimals typed"""
+    if isinstance(value, date):  # datetime is a subclass of date
+        return {"type": type(value).__name__, "value": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"type": "Decimal", "value": str(value)}
+    return {"type": None, "value": value}
+
+
+def _decode_mark(mark: Dict):
+    decoders = {
+        "datetime": datetime.fromisoformat,
+        "date": date.fromisoformat,
+        "Decimal": Decimal,
+    }
+    decode = decoders.get(mark["type"])
+    return decode(mark["value"]) if decode else mark["value"]
 
 
 if __name__ == "__main__":
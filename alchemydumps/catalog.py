@@ -0,0 +1,134 @@
+# coding: utf-8
+
+import json
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Dict, Generator, List, Union
+
+from alchemydumps.storage import Storage
+
+
+@dataclass
+class Catalog(object):
+    """
+    Index of the backups kept in a storage: a single file mapping each backup
+    ID to its files (with their sizes, row counts and checksums), so listing
+    and cleaning backups don't need to list the storage. It is created from
+    a listing of the storage the first time it's needed.
+
+    Each save re-reads the catalog file and applies the files this instance
+    added or removed to it, so commands running at the same time (e.g.
+    `create` and `autoclean`) keep each other's changes, unless they save
+    at the very same moment.
+    """
+
+    storage: Storage
+    name: str = "alchemydumps-catalog.json"
+    backups: Dict = None
+    lock: Lock = field(default_factory=Lock)
+    added: Dict = field(default_factory=dict)
+    removed: set = field(default_factory=set)
+
+    VERSION = 1
+
+    def load(self) -> Dict:
+        """Loads the catalog (once), rebuilding it if it doesn't exist"""
+        if self.backups is not None:
+            return self.backups
+
+        backups = self.read()
+        if backups is None:
+            self.rebuild()
+        else:
+            self.backups = backups
+        return self.backups
+
+    def read(self) -> Union[Dict, None]:
+        """
+        Reads the catalog file (None if there's none). The file is read
+        first and only looked for when that fails, so a storage wrongly
+        saying it's missing can't get an existing catalog replaced.
+        """
+        try:
+            data = self.storage.read_file(self.name)
+        except Exception:
+            if self.storage.has_file(self.name):
+                raise
+            return None
+        return json.loads(data)["backups"]
+
+    def rebuild(self) -> None:
+        """Recreates the catalog from a listing of the storage"""
+        self.backups = dict()
+        for name in self.storage.get_files():
+            self.add_file(self.storage.get_timestamp(name), name)
+        self.save(merge=False)
+
+    def save(self, merge: bool = True) -> None:
+        """
+        Replaces the catalog file atomically (write, then rename)
+        :param merge: (bool) applies the changes of this instance to the
+        catalog file as it is now, rather than replacing it
+        """
+        current = self.read() if merge else None
+        with self.lock:
+            if current is not None:
+                for name in self.removed:
+                    self.drop(current, name)
+                for name, (timestamp, details) in self.added.items():
+                    files = current.setdefault(timestamp, dict())
+                    files.setdefault(name, dict()).update(details)
+                self.backups = current
+            self.added.clear()
+            self.removed.clear()
+            contents = {"version": self.VERSION, "backups": self.backups}
+            data = json.dumps(contents, sort_keys=True).encode("utf-8")
+        tmp = self.name + ".tmp"
+        self.storage.create_file(tmp, data)
+        self.storage.rename_file(tmp, self.name)
+
+    def add_file(self, timestamp: str, name: str, **details) -> None:
+        """
+        Adds (or updates) a file of a backup
+        :param timestamp: (str) backup ID
+        :param name: (str) file name
+        :param details: size, rows, sha256 etc. of the file, to which the
+        storage adds its own (e.g. the chunks of a deduplicated file)
+        """
+        details = dict(self.storage.get_details(name), **details)
+        backups = self.load()
+        with self.lock:
+            files = backups.setdefault(timestamp, dict())
+            files.setdefault(name, dict()).update(details)
+            self.added[name] = (timestamp, files[name])
+            self.removed.discard(name)
+
+    def remove_file(self, name: str) -> None:
+        backups = self.load()
+        with self.lock:
+            self.drop(backups, name)
+            self.added.pop(name, None)
+            self.removed.add(name)
+
+    @staticmethod
+    def drop(backups: Dict, name: str) -> None:
+        """Removes a file from a mapping of backup IDs to files"""
+        for timestamp, files in tuple(backups.items()):
+            if files.pop(name, None) is not None and not files:
+                del backups[timestamp]
+
+    def get_timestamps(self) -> List:
+        """Gets the backup IDs (most recent first)"""
+        return sorted(self.load(), key=int, reverse=True)
+
+    def get_files(self, timestamp: str = None) -> Generator:
+        """Gets the file names of a backup ID (or of every backup)"""
+        backups = self.load()
+        timestamps = (timestamp,) if timestamp else tuple(backups)
+        for timestamp_ in timestamps:
+            yield from sorted(backups.get(timestamp_, dict()))
+
+    def get_details(self, name: str) -> Dict:
+        """Gets the details (size, rows, sha256…) recorded for a file"""
+        timestamp = self.storage.get_timestamp(name)
+        return self.load().get(timestamp, dict()).get(name, dict())
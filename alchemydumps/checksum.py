@@ -0,0 +1,100 @@
+# coding: utf-8
+
+import json
+from dataclasses import dataclass
+from functools import partial
+from hashlib import blake2b
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from sqlalchemy import inspect
+
+from alchemydumps.formats import CopyFormat, load_chunks
+from alchemydumps.stream import Digest, IterReader, decode_frames
+
+MASK_64 = 2 ** 64 - 1
+
+
+def canonical(value) -> str:
+    """Encodes a column value the same way whatever the format it came from"""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True, default=str)
+    return CopyFormat.encode_value(value)
+
+
+@dataclass
+class RowChecksum(object):
+    """
+    Checksum of the content of rows that doesn't depend on their order: the
+    sum (modulo 2 ** 64) of a hash of each row, its values (in the order of
+    the table columns) encoded as COPY text. The checksums of the segments of
+    a table, or of ranges of it read in parallel, add up to the checksum of
+    the whole table.
+    """
+
+    keys: Tuple = ()
+    rows: int = 0
+    total: int = 0
+
+    @classmethod
+    def of(cls, model, columns: List = None) -> "RowChecksum":
+        """Gets an empty checksum of (some of) the columns of a mapped class"""
+        if columns is None:
+            columns = inspect(model).local_table.columns
+        return cls(tuple(column.key for column in columns))
+
+    def add(self, values: Sequence) -> None:
+        """Adds a row given its values in the order of the table columns"""
+        line = "\t".join(canonical(value) for value in values)
+        digest = blake2b(line.encode("utf-8"), digest_size=8).digest()
+        self.total = (self.total + int.from_bytes(digest, "big")) & MASK_64
+        self.rows += 1
+
+    def update(self, rows: Iterable[Sequence]) -> None:
+        for values in rows:
+            self.add(values)
+
+    def update_dicts(self, rows: Iterable[Dict]) -> None:
+        """Adds rows given as dicts of column values (see `get_values`)"""
+        keys = self.keys
+        for values in rows:
+            self.add([values[key] for key in keys if key in values])
+
+    def combine(self, other: "RowChecksum") -> "RowChecksum":
+        return RowChecksum(self.keys, self.rows + other.rows,
+                           (self.total + other.total) & MASK_64)
+
+    def hexdigest(self) -> str:
+        return "{:016x}".format(self.total)
+
+
+def verify_file(alchemy, storage, model, name: str,
+                details: Dict) -> Tuple[List[str], RowChecksum]:
+    """
+    Reads a backup file back, decompressing and decoding it as a stream
+    without touching the database, and compares it with the details the
+    catalog recorded when it was created (size and sha256 of the framed
+    bytes, number of rows and row checksum), when there are any
+    :param alchemy: AlchemyDumpsDatabase instance
+    :param storage: storage holding the file
+    :param model: SQLAlchemy mapped class the file holds rows of
+    :return: (tuple) list of the mismatches found and checksum of the rows
+    """
+    checksum = RowChecksum.of(model)
+    with storage.open_file(name) as handler:
+        digest = Digest(iter(partial(handler.read, 2 ** 16), b""))
+        with IterReader(digest) as reader:
+            rows = load_chunks(alchemy, model, decode_frames(reader))
+            checksum.update_dicts(map(alchemy.get_values, rows))
+
+    found = {
+        "size": digest.size,
+        "sha256": digest.hexdigest(),
+        "rows": checksum.rows,
+        "checksum": checksum.hexdigest(),
+    }
+    problems = [
+        "{} is {}, expected {}".format(key, value, details[key])
+        for key, value in found.items()
+        if details.get(key) is not None and details[key] != value
+    ]
+    return problems, checksum
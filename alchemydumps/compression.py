@@ -0,0 +1,108 @@
+# coding: utf-8
+
+import gzip
+from typing import BinaryIO, Union
+
+
+class Codec(object):
+    """
+    Compression used for backup files. `open` accepts a file name or a file
+    object, just like `gzip.open` does.
+    """
+
+    name = None
+    extension = None
+    magic = None
+
+    def __init__(self, level=None, threads=None):
+        self.level = level
+        self.threads = threads
+
+    def open(self, target: Union[str, BinaryIO], mode: str = "rb") -> BinaryIO:
+        raise NotImplementedError
+
+
+class GzipCodec(Codec):
+    name = "gzip"
+    extension = ".gz"
+    magic = b"\x1f\x8b"
+
+    def open(self, target, mode="rb"):
+        level = 9 if self.level is None else self.level
+        return gzip.open(target, mode, compresslevel=level)
+
+
+class ZstdCodec(Codec):
+    name = "zstd"
+    extension = ".zst"
+    magic = b"\x28\xb5\x2f\xfd"
+
+    def open(self, target, mode="rb"):
+        try:  # imported when used, so other commands start faster
+            import zstandard
+        except ImportError:  # optional dependency: AlchemyDumps[zstd]
+            raise RuntimeError(
+                "The zstd codec requires zstandard (pip install zstandard)")
+        if "w" in mode:
+            compressor = zstandard.ZstdCompressor(
+                level=3 if self.level is None else self.level,
+                threads=self.threads or 0)  # -1 uses every CPU
+            return zstandard.open(target, mode, cctx=compressor)
+        return zstandard.open(target, mode)
+
+
+class Lz4Codec(Codec):
+    name = "lz4"
+    extension = ".lz4"
+    magic = b"\x04\x22\x4d\x18"
+
+    def open(self, target, mode="rb"):
+        try:  # imported when used, so other commands start faster
+            import lz4.frame as lz4_frame
+        except ImportError:  # optional dependency: AlchemyDumps[lz4]
+            raise RuntimeError("The lz4 codec requires lz4 (pip install lz4)")
+        return lz4_frame.open(
+            target, mode, compression_level=self.level or 0)
+
+
+class NoCodec(Codec):
+    name = "none"
+    extension = ".bin"
+
+    def open(self, target, mode="rb"):
+        if isinstance(target, str):
+            return open(target, mode)
+        return target
+
+
+CODECS = {cls.name: cls for cls in (GzipCodec, ZstdCodec, Lz4Codec, NoCodec)}
+
+
+def get_codec(name=None, level=None, threads=None) -> Codec:
+    """Gets a codec by its name (default: gzip)"""
+    try:
+        return CODECS[name or GzipCodec.name](level, threads)
+    except KeyError:
+        raise ValueError("Unknown compression codec: {}".format(name))
+
+
+def detect_codec(head: bytes) -> Codec:
+    """Gets the codec of a file given its first bytes"""
+    for cls in (GzipCodec, ZstdCodec, Lz4Codec):
+        if head.startswith(cls.magic):
+            return cls()
+    return NoCodec()
+
+
+def open_file(target: Union[str, BinaryIO]) -> BinaryIO:
+    """Opens a (compressed) backup file for reading, whatever its codec"""
+    if isinstance(target, str):
+        with open(target, "rb") as handler:
+            head = handler.read(4)
+    elif hasattr(target, "peek"):  # streams that can't seek, e.g. PipeReader
+        head = target.peek(4)[:4]
+    else:
+        position = target.tell()
+        head = target.read(4)
+        target.seek(position)
+    return detect_codec(head).open(target, "rb")
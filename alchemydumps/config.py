@@ -1,60 +1,198 @@
-from os import path as op, getcwd
-from dataclasses import dataclass
-from pathlib import Path
-from pyclbr import readmodule
+import json
+from os import environ, path as op, getcwd, stat
+from dataclasses import dataclass, field, fields
+from threading import Lock
+from types import MappingProxyType
+from typing import Mapping, Tuple
 
-from contextlib import suppress
-from functools import wraps
+from alchemydumps.compression import CODECS
+from alchemydumps.storage import get_storage_class
 
-from yaml import dump, load
-from yamlordereddictloader import Loader, SafeDumper
+ENV_PREFIX = "ALCHEMYDUMPS_"
+TRUE = ("1", "true", "yes", "on")
+FALSE = ("", "0", "false", "no", "off")
+
+# parsed settings files by path, along with their modification time and size
+_files = dict()
+_files_lock = Lock()
+
+
+def read_yaml(path: str) -> dict:
+    """Reads a YAML file keeping the order of mappings"""
+    from yaml import load  # only loaded along with the settings
+    from yamlordereddictloader import Loader
+
+    with open(path, "r") as f:
+        return load(f, Loader=Loader)
+
+
+def read_settings_file(path: str) -> Mapping:
+    """
+    Parses a settings file once for as long as it isn't modified (its
+    modification time and size are checked on each call)
+    :param path: (str) path of the YAML file
+    :return: read-only mapping of raw values (empty if there's no file)
+    """
+    path = op.abspath(path)
+    try:
+        info = stat(path)
+    except FileNotFoundError:
+        return MappingProxyType(dict())
+    version = (info.st_mtime_ns, info.st_size)
+    with _files_lock:
+        cached = _files.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    values = MappingProxyType(dict(read_yaml(path) or dict()))
+    with _files_lock:
+        _files[path] = (version, values)
+    return values
+
+
+@dataclass(frozen=True)
+class Settings(object):
+    """
+    Validated settings (see settings.yml). They can't be changed once
+    loaded, so the threads of a command share them safely.
+    """
+
+    storage: str = None  # local, ftp, s3 or dedup (default: see Backup)
+    local_path: str = "alchemydumps-backup"
+    prefix: str = "db-bkp"
+    ftp_server: str = None
+    ftp_user: str = None
+    ftp_password: str = None
+    ftp_path: str = None
+    ftp_blocksize: int = None
+    ftp_tls: bool = False
+    ftp_pool_size: int = None
+    s3_bucket_name: str = None
+    s3_bucket_domain: str = None
+    s3_bucket_path: str = None
+    s3_part_size: int = None
+    s3_jobs: int = None
+    format: str = None
+    compression: str = None
+    compression_level: int = None
+    compression_threads: int = None
+    memory_limit: int = None
+    deduplicate: bool = False
+    split_rows: int = None
+    include: Tuple = ()
+    exclude: Tuple = ()
+    filters: Mapping = field(default_factory=lambda: MappingProxyType({}))
+    columns: Mapping = field(default_factory=lambda: MappingProxyType({}))
+    keep_last: int = None
+    keep_hourly: int = None
+    keep_daily: int = None
+    keep_weekly: int = None
+    keep_monthly: int = None
+    keep_yearly: int = None
+    metrics_textfile: str = None
+    statsd_address: str = None
+
+    @classmethod
+    def names(cls) -> Tuple:
+        return tuple(f.name for f in fields(cls))
+
+    @classmethod
+    def from_mapping(cls, values: Mapping) -> "Settings":
+        """
+        Validates raw values (from a YAML file or environment variables),
+        converting each one to the type of its setting; empty values keep
+        the default
+        :raise ValueError: on unknown settings or invalid values
+        """
+        types = {f.name: f.type for f in fields(cls)}
+        unknown = set(values) - set(types)
+        if unknown:
+            raise ValueError("Unknown settings: {}".format(
+                ", ".join(sorted(unknown))))
+
+        converted = dict()
+        for name, value in values.items():
+            if value is None or value == "":
+                continue
+            try:
+                converted[name] = cls.convert(types[name], value)
+            except (TypeError, ValueError) as error:
+                raise ValueError("Invalid setting {}: {!r} ({})".format(
+                    name, value, error))
+        settings = cls(**converted)
+        settings.validate()
+        return settings
+
+    @staticmethod
+    def convert(type_, value):
+        if type_ is bool:
+            if isinstance(value, str):
+                if value.lower() not in TRUE + FALSE:
+                    raise ValueError("not a boolean")
+                return value.lower() in TRUE
+            return bool(value)
+        if type_ is int:
+            if isinstance(value, bool):
+                raise TypeError("not an integer")
+            return int(value)
+        if type_ is str:
+            return str(value)
+        if isinstance(value, str):  # from an environment variable
+            value = (json.loads(value) if type_ is Mapping
+                     else value.split(","))
+        if type_ is Tuple:
+            return tuple(str(item).strip() for item in value)
+        return MappingProxyType({
+            str(key): item if isinstance(item, str) else tuple(item)
+            for key, item in dict(value).items()
+        })
+
+    def validate(self) -> None:
+        get_storage_class(self.storage)
+        if self.compression and self.compression not in CODECS:
+            raise ValueError("Unknown compression: {}".format(
+                self.compression))
 
 
 @dataclass
 class DefaultLoader(object):
-    storage: str = 'local'
-    settings_file: str = op.join(getcwd(), "settings.yml")
-
-    def __post_init__(self):
-        self.configs = self.load_settings()
-        self.add_storage_adaptor(self.configs['storage'])
-        for k, v in self.configs.items():
-            setattr(self, k, v)
-
-    def load_settings(self) -> dict:
-        with suppress(FileExistsError):
-            Path(self.settings_file).touch()  # touched this way - not `w+`
-        with open(self.settings_file, "r") as f:
-            settings = load(f, Loader=Loader)
-        return settings
+    """
+    Loads settings.yml (from the working directory), overridden by the
+    `ALCHEMYDUMPS_` environment variables (e.g. `ALCHEMYDUMPS_FTP_SERVER`)
+    """
+
+    settings_file: str = None
+    environ: Mapping = None
+
+    def load(self) -> Settings:
+        values = dict(self.load_settings())
+        values.update(self.load_env())
+        return Settings.from_mapping(values)
+
+    def load_settings(self) -> Mapping:
+        return read_settings_file(
+            self.settings_file or op.join(getcwd(), "settings.yml"))
+
+    def load_env(self) -> dict:
+        variables = environ if self.environ is None else self.environ
+        return {
+            name: variables[ENV_PREFIX + name.upper()]
+            for name in Settings.names()
+            if ENV_PREFIX + name.upper() in variables
+        }
 
-    def add_storage_adaptor(obj, storage_adapter):
-        available_adaptors = list(readmodule("alchemydumps.storage"))
-        adaptor_name = f'{storage_adapter.title()}Storage'
-        adaptor = [a for a in available_adaptors if a == adaptor_name][0]
-        base_cls = obj.__class__
-        base_cls_name = obj.__class__.__name__
-        obj.__class__ = type(base_cls_name, (base_cls, adaptor), {})
 
 @dataclass
 class YamlLoader(DefaultLoader):
-    def load_settings(self) -> dict:
-        with suppress(FileExistsError):
-            Path(self.settings_file).touch()  # touched this way - not `w+`
-        with open(self.settings_file, "r") as f:
-            settings = load(f, Loader=Loader)
-        return settings
+    """Loads settings.yml only"""
+
+    def load_env(self) -> dict:
+        return dict()
 
 
 @dataclass
 class EnvLoader(DefaultLoader):
-    def load_settings(self):
-        pass
-
-
-def config(func):
-    def wrapper(self, *args, **kwargs):
-        func.__globals__['c'] = self.conf
-        func(self, *args, **kwargs)
+    """Loads the `ALCHEMYDUMPS_` environment variables only"""
 
-    return wrapper
+    def load_settings(self) -> Mapping:
+        return dict()
@@ -1,13 +1,35 @@
 # coding: utf-8
 
+import gc
+from contextlib import contextmanager
+from fnmatch import fnmatchcase
+from functools import partial
+from importlib import import_module
+from io import BytesIO
+from itertools import islice
+from re import match
+from tempfile import NamedTemporaryFile
+from threading import Thread
+
 from flask import current_app
+from sqlalchemy import func, insert, inspect, select, text
+from sqlalchemy.sql import column as column_clause, table as table_clause
+from sqlalchemy.exc import DBAPIError, IntegrityError, InvalidRequestError
 from sqlalchemy.ext.serializer import dumps, loads
+from sqlalchemy.orm import Session
+from sqlalchemy.types import ARRAY, DateTime
 from dataclasses import dataclass, field
-from typing import List, Any
+from typing import Callable, Dict, Generator, Iterable, List, Any
 
 # from sqlalchemy import Column, Integer, MetaData, create_engine, inspect
 # from sqlalchemy.exc import IntegrityError, InvalidRequestError, NoInspectionAvailable
 from sqlalchemy.ext.declarative import declarative_base, declared_attr
+
+from alchemydumps.checksum import RowChecksum
+from alchemydumps.formats import CopyFormat
+from alchemydumps.metrics import Metrics, get_rss
+from alchemydumps.stream import PipeReader
+from alchemydumps.utils import batched
 # from sqlalchemy.ext.serializer import dumps as sdumps, loads as sloads
 # from sqlalchemy.orm import Query, sessionmaker, scoped_session
 # from sqlalchemy.orm.exc import UnmappedInstanceError
@@ -16,11 +38,23 @@ from sqlalchemy.ext.declarative import declarative_base, declared_attr
 
 @dataclass
 class AlchemyDumpsDatabase(object):
-    do_not_backup: List = field(default_factory=list())
-    models: List = field(default_factory=list())
+    do_not_backup: List = field(default_factory=list)
+    include: List = field(default_factory=list)
+    filters: Dict = field(default_factory=dict)
+    columns: Dict = field(default_factory=dict)
+    models: List = field(default_factory=list)
     session: Any = None
     is_flask: bool = True
     base_class: declarative_base() = None
+    chunk_size: int = 1000
+    batch_size: int = 1000
+    row_counts: Dict = field(default_factory=dict)
+    checksums: Dict = field(default_factory=dict)
+    stream_results: bool = False
+    fast: bool = False
+    metrics: Metrics = field(default_factory=Metrics)
+    low_memory: bool = False
+    memory_limit: int = None
 
     @staticmethod
     def db():
@@ -29,6 +63,7 @@ class AlchemyDumpsDatabase(object):
     def get_mapped_classes(self):
         """Gets a list of SQLALchemy mapped classes"""
         db = self.db()
+        self.models = list()
         self.add_subclasses(db.Model)  # change to allow other declarative_bases
         return self.models
 
@@ -37,19 +72,715 @@ class AlchemyDumpsDatabase(object):
         if model.__subclasses__():
             for submodel in model.__subclasses__():
                 self.add_subclasses(submodel)
-        else:
+        elif self.is_selected(model):
             self.models.append(model)
 
+    def is_selected(self, model) -> bool:
+        """
+        Checks a mapped class against `include` (if any) and `do_not_backup`,
+        lists of class or table names, or globs matching them
+        """
+        names = (model.__name__, inspect(model).local_table.name)
+
+        def matches(patterns):
+            return any(fnmatchcase(name, pattern)
+                       for pattern in patterns for name in names)
+
+        if self.include and not matches(self.include):
+            return False
+        return not matches(self.do_not_backup)
+
+    def get_filters(self, model) -> List:
+        """
+        Gets the criteria of the SQL `WHERE` condition set in `filters` for a
+        mapped class (by class name), so only matching rows are read
+        """
+        condition = self.filters.get(model.__name__)
+        return [text(condition)] if condition else list()
+
+    def get_columns(self, model) -> List:
+        """
+        Gets the table columns read from a mapped class: the ones named in
+        `columns` for it (plus its primary key) or all of them
+        """
+        table = inspect(model).local_table
+        names = self.columns.get(model.__name__)
+        if not names:
+            return list(table.columns)
+        unknown = set(names) - {column.name for column in table.columns}
+        if unknown:
+            raise ValueError("Unknown columns of {}: {}".format(
+                model.__name__, ", ".join(sorted(unknown))))
+        return [column for column in table.columns
+                if column.name in names or column.primary_key]
+
+    def get_levels(self) -> List[List]:
+        """
+        Groups the mapped classes by foreign key depth, so that the classes in
+        a group only reference tables from previous groups and the classes
+        within the same group can be restored concurrently
+        """
+        db = self.db()
+        depths = dict()
+        for table in db.metadata.sorted_tables:
+            parents = {
+                fk.column.table
+                for fk in table.foreign_keys
+                if fk.column.table is not table
+            }
+            depths[table] = 1 + max(
+                (depths.get(parent, 0) for parent in parents), default=-1)
+
+        levels = dict()
+        for model in self.get_mapped_classes():
+            depth = depths.get(inspect(model).local_table, 0)
+            levels.setdefault(depth, list()).append(model)
+        return [levels[depth] for depth in sorted(levels)]
+
+    @staticmethod
+    def get_tracking_column(model):
+        """
+        Gets the column a mapped class declares (as the name of a mapped
+        attribute in `__alchemydumps_track__`) to track changes, such as an
+        `updated_on` timestamp or an ever-growing primary key, or None
+        """
+        key = getattr(model, "__alchemydumps_track__", None)
+        if not key:
+            return None
+        return inspect(model).get_property(key).columns[0]
+
+    def get_mark(self, model):
+        """Gets the high-water mark (max value) of the tracking column"""
+        db = self.db()
+        column = self.get_tracking_column(model)
+        if column is None:
+            return None
+        return db.session.execute(select(func.max(column))).scalar()
+
+    def get_changes_criteria(self, model, mark) -> List:
+        """
+        Gets the criteria selecting the rows changed since a high-water mark.
+        Rows matching the mark itself are included (they could have changed
+        within the same tick); restoring them twice is harmless. Deleted rows
+        can't be tracked this way.
+        """
+        column = self.get_tracking_column(model)
+        if column is None or mark is None:
+            return list()
+        if (isinstance(column.type, DateTime) and
+                self.get_dialect(model) == "sqlite"):
+            # SQLite compares datetimes as text, and `CURRENT_TIMESTAMP`
+            # stores them without the microseconds a bound datetime has:
+            # compare with the mark truncated to the second
+            return [column >= func.datetime(mark)]
+        return [column >= mark]
+
+    def count_rows(self, model, criteria=None) -> int:
+        db = self.db()
+        query = select(func.count()).select_from(inspect(model).local_table)
+        if criteria:
+            query = query.where(*criteria)
+        return db.session.execute(query).scalar()
+
+    def split_ranges(self, model, segments: int) -> List[List]:
+        """
+        Splits a mapped class in (at most) `segments` ranges of its primary
+        key: evenly between its min and max values for integer keys, at its
+        quantiles (found with OFFSET) otherwise. The first and the last ranges
+        are open, so the ranges cover every row.
+        :param model: SQLAlchemy mapped class
+        :param segments: (int) number of ranges
+        :return: list of criteria (lists of SQL expressions), one per range; a
+        single empty list if the primary key is composite or the table empty
+        """
+        return self.get_ranges(model, self.split_bounds(model, segments))
+
+    def split_bounds(self, model, segments: int) -> List:
+        """
+        Gets the primary key values splitting a mapped class in (at most)
+        `segments` ranges (see `split_ranges`)
+        :return: list of the bounds between ranges (empty when there's no
+        split)
+        """
+        db = self.db()
+        primary_key = inspect(model).primary_key
+        if segments < 2 or len(primary_key) != 1:
+            return list()
+
+        column = primary_key[0]
+        query = select(func.min(column), func.max(column))
+        low, high = db.session.execute(query).one()
+        if low is None:
+            return list()
+
+        try:
+            is_integer = column.type.python_type is int
+        except NotImplementedError:
+            is_integer = False
+        if is_integer:
+            step = (high - low) // segments + 1
+            bounds = [low + step * n for n in range(1, segments)]
+            bounds = [bound for bound in bounds if bound <= high]
+        else:
+            count = self.count_rows(model)
+            bounds = list()
+            for n in range(1, segments):
+                query = select(column).order_by(column).limit(1)
+                query = query.offset(count * n // segments)
+                bound = db.session.execute(query).scalar()
+                if bound is not None and bound > (bounds or [low])[-1]:
+                    bounds.append(bound)
+        return bounds
+
+    @staticmethod
+    def get_ranges(model, bounds: List) -> List[List]:
+        """
+        Turns primary key bounds (see `split_bounds`) into criteria
+        :return: list of criteria (lists of SQL expressions), one per range
+        """
+        if not bounds:
+            return [list()]
+        column = inspect(model).primary_key[0]
+        ranges, lower = list(), None
+        for bound in bounds + [None]:
+            criteria = list()
+            if lower is not None:
+                criteria.append(column >= lower)
+            if bound is not None:
+                criteria.append(column < bound)
+            ranges.append(criteria)
+            lower = bound
+        return ranges
+
     def get_data(self):
         """Go through every mapped class and dumps the data"""
         db = self.db()
         data = dict()
         for model in self.get_mapped_classes():
             query = db.session.query(model)
-            data[model.__name__] = dumps(query.all())
+            with self.metrics.phase("query"):
+                rows = query.all()
+            with self.metrics.phase("serialize"):
+                data[model.__name__] = dumps(rows)
         return data
 
     def parse_data(self, contents):
         """Loads a dump and convert it into rows """
         db = self.db()
-        return loads(contents, db.metadata, db.session)
+        with self.metrics.phase("parse"):
+            return loads(contents, db.metadata, db.session)
+
+    def get_dialect(self, model=None) -> str:
+        """Gets the name of the dialect of the engine bound to the session"""
+        db = self.db()
+        mapper = inspect(model) if model is not None else None
+        return db.session.get_bind(mapper=mapper).dialect.name
+
+    @contextmanager
+    def export_snapshot(self) -> Generator:
+        """
+        Opens a repeatable read transaction whose snapshot can be shared with
+        other sessions (see `begin_snapshot`). Only PostgreSQL can export
+        snapshots; with any other dialect this yields None.
+        """
+        db = self.db()
+        if self.get_dialect() != "postgresql":
+            yield None
+            return None
+
+        connection = db.engine.connect().execution_options(
+            isolation_level="REPEATABLE READ")
+        transaction = connection.begin()
+        try:
+            query = text("SELECT pg_export_snapshot()")
+            yield connection.execute(query).scalar()
+        finally:
+            transaction.rollback()
+            connection.close()
+
+    def begin_snapshot(self, snapshot=None) -> None:
+        """
+        Starts a read-only transaction with a stable view of the data in the
+        current session: repeatable read (serializable on SQLite), importing
+        the given exported snapshot on PostgreSQL. It must be called before
+        the session runs any query and lasts until `end_snapshot`.
+        """
+        db = self.db()
+        dialect = self.get_dialect()
+        level = "SERIALIZABLE" if dialect == "sqlite" else "REPEATABLE READ"
+        connection = db.session.connection(
+            execution_options={"isolation_level": level})
+        if dialect in ("postgresql", "mysql"):
+            db.session.execute(text("SET TRANSACTION READ ONLY"))
+        if snapshot and dialect == "postgresql":
+            if not match(r"^[0-9A-Fa-f-]+$", snapshot):
+                raise ValueError("Invalid snapshot ID: {}".format(snapshot))
+            query = "SET TRANSACTION SNAPSHOT '{}'".format(snapshot)
+            db.session.execute(text(query))
+        if dialect == "sqlite":  # pysqlite doesn't BEGIN before a SELECT
+            driver_connection = connection.connection.driver_connection
+            if not driver_connection.in_transaction:
+                connection.exec_driver_sql("BEGIN")
+
+    def end_snapshot(self) -> None:
+        """Ends the read transaction started with `begin_snapshot`"""
+        db = self.db()
+        db.session.rollback()
+
+    def iter_rows(self, model, chunk_size=None, core=False,
+                  criteria=None) -> Generator:
+        """
+        Pages through a mapped class yielding lists of at most `chunk_size`
+        rows. Keyset pagination on the primary key is used when it is a single
+        column, otherwise (or with `stream_results`, when a snapshot keeps the
+        data stable) a single query is streamed through a server-side cursor
+        with `yield_per`.
+        :param model: SQLAlchemy mapped class
+        :param chunk_size: (int) number of rows per list
+        :param core: (bool) fetch plain rows of column values (in the order of
+        the table columns) with a Core select instead of mapped instances
+        :param criteria: list of SQL expressions filtering the rows
+        """
+        db = self.db()
+        chunk_size = chunk_size or self.chunk_size
+        mapper = inspect(model)
+        primary_key = mapper.primary_key
+        if core:
+            columns = self.get_columns(model)
+            query = select(*columns).order_by(*primary_key)
+        else:
+            query = db.session.query(model).order_by(*primary_key)
+        if criteria:
+            query = query.filter(*criteria)
+
+        if self.stream_results or len(primary_key) != 1:
+            if core:
+                options = {"stream_results": True,
+                           "max_row_buffer": chunk_size}
+                rows = db.session.execute(query.execution_options(**options))
+            else:
+                rows = query.yield_per(chunk_size)
+            yield from self.metrics.timed("query", batched(rows, chunk_size))
+            return None
+
+        column = primary_key[0]
+        if core:
+            index = columns.index(column)
+            get_last = lambda row: row[index]  # noqa
+        else:
+            key = mapper.get_property_by_column(column).key
+            get_last = lambda row: getattr(row, key)  # noqa
+
+        last = None
+        while True:
+            page = query if last is None else query.filter(column > last)
+            page = page.limit(chunk_size)
+            with self.metrics.phase("query"):
+                chunk = db.session.execute(page).all() if core else page.all()
+            if not chunk:
+                return None
+            last = get_last(chunk[-1])
+            yield chunk
+            if len(chunk) < chunk_size:
+                return None
+
+    def start_dump(self, model) -> RowChecksum:
+        """
+        Resets the row count (see `add_rows`) and the checksum of the rows
+        dumped of a mapped class, which the caller updates
+        """
+        self.row_counts[model.__name__] = 0
+        checksum = RowChecksum.of(model, self.get_columns(model))
+        self.checksums[model.__name__] = checksum
+        return checksum
+
+    def checksum_rows(self, model, criteria=None) -> RowChecksum:
+        """
+        Computes the checksum of the rows of a mapped class as they are in
+        the database, page by page (see `iter_rows`)
+        """
+        checksum = RowChecksum.of(model, self.get_columns(model))
+        for chunk in self.iter_rows(model, core=True, criteria=criteria):
+            checksum.update(chunk)
+        return checksum
+
+    def add_rows(self, model, count: int) -> None:
+        """Counts rows dumped of a mapped class (see `row_counts`)"""
+        name = model.__name__
+        self.row_counts[name] = self.row_counts.get(name, 0) + count
+        self.metrics.add("rows", count)
+
+    def dump_chunks(self, model, chunk_size=None, criteria=None) -> Generator:
+        """
+        Serializes a mapped class chunk by chunk, so only `chunk_size` rows
+        are held in memory (and in the session identity map) at a time. The
+        number of rows dumped is kept in `self.row_counts` and their checksum
+        in `self.checksums`.
+        """
+        db = self.db()
+        checksum = self.start_dump(model)
+        for chunk in self.iter_rows(model, chunk_size, criteria=criteria):
+            yield dumps(chunk)
+            self.add_rows(model, len(chunk))
+            checksum.update_dicts(self.get_values(row) for row in chunk)
+            for row in chunk:
+                db.session.expunge(row)
+
+    def copy_to(self, model, criteria=None) -> Generator:
+        """
+        Dumps a mapped class with PostgreSQL's `COPY (SELECT ...) TO STDOUT`
+        (text format) on the session's connection, yielding blocks of bytes
+        as the server sends them
+        """
+        db = self.db()
+        mapper = inspect(model)
+        query = select(*self.get_columns(model))
+        query = query.order_by(*mapper.primary_key)
+        if criteria:
+            query = query.where(*criteria)
+        connection = db.session.connection()
+        compiled = query.compile(dialect=connection.dialect)
+        sql = "COPY ({}) TO STDOUT".format(compiled)
+        cursor = connection.connection.cursor()
+
+        if not hasattr(cursor, "copy_expert"):  # psycopg 3
+            with cursor.copy(sql, compiled.params) as copy:
+                buffer = bytearray()
+                for data in copy:
+                    buffer.extend(data)
+                    if len(buffer) >= 2 ** 16:
+                        yield bytes(buffer)
+                        buffer.clear()
+                if buffer:
+                    yield bytes(buffer)
+            return None
+
+        # psycopg2 writes the whole output to a file: stream it from a thread
+        pipe = PipeReader()
+        sql = cursor.mogrify(sql, compiled.params).decode("utf-8")
+
+        def copy():
+            try:
+                cursor.copy_expert(sql, pipe)
+            except Exception as error:
+                pipe.finish(error)
+            else:
+                pipe.finish()
+
+        Thread(target=copy, daemon=True).start()
+        with pipe:
+            yield from iter(partial(pipe.read, 2 ** 16), b"")
+
+    def parse_chunks(self, chunks: Iterable[bytes]) -> Generator:
+        """
+        Loads dump chunks (see `dump_chunks`) yielding rows one by one, and
+        letting go of each row once it's yielded
+        """
+        for chunk in chunks:
+            rows = list(self.parse_data(chunk))
+            del chunk  # the bytes aren't needed any more
+            rows.reverse()
+            while rows:
+                yield rows.pop()
+
+    @staticmethod
+    def get_values(row) -> Dict:
+        """Gets the column values of a mapped instance keyed by column"""
+        if isinstance(row, dict):
+            return row
+        mapper = inspect(row).mapper
+        return {
+            prop.columns[0].key: getattr(row, prop.key)
+            for prop in mapper.column_attrs
+        }
+
+    @staticmethod
+    def get_instance(model, values: Dict):
+        """Builds a mapped instance from column values (see `get_values`)"""
+        mapper = inspect(model)
+        row = mapper.class_manager.new_instance()
+        for prop in mapper.column_attrs:
+            key = prop.columns[0].key
+            if key in values:
+                setattr(row, prop.key, values[key])
+        return row
+
+    def insert_statement(self, model, upsert=False, names=None):
+        """
+        Builds the statement used to bulk load rows of a mapped class
+        :param model: SQLAlchemy mapped class
+        :param upsert: (bool) update existing rows (merge semantics) instead
+        of failing on conflicting primary keys
+        :param names: keys of the columns loaded, the only ones an upsert
+        updates (default: every column)
+        :return: an insert statement or None if the dialect has no upsert
+        """
+        table = inspect(model).local_table
+        if not upsert:
+            return insert(table)
+
+        dialect = self.get_dialect(model)
+        if dialect not in ("postgresql", "sqlite", "mysql"):
+            return None
+        module = import_module("sqlalchemy.dialects.{}".format(dialect))
+        dialect_insert = getattr(module, "insert", None)
+        if dialect_insert is None:  # no SQLite upsert before SQLAlchemy 1.4
+            return None
+
+        statement = dialect_insert(table)
+        updated = [
+            c for c in table.columns
+            if not c.primary_key and (names is None or c.key in names)
+        ]
+        if dialect == "mysql":
+            values = {c.name: statement.inserted[c.name] for c in updated}
+            return statement.on_duplicate_key_update(values or {
+                c.name: statement.inserted[c.name] for c in table.primary_key
+            })
+
+        values = {c.name: statement.excluded[c.name] for c in updated}
+        keys = [c.name for c in table.primary_key]
+        if not values:
+            return statement.on_conflict_do_nothing(index_elements=keys)
+        return statement.on_conflict_do_update(
+            index_elements=keys, set_=values)
+
+    def merge_rows(self, model, rows: Iterable, session=None) -> Generator:
+        """Merges rows one by one yielding the ones that failed"""
+        session = session or self.db().session
+        for row in rows:
+            try:
+                if isinstance(row, dict):
+                    session.merge(self.get_instance(model, row))
+                else:
+                    session.merge(row)
+                session.commit()
+            except (IntegrityError, InvalidRequestError):
+                session.rollback()
+                yield row
+
+    def can_load(self, model) -> bool:
+        """Checks if batches of a mapped class can go to `load_batch`"""
+        dialect = self.get_dialect(model)
+        if dialect not in ("postgresql", "mysql"):
+            return False
+        columns = inspect(model).local_table.columns
+        # arrays are only written the way COPY reads them by the database
+        if any(isinstance(column.type, ARRAY) for column in columns):
+            return False
+        if dialect == "postgresql":
+            return True
+        # binary values would need an UNHEX for each column in LOAD DATA
+        for column in columns:
+            try:
+                if column.type.python_type is bytes:
+                    return False
+            except NotImplementedError:
+                pass
+        return True
+
+    def load_batch(self, model, rows: Iterable, upsert=False,
+                   session=None) -> None:
+        """
+        Bulk loads rows with the database's own path into a temporary table
+        (`COPY ... FROM STDIN` on PostgreSQL, `LOAD DATA LOCAL INFILE` on
+        MySQL, which must allow `local_infile`), and from there into the
+        table with the same insert (or upsert) the portable path uses. The
+        caller commits.
+        """
+        session = session or self.db().session
+        source = inspect(model).local_table
+        connection = session.connection()
+        dialect = connection.dialect.name
+        preparer = connection.dialect.identifier_preparer
+        name = "alchemydumps_" + source.name
+        rows = [self.get_values(row) for row in rows]
+        # only the columns a backup saved (see `columns`) are loaded
+        columns = [c for c in source.columns if rows and c.key in rows[0]]
+        names = ", ".join(preparer.quote(c.name) for c in columns)
+        data = CopyFormat.encode_rows(
+            [[values.get(c.key) for c in columns] for values in rows],
+            dialect,
+            columns,
+        )
+
+        if dialect == "postgresql":
+            connection.exec_driver_sql(
+                "CREATE TEMPORARY TABLE {} (LIKE {}) ON COMMIT DROP".format(
+                    preparer.quote(name), preparer.format_table(source)))
+            sql = "COPY {} ({}) FROM STDIN".format(preparer.quote(name), names)
+            cursor = connection.connection.cursor()
+            if hasattr(cursor, "copy_expert"):  # psycopg2
+                cursor.copy_expert(sql, BytesIO(data))
+            else:
+                with cursor.copy(sql) as copy:
+                    copy.write(data)
+        else:
+            connection.exec_driver_sql(
+                "DROP TEMPORARY TABLE IF EXISTS {}".format(
+                    preparer.quote(name)))
+            connection.exec_driver_sql(
+                "CREATE TEMPORARY TABLE {} LIKE {}".format(
+                    preparer.quote(name), preparer.format_table(source)))
+            with NamedTemporaryFile(suffix=".tsv") as handler:
+                handler.write(data)
+                handler.flush()
+                sql = ("LOAD DATA LOCAL INFILE :path INTO TABLE {} "
+                       "CHARACTER SET utf8mb4 ({})")
+                connection.execute(
+                    text(sql.format(preparer.quote(name), names)),
+                    {"path": handler.name})
+
+        temporary = table_clause(
+            name, *(column_clause(c.name) for c in columns))
+        statement = self.insert_statement(
+            model, upsert, [c.key for c in columns]).from_select(
+            [c.name for c in columns], select(*temporary.c))
+        connection.execute(statement)
+
+    @contextmanager
+    def bulk_connection(self, model) -> Generator:
+        """
+        Gets what the portable path inserts rows with: the session or, when
+        `fast` on SQLite, a connection of its own with syncing to disk turned
+        off and a bigger page cache for as long as the restore lasts
+        """
+        db = self.db()
+        if not self.fast or self.get_dialect(model) != "sqlite":
+            yield db.session
+            return None
+
+        engine = db.session.get_bind(mapper=inspect(model))
+        pragmas = {"synchronous": "OFF", "cache_size": -2 ** 16,
+                   "temp_store": "MEMORY"}
+        with engine.connect() as connection:
+            previous = {
+                name: connection.exec_driver_sql(
+                    "PRAGMA {}".format(name)).scalar()
+                for name in pragmas
+            }
+            for name, value in pragmas.items():
+                connection.exec_driver_sql(
+                    "PRAGMA {} = {}".format(name, value))
+            try:
+                yield connection
+            finally:
+                connection.rollback()
+                for name, value in previous.items():
+                    connection.exec_driver_sql(
+                        "PRAGMA {} = {}".format(name, value))
+
+    @contextmanager
+    def batch_session(self, model) -> Generator:
+        """
+        Gets the session a batch of rows is restored with: the shared one,
+        with autoflush off while loading, or, with `low_memory`, a short-lived
+        one that is closed (emptying its identity map) after the batch
+        """
+        db = self.db()
+        if not self.low_memory:
+            with db.session.no_autoflush:
+                yield db.session
+            return None
+
+        engine = db.session.get_bind(mapper=inspect(model))
+        session = Session(bind=engine, autoflush=False,
+                          expire_on_commit=False)
+        try:
+            yield session
+        finally:
+            session.expunge_all()
+            session.close()
+
+    def check_memory(self, batch_size: int) -> int:
+        """
+        Keeps the resident set of the process under `memory_limit` (bytes):
+        when it's above, collects garbage and halves the batch size
+        :param batch_size: (int) current number of rows per batch
+        :return: (int) the number of rows per batch to go on with
+        :raise MemoryError: if still above the limit with single row batches
+        """
+        if not self.memory_limit or get_rss() <= self.memory_limit:
+            return batch_size
+        gc.collect()
+        if get_rss() <= self.memory_limit:
+            return batch_size
+        if batch_size == 1:
+            raise MemoryError("Using {:.0f} MB, over the limit of {:.0f} MB"
+                              .format(get_rss() / 2 ** 20,
+                                      self.memory_limit / 2 ** 20))
+        self.metrics.add("throttled")
+        return batch_size // 2
+
+    def restore_rows(self, model, rows: Iterable, batch_size=None,
+                     upsert=False, checkpoint: Callable = None) -> Generator:
+        """
+        Restores rows of a mapped class in batches, each one sent as a single
+        executemany and committed in a single transaction (or, with `fast`,
+        bulk loaded where the dialect allows, see `load_batch`). Batches
+        raising `IntegrityError` are retried row by row (with `merge`), so
+        failures are still reported per row. Each batch gets its session from
+        `batch_session` and, with a `memory_limit`, batches shrink as needed
+        (see `check_memory`).
+        :param model: SQLAlchemy mapped class
+        :param rows: iterable of mapped instances (see `parse_chunks`) or of
+        dicts of column values
+        :param batch_size: (int) number of rows per batch
+        :param upsert: (bool) update existing rows where the dialect allows
+        :param checkpoint: callable receiving the number of rows of each batch
+        once it's committed (or reported as failed)
+        :return: generator of the rows that could not be restored
+        """
+        db = self.db()
+        statement = self.insert_statement(model, upsert)
+        statements = dict()  # upserts by the columns the rows have
+        bulk_load = self.fast and self.can_load(model)
+        batch_size = batch_size or self.batch_size
+        rows = iter(rows)
+        committed = 0
+        with self.bulk_connection(model) as connection:
+            while True:
+                batch_size = self.check_memory(batch_size)
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                if committed and checkpoint:  # the previous batch is done
+                    checkpoint(committed)
+                committed = len(batch)
+                self.metrics.add("rows", len(batch))
+                with self.metrics.phase("insert"), \
+                        self.batch_session(model) as session:
+                    target = session if connection is db.session \
+                        else connection
+                    if bulk_load:
+                        try:
+                            self.load_batch(model, batch, upsert, session)
+                            session.commit()
+                            continue
+                        except IntegrityError:
+                            session.rollback()
+                            yield from self.merge_rows(model, batch, session)
+                            continue
+                        except DBAPIError:  # e.g. LOAD DATA LOCAL is disabled
+                            session.rollback()
+                            bulk_load = False
+
+                    if statement is None:
+                        yield from self.merge_rows(model, batch, session)
+                        continue
+                    try:
+                        values = [self.get_values(row) for row in batch]
+                        if upsert:  # only update the columns saved
+                            names = frozenset(values[0])
+                            if names not in statements:
+                                statements[names] = self.insert_statement(
+                                    model, upsert, names)
+                            target.execute(statements[names], values)
+                        else:
+                            target.execute(statement, values)
+                        target.commit()
+                    except IntegrityError:
+                        target.rollback()
+                        yield from self.merge_rows(model, batch, session)
+        if committed and checkpoint:
+            checkpoint(committed)
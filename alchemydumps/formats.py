@@ -0,0 +1,352 @@
+# coding: utf-8
+
+import json
+import re
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from itertools import chain, zip_longest
+from typing import Dict, Generator, Iterable, List
+
+from sqlalchemy import inspect
+from sqlalchemy.types import ARRAY, JSON
+
+try:
+    import msgpack
+except ImportError:  # optional dependency: pip install AlchemyDumps[msgpack]
+    msgpack = None
+
+
+class PickleFormat(object):
+    """
+    Mapped instances serialized with `sqlalchemy.ext.serializer` (the format
+    of every backup created before formats were selectable)
+    """
+
+    name = "pickle"
+
+    def dump(self, alchemy, model, chunk_size=None,
+             criteria=None) -> Generator:
+        if alchemy.columns.get(model.__name__):
+            raise ValueError("Only the msgpack and copy formats can save some "
+                             "of the columns of {}".format(model.__name__))
+        return alchemy.dump_chunks(model, chunk_size, criteria)
+
+    def load(self, alchemy, model, chunks: Iterable[bytes]) -> Generator:
+        return alchemy.parse_chunks(chunks)
+
+
+class MsgpackFormat(object):
+    """
+    Column batches read with Core selects (no ORM instances are created) and
+    packed with msgpack. The first chunk is a header with the table schema;
+    each following chunk holds one list of values per column.
+    """
+
+    name = "msgpack"
+    MAGIC = b"ADMSGPACK1\n"
+    VERSION = 1
+    TYPES = (
+        (1, datetime, lambda v: v.isoformat(), datetime.fromisoformat),
+        (2, date, lambda v: v.isoformat(), date.fromisoformat),
+        (3, time, lambda v: v.isoformat(), time.fromisoformat),
+        (4, timedelta, lambda v: repr(v.total_seconds()),
+         lambda v: timedelta(seconds=float(v))),
+        (5, Decimal, str, Decimal),
+    )
+
+    def __init__(self):
+        if msgpack is None:
+            raise RuntimeError(
+                "The msgpack format requires msgpack (pip install msgpack)")
+
+    def encode(self, value):
+        """Packs values msgpack can't handle natively as extension types"""
+        for code, type_, encode, _ in self.TYPES:
+            if isinstance(value, type_):
+                return msgpack.ExtType(code, encode(value).encode("utf-8"))
+        raise TypeError("Cannot serialize {!r}".format(value))
+
+    def decode(self, code, data):
+        for code_, _, _, decode in self.TYPES:
+            if code == code_:
+                return decode(data.decode("utf-8"))
+        return msgpack.ExtType(code, data)
+
+    @staticmethod
+    def get_schema(model, columns: List = None) -> dict:
+        table = inspect(model).local_table
+        return {
+            "version": MsgpackFormat.VERSION,
+            "table": table.name,
+            "columns": [
+                [column.name, repr(column.type), column.nullable]
+                for column in (table.columns if columns is None else columns)
+            ],
+        }
+
+    def dump(self, alchemy, model, chunk_size=None,
+             criteria=None) -> Generator:
+        schema = self.get_schema(model, alchemy.get_columns(model))
+        header = msgpack.packb(schema, use_bin_type=True)
+        yield self.MAGIC + header
+
+        checksum = alchemy.start_dump(model)
+        chunks = alchemy.iter_rows(model, chunk_size, True, criteria)
+        for chunk in chunks:
+            columns = [list(values) for values in zip(*chunk)]
+            yield msgpack.packb(columns, default=self.encode,
+                                use_bin_type=True)
+            alchemy.add_rows(model, len(chunk))
+            checksum.update(chunk)
+
+    def load(self, alchemy, model, chunks: Iterable[bytes]) -> Generator:
+        """Yields dicts of column values keyed as `get_values` does"""
+        chunks = iter(chunks)
+        header = next(chunks)[len(self.MAGIC):]
+        schema = msgpack.unpackb(header, raw=False)
+        if schema["version"] > self.VERSION:
+            raise ValueError("Unsupported msgpack backup version")
+
+        # columns missing from the current table are skipped
+        table = inspect(model).local_table
+        keys_by_name = {column.name: column.key for column in table.columns}
+        keys = [keys_by_name.get(name) for name, *_ in schema["columns"]]
+
+        for chunk in chunks:
+            columns = msgpack.unpackb(chunk, ext_hook=self.decode, raw=False)
+            for values in zip(*columns):
+                yield {k: v for k, v in zip(keys, values) if k is not None}
+
+
+class CopyFormat(object):
+    """
+    Rows in the text format of PostgreSQL's COPY: one line per row, values
+    separated by tabs, `\\N` for NULL and backslash escapes. PostgreSQL
+    tables are dumped with `COPY ... TO STDOUT`; other databases get their
+    rows encoded the same way. The first chunk is a header with the column
+    names; lines may span the following chunks. JSON values are saved as
+    JSON text; array columns can't be saved in this format.
+    """
+
+    name = "copy"
+    MAGIC = b"ADCOPY1\n"
+    VERSION = 1
+    ESCAPES = str.maketrans(
+        {"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+    ESCAPED = re.compile(r"\\(x[0-9A-Fa-f]{1,2}|[0-7]{1,3}|.)")
+    SPECIAL = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t",
+               "v": "\v"}
+    TRUE = ("t", "true", "y", "yes", "on", "1")
+    INTERVAL = re.compile(
+        r"^(?:(-?\d+) days? ?)?(?:(-)?(\d+):(\d+):(\d+(?:\.\d+)?))?$")
+
+    @classmethod
+    def encode_value(cls, value, flavor: str = "postgresql") -> str:
+        """Encodes a value as a COPY field (MySQL wants booleans as 1/0)"""
+        if value is None:
+            return "\\N"
+        if isinstance(value, bool):
+            if flavor == "mysql":
+                return "1" if value else "0"
+            return "t" if value else "f"
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            value = "\\x" + bytes(value).hex()
+        elif isinstance(value, timedelta):
+            value = "{} seconds".format(value.total_seconds())
+        return str(value).translate(cls.ESCAPES)
+
+    @classmethod
+    def encode_field(cls, value, flavor: str = "postgresql",
+                     is_json: bool = False) -> str:
+        """Encodes the value of a column as a COPY field"""
+        if is_json and value is not None:
+            value = json.dumps(value)
+        return cls.encode_value(value, flavor)
+
+    @classmethod
+    def encode_rows(cls, rows: Iterable, flavor: str = "postgresql",
+                    columns: List = None) -> bytes:
+        """
+        Encodes rows (sequences of values) as COPY lines; given the columns
+        the values come from, the values of JSON columns are encoded as JSON
+        """
+        is_json = [isinstance(column.type, JSON) for column in columns or ()]
+        lines = (
+            "\t".join(cls.encode_field(value, flavor, json_value)
+                      for value, json_value in zip_longest(row, is_json))
+            for row in rows
+        )
+        return "".join(line + "\n" for line in lines).encode("utf-8")
+
+    @classmethod
+    def unescape(cls, match) -> str:
+        code = match.group(1)
+        if code[0] == "x" and len(code) > 1:
+            return chr(int(code[1:], 16))
+        if code[0] in "01234567":
+            return chr(int(code, 8))
+        return cls.SPECIAL.get(code, code)
+
+    @classmethod
+    def decode_value(cls, text: str):
+        if text == "\\N":
+            return None
+        if "\\" not in text:
+            return text
+        return cls.ESCAPED.sub(cls.unescape, text)
+
+    @classmethod
+    def parse_interval(cls, text: str):
+        if text.endswith(" seconds"):
+            return timedelta(seconds=float(text[:-len(" seconds")]))
+        match = cls.INTERVAL.match(text)
+        if not match:
+            return text
+        days, sign, hours, minutes, seconds = match.groups()
+        delta = timedelta(hours=int(hours or 0), minutes=int(minutes or 0),
+                          seconds=float(seconds or 0))
+        return timedelta(days=int(days or 0)) + (-delta if sign else delta)
+
+    @classmethod
+    def get_converter(cls, column):
+        """
+        Gets the function turning the text of a field back into the Python
+        type of a column, or None to keep the text
+        """
+        if isinstance(column.type, JSON):
+            return json.loads
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            return None
+        if python_type is bool:
+            return lambda text: text.lower() in cls.TRUE
+        if python_type in (int, float, Decimal):
+            return python_type
+        if python_type in (datetime, date, time):
+            return python_type.fromisoformat
+        if python_type is bytes:
+            return lambda text: (bytes.fromhex(text[2:])
+                                 if text.startswith("\\x")
+                                 else text.encode("utf-8"))
+        if python_type is timedelta:
+            return cls.parse_interval
+        return None
+
+    def dump(self, alchemy, model, chunk_size=None,
+             criteria=None) -> Generator:
+        table = inspect(model).local_table
+        columns = alchemy.get_columns(model)
+        for column in columns:
+            if isinstance(column.type, ARRAY):
+                raise ValueError("The copy format can't save the array "
+                                 "column {}.{}".format(model.__name__,
+                                                       column.name))
+        names = [column.name for column in columns]
+        header = {"version": self.VERSION, "table": table.name,
+                  "columns": names}
+        yield self.MAGIC + json.dumps(header).encode("utf-8")
+
+        checksum = alchemy.start_dump(model)
+        if alchemy.get_dialect(model) == "postgresql":
+            chunks = alchemy.metrics.timed(
+                "query", alchemy.copy_to(model, criteria))
+            chunks = self.add_lines(checksum, table, names, chunks)
+        else:
+            rows = alchemy.iter_rows(model, chunk_size, True, criteria)
+            chunks = self.add_rows(checksum, rows, columns)
+        for chunk in chunks:
+            alchemy.add_rows(model, chunk.count(b"\n"))
+            yield chunk
+
+    def add_rows(self, checksum, rows: Iterable,
+                 columns: List = None) -> Generator:
+        """Encodes chunks of rows adding them to a checksum on the way"""
+        for chunk in rows:
+            checksum.update(chunk)
+            yield self.encode_rows(chunk, columns=columns)
+
+    def add_lines(self, checksum, table, names: List[str],
+                  chunks: Iterable[bytes]) -> Generator:
+        """Passes COPY output through, adding its lines to a checksum"""
+        fields = self.get_fields(table, names)
+        pending = b""
+        for chunk in chunks:
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            checksum.update_dicts(self.decode_line(line, fields)
+                                  for line in lines)
+            yield chunk
+
+    @classmethod
+    def get_fields(cls, table, names: List[str]) -> List:
+        """
+        Gets the key and converter (see `get_converter`) of each field of a
+        line, given the names of the columns; columns missing from the
+        current table are skipped
+        """
+        columns = {column.name: column for column in table.columns}
+        return [
+            (columns[name].key, cls.get_converter(columns[name]))
+            if name in columns else (None, None)
+            for name in names
+        ]
+
+    @classmethod
+    def decode_line(cls, line: bytes, fields) -> Dict:
+        row = dict()
+        values = line.decode("utf-8").split("\t")
+        for (key, convert), text in zip(fields, values):
+            if key is not None:
+                value = cls.decode_value(text)
+                if value is not None and convert is not None:
+                    value = convert(value)
+                row[key] = value
+        return row
+
+    def load(self, alchemy, model, chunks: Iterable[bytes]) -> Generator:
+        """Yields dicts of column values keyed as `get_values` does"""
+        chunks = iter(chunks)
+        header = next(chunks)[len(self.MAGIC):]
+        schema = json.loads(header.decode("utf-8"))
+        if schema["version"] > self.VERSION:
+            raise ValueError("Unsupported copy backup version")
+
+        fields = self.get_fields(inspect(model).local_table,
+                                 schema["columns"])
+
+        pending = b""
+        for chunk in chunks:
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                yield self.decode_line(line, fields)
+        if pending:
+            raise EOFError("Truncated row")
+
+
+FORMATS = {cls.name: cls for cls in (PickleFormat, MsgpackFormat, CopyFormat)}
+
+
+def get_format(name=None):
+    """Gets an instance of a backup format by its name (default: pickle)"""
+    try:
+        return FORMATS[name or PickleFormat.name]()
+    except KeyError:
+        raise ValueError("Unknown backup format: {}".format(name))
+
+
+def load_chunks(alchemy, model, chunks: Iterable[bytes]) -> Generator:
+    """Loads rows from dump chunks detecting the format from the first one"""
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None:
+        return None
+
+    chunks = chain((first,), chunks)
+    if first.startswith(MsgpackFormat.MAGIC):
+        yield from MsgpackFormat().load(alchemy, model, chunks)
+    elif first.startswith(CopyFormat.MAGIC):
+        yield from CopyFormat().load(alchemy, model, chunks)
+    else:
+        yield from PickleFormat().load(alchemy, model, chunks)
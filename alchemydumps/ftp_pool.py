@@ -0,0 +1,182 @@
+# coding: utf-8
+
+from atexit import register
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from ftplib import FTP, FTP_TLS, all_errors, error_perm, error_temp
+from threading import Condition, Lock
+from time import monotonic
+from typing import Callable, Dict, Generator
+
+_pools: Dict = dict()
+_pools_lock = Lock()
+
+
+@dataclass
+class FtpPool(object):
+    """
+    Pool of logged in FTP (or FTPS) sessions to one server directory. Up to
+    `size` sessions are open at a time, so parallel transfers each get their
+    own control connection; idle sessions are kept for reuse and checked
+    with a NOOP when they've been idle for more than `max_idle` seconds.
+    """
+
+    server: str = None
+    user: str = None
+    password: str = None
+    path: str = None
+    tls: bool = False
+    size: int = 4
+    max_idle: float = 30.0
+    timeout: float = None
+
+    def __post_init__(self):
+        self.idle = deque()  # (session, last time it was used)
+        self.opened = 0
+        self.condition = Condition()
+
+    @classmethod
+    def wrap(cls, ftp: FTP) -> "FtpPool":
+        """Pool holding a single session opened elsewhere"""
+        pool = cls(server=None, size=1, max_idle=float("inf"))
+        pool.idle.append((ftp, monotonic()))
+        pool.opened = 1
+        return pool
+
+    def connect(self) -> FTP:
+        if not self.server:
+            raise error_temp("421 Session lost and no server to reconnect")
+        ftp = FTP_TLS(timeout=self.timeout) if self.tls else FTP(
+            timeout=self.timeout)
+        try:
+            ftp.connect(self.server)
+            ftp.login(self.user or "", self.password or "")
+            if self.tls:
+                ftp.prot_p()  # encrypt data connections too
+            if self.path:
+                ftp.cwd(self.path)
+        except BaseException:
+            ftp.close()
+            raise
+        return ftp
+
+    @staticmethod
+    def is_alive(ftp: FTP) -> bool:
+        try:
+            ftp.voidcmd("NOOP")
+        except all_errors:
+            return False
+        return True
+
+    @staticmethod
+    def disconnect(ftp: FTP) -> None:
+        try:
+            ftp.quit()
+        except all_errors:
+            ftp.close()
+
+    def acquire(self) -> FTP:
+        """Checks out a session, waiting for one if `size` are in use"""
+        with self.condition:
+            while not self.idle and self.opened >= self.size:
+                self.condition.wait()
+            if self.idle:
+                ftp, used = self.idle.pop()  # most recently used first
+            else:
+                ftp, used = None, None
+                self.opened += 1
+
+        if ftp is not None and monotonic() - used > self.max_idle:
+            if not self.is_alive(ftp):
+                ftp.close()
+                ftp = None
+        if ftp is None:
+            try:
+                ftp = self.connect()
+            except BaseException:
+                self.release(None, broken=True)
+                raise
+        return ftp
+
+    def release(self, ftp: FTP, broken: bool = False) -> None:
+        """Returns a session to the pool (closing it if it's `broken`)"""
+        with self.condition:
+            if broken:
+                self.opened -= 1
+            else:
+                self.idle.append((ftp, monotonic()))
+            self.condition.notify()
+        if broken and ftp is not None:
+            ftp.close()
+
+    @contextmanager
+    def session(self) -> Generator:
+        """
+        Context manager checking out a session; it goes back to the pool
+        unless the block raised an error other than a permanent one (e.g.
+        550), which may have left the control connection out of sync
+        """
+        ftp = self.acquire()
+        try:
+            yield ftp
+        except error_perm:
+            self.release(ftp)
+            raise
+        except BaseException:
+            self.release(ftp, broken=True)
+            raise
+        self.release(ftp)
+
+    def call(self, func: Callable, retries: int = 1):
+        """
+        Runs `func(session)` reconnecting and retrying on transient errors
+        (4xx replies, lost connections). Only use it for commands that are
+        safe to repeat (listing, deleting, renaming, etc.)
+        """
+        for attempt in range(retries + 1):
+            try:
+                with self.session() as ftp:
+                    return func(ftp)
+            except error_perm:
+                raise
+            except all_errors:
+                if attempt == retries:
+                    raise
+
+    def close(self) -> None:
+        """Quits the idle sessions (sessions in use are left alone)"""
+        with self.condition:
+            sessions = [ftp for ftp, _ in self.idle]
+            self.idle.clear()
+            self.opened -= len(sessions)
+            self.condition.notify_all()
+        for ftp in sessions:
+            self.disconnect(ftp)
+
+
+def get_pool(server: str, user: str, password: str = None, path: str = None,
+             tls: bool = False, size: int = 4) -> FtpPool:
+    """
+    Gets the pool of a server, user and path, creating it the first time: a
+    long-running process (e.g. a Flask app using AlchemyDumps as a library)
+    reuses the same sessions for every backup
+    """
+    key = (server, user, password, path, tls)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = FtpPool(server, user, password, path, tls,
+                                         size)
+        pool.size = max(pool.size, size)
+    return pool
+
+
+@register
+def close_pools() -> None:
+    """Quits every idle pooled session (called when the process exits)"""
+    with _pools_lock:
+        pools = tuple(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
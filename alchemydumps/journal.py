@@ -0,0 +1,85 @@
+# coding: utf-8
+
+import json
+from dataclasses import dataclass, field
+from threading import Lock
+from time import monotonic
+from typing import Any, Dict
+
+from alchemydumps.backup import _decode_mark, _encode_mark
+from alchemydumps.storage import Storage
+
+
+@dataclass
+class Journal(object):
+    """
+    Progress of a command saved as JSON in a storage, so a rerun after a
+    failure can skip what was already done: `create` journals the files it
+    completed (next to the backup files), `restore` the rows it committed
+    per file (in the working directory, next to the settings)
+    """
+
+    storage: Storage
+    name: str
+    interval: float = 0.0
+    data: Dict = field(default_factory=dict)
+    lock: Lock = field(default_factory=Lock)
+
+    CREATE = "alchemydumps-journal-{}.json"
+    RESTORE = "alchemydumps-restore-{}.json"
+
+    def __post_init__(self):
+        self.saved = None
+
+    def load(self) -> bool:
+        """
+        Reads the journal
+        :return: (bool) whether there was one
+        """
+        if not self.storage.has_file(self.name):
+            return False
+        self.data = json.loads(self.storage.read_file(self.name))
+        return True
+
+    def save(self, force: bool = True) -> None:
+        """
+        Replaces the journal atomically; unless `force`d, at most once every
+        `interval` seconds
+        """
+        with self.lock:
+            now = monotonic()
+            if not force and self.saved is not None:
+                if now - self.saved < self.interval:
+                    return None
+            self.saved = now
+            data = json.dumps(self.data, sort_keys=True).encode("utf-8")
+            tmp = self.name + ".tmp"
+            self.storage.create_file(tmp, data)
+            self.storage.rename_file(tmp, self.name)
+
+    def delete(self) -> None:
+        if self.storage.has_file(self.name):
+            self.storage.delete_file(self.name)
+
+    def get(self, section: str, key: str, default=None):
+        with self.lock:
+            return self.data.get(section, dict()).get(key, default)
+
+    def update(self, section: str, key: str, value) -> None:
+        """Records `value` under `section`, saving the journal later"""
+        with self.lock:
+            self.data.setdefault(section, dict())[key] = value
+
+    def set(self, section: str, key: str, value, force: bool = True) -> None:
+        """Records `value` under `section` and saves the journal"""
+        self.update(section, key, value)
+        self.save(force)
+
+    @staticmethod
+    def encode(value) -> Dict:
+        """Encodes a value (e.g. a primary key bound) keeping its type"""
+        return _encode_mark(value)
+
+    @staticmethod
+    def decode(value: Dict) -> Any:
+        return _decode_mark(value)
@@ -0,0 +1,285 @@
+# coding: utf-8
+
+import json
+import socket
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from os import replace
+from sys import platform, stderr
+from threading import Event, Lock, Thread, local
+from time import perf_counter, time
+from typing import Any, Dict, Generator, Iterable, List
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+_END = object()
+
+
+def get_peak_rss() -> int:
+    """Peak resident set size of the process in bytes (0 if unknown)"""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if platform == "darwin" else peak * 1024  # KB on Linux
+
+
+def get_rss() -> int:
+    """Current resident set size of the process in bytes"""
+    try:
+        with open("/proc/self/statm") as handler:
+            pages = int(handler.read().split()[1])
+        return pages * resource.getpagesize()
+    except (OSError, ValueError, IndexError):  # no procfs: the peak will do
+        return get_peak_rss()
+
+
+@dataclass
+class Metrics(object):
+    """
+    Thread safe phase timers and counters of a command. Phases nest and are
+    timed exclusively: while the storage pulls rows (`store`) the time spent
+    querying them (`query`) only counts as `query`, so summing the timers of
+    a thread gives the time it spent in any phase.
+    """
+
+    command: str = None
+    timers: Dict[str, float] = field(default_factory=dict)
+    counters: Dict[str, int] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.lock = Lock()
+        self.local = local()
+        self.started = perf_counter()
+
+    def add(self, name: str, value: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def get(self, name: str) -> int:
+        return self.counters.get(name, 0)
+
+    def account(self, name: str, elapsed: float) -> None:
+        with self.lock:
+            self.timers[name] = self.timers.get(name, 0.0) + elapsed
+
+    @contextmanager
+    def phase(self, name: str) -> Generator:
+        """Context manager timing a block as phase `name`"""
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = list()
+        now = perf_counter()
+        if stack:  # pause the enclosing phase
+            self.account(stack[-1][0], now - stack[-1][1])
+        current = [name, now]
+        stack.append(current)
+        try:
+            yield current
+        finally:
+            now = perf_counter()
+            self.account(name, now - current[1])
+            stack.remove(current)  # a generator may be closed out of order
+            if stack:
+                stack[-1][1] = now
+
+    def timed(self, name: str, items: Iterable, counter: str = None,
+              size=len) -> Generator:
+        """
+        Iterates over `items` timing how long each one takes to be produced
+        as phase `name` (the work of lazy generators happens then)
+        :param counter: (str) counter incremented by the `size` of each item
+        """
+        iterator = iter(items)
+        try:
+            while True:
+                with self.phase(name):
+                    item = next(iterator, _END)
+                if item is _END:
+                    return None
+                if counter:
+                    self.add(counter, size(item))
+                yield item
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    @property
+    def elapsed(self) -> float:
+        return perf_counter() - self.started
+
+    def summary(self) -> Dict:
+        """Machine readable summary of the command"""
+        elapsed = self.elapsed
+        with self.lock:
+            timers = dict(self.timers)
+            counters = dict(self.counters)
+        rows = counters.get("rows", 0)
+        return {
+            "command": self.command,
+            "finished": int(time()),
+            "elapsed": round(elapsed, 3),
+            "phases": {name: round(value, 3) for name, value
+                       in sorted(timers.items())},
+            "counters": counters,
+            "rows_per_sec": round(rows / elapsed) if elapsed else 0,
+            "peak_rss": get_peak_rss(),
+        }
+
+    def describe(self) -> str:
+        """Human readable time spent per phase"""
+        return ", ".join("{} {:.2f}s".format(name, value)
+                         for name, value in sorted(self.timers.items()))
+
+
+def to_prometheus(summary: Dict) -> str:
+    """Formats a summary as Prometheus text exposition format"""
+    labels = 'command="{}"'.format(summary["command"])
+    lines = [
+        "# TYPE alchemydumps_duration_seconds gauge",
+        "alchemydumps_duration_seconds{{{}}} {}".format(
+            labels, summary["elapsed"]),
+        "# TYPE alchemydumps_last_run_timestamp_seconds gauge",
+        "alchemydumps_last_run_timestamp_seconds{{{}}} {}".format(
+            labels, summary["finished"]),
+        "# TYPE alchemydumps_peak_rss_bytes gauge",
+        "alchemydumps_peak_rss_bytes{{{}}} {}".format(
+            labels, summary["peak_rss"]),
+        "# TYPE alchemydumps_phase_seconds gauge",
+    ]
+    for name, value in summary["phases"].items():
+        lines.append('alchemydumps_phase_seconds{{{},phase="{}"}} {}'.format(
+            labels, name, value))
+    for name, value in sorted(summary["counters"].items()):
+        lines.append("# TYPE alchemydumps_{}_total gauge".format(name))
+        lines.append("alchemydumps_{}_total{{{}}} {}".format(
+            name, labels, value))
+    return "\n".join(lines) + "\n"
+
+
+def to_statsd(summary: Dict, prefix: str = "alchemydumps") -> List[str]:
+    """Formats a summary as StatsD timings (in ms) and gauges"""
+    prefix = "{}.{}".format(prefix, summary["command"])
+    lines = ["{}.duration:{}|ms".format(prefix,
+                                        round(summary["elapsed"] * 1000))]
+    for name, value in summary["phases"].items():
+        lines.append("{}.phase.{}:{}|ms".format(prefix, name,
+                                                round(value * 1000)))
+    for name, value in sorted(summary["counters"].items()):
+        lines.append("{}.{}:{}|g".format(prefix, name, value))
+    lines.append("{}.peak_rss:{}|g".format(prefix, summary["peak_rss"]))
+    return lines
+
+
+def export_metrics(metrics: Metrics, summary_path: str = None,
+                   textfile: str = None, statsd: str = None) -> Dict:
+    """
+    Exports the summary of a command
+    :param summary_path: (str) JSON file to write (`-` prints it)
+    :param textfile: (str) Prometheus textfile (e.g. for node_exporter's
+    textfile collector), replaced atomically
+    :param statsd: (str) `host:port` of a StatsD server (UDP)
+    :return: (dict) the summary
+    """
+    summary = metrics.summary()
+    if summary_path == "-":
+        print(json.dumps(summary, indent=2))
+    elif summary_path:
+        with open(summary_path, "w") as handler:
+            json.dump(summary, handler, indent=2)
+
+    if textfile:
+        with open(textfile + ".tmp", "w") as handler:
+            handler.write(to_prometheus(summary))
+        replace(textfile + ".tmp", textfile)
+
+    if statsd:
+        host, port = statsd.rsplit(":", 1)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for line in to_statsd(summary):
+                try:
+                    sock.sendto(line.encode("utf-8"), (host, int(port)))
+                except OSError as error:
+                    print("==> Couldn't send metrics to {} ({})".format(
+                        statsd, error))
+                    break
+    return summary
+
+
+@dataclass
+class Progress(object):
+    """
+    Live status line (on stderr, when it's a terminal) refreshed from the
+    counters of a command. Use `echo` to print lines while it's shown.
+    """
+
+    metrics: Metrics
+    files: int = None
+    rows: int = None
+    enabled: bool = True
+    interval: float = 0.5
+    stream: Any = field(default_factory=lambda: stderr)
+
+    def __post_init__(self):
+        self.enabled = self.enabled and self.stream.isatty()
+        self.stopped = Event()
+        self.lock = Lock()
+        self.thread = None
+
+    def render(self) -> str:
+        metrics = self.metrics
+        rows = metrics.get("rows")
+        elapsed = metrics.elapsed
+        status = ["{}{} files".format(
+            metrics.get("files"),
+            "" if self.files is None else "/{}".format(self.files))]
+        if self.rows:
+            status.append("{:,} of {:,} rows ({:.0%})".format(
+                rows, self.rows, min(rows / self.rows, 1)))
+        else:
+            status.append("{:,} rows".format(rows))
+        status.append("{:.1f} MB".format(metrics.get("bytes") / 2 ** 20))
+        status.append("{:,.0f} rows/s".format(rows / elapsed if elapsed
+                                               else 0))
+        minutes, seconds = divmod(int(elapsed), 60)
+        status.append("{}:{:02d}".format(minutes, seconds))
+        return "==> " + ", ".join(status)
+
+    def draw(self) -> None:
+        with self.lock:
+            self.stream.write("\r\x1b[K" + self.render())
+            self.stream.flush()
+
+    def clear(self) -> None:
+        self.stream.write("\r\x1b[K")
+        self.stream.flush()
+
+    def echo(self, message: str) -> None:
+        """Prints a line without garbling the status line"""
+        if not self.enabled:
+            print(message)
+            return None
+        with self.lock:
+            self.clear()
+            print(message)
+        self.draw()
+
+    def refresh(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.draw()
+
+    def __enter__(self) -> "Progress":
+        if self.enabled:
+            self.thread = Thread(target=self.refresh, daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            with self.lock:
+                self.clear()
@@ -0,0 +1,43 @@
+# coding: utf-8
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import wraps
+from typing import Callable, Generator, Iterable
+
+from flask import current_app
+
+
+def in_app_context(func: Callable) -> Callable:
+    """
+    Wraps `func` so it runs inside its own context of the current Flask app.
+    Flask-SQLAlchemy scopes `db.session` to the app context, so each worker
+    gets its own session (and its own connection from the engine pool).
+    """
+    app = current_app._get_current_object()
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with app.app_context():
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def run_jobs(func: Callable, items: Iterable, jobs: int = 1) -> Generator:
+    """
+    Calls `func` for each item on a pool of `jobs` threads
+    :param func: callable receiving a single item
+    :param items: iterable of items to be processed
+    :param jobs: (int) number of workers; 1 runs everything in this thread
+    :return: generator of (item, result) tuples in order of completion
+    """
+    if jobs <= 1:
+        for item in items:
+            yield item, func(item)
+        return None
+
+    worker = in_app_context(func)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(worker, item): item for item in items}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
@@ -1,12 +1,24 @@
-import gzip
+import json
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
-from os import listdir, mkdir, path as op, remove, sep
+from functools import partial
+from hashlib import sha256
+from itertools import chain, islice
+from os import listdir, mkdir, path as op, remove, replace, sep
 from re import search
-from tempfile import NamedTemporaryFile
-from time import gmtime, strftime
+from threading import Lock, Thread
+from time import gmtime, strftime, time
 from dataclasses import dataclass, field
-from typing import Generator
-from ftplib import FTP
+from typing import (Any, BinaryIO, Dict, Generator, Iterable, List, Mapping,
+                    Tuple, Union)
+from ftplib import FTP, error_perm
+
+from alchemydumps.compression import Codec, GzipCodec, open_file
+from alchemydumps.ftp_pool import FtpPool
+from alchemydumps.stream import (ClosingReader, CompressingReader, IterReader,
+                                 PipeReader, iter_contents, split_chunks)
+from alchemydumps.utils import batched
 
 
 # class StorageTools(object):
@@ -34,26 +46,100 @@ from ftplib import FTP
 class Storage(object):
     backup_path: str
     prefix: str = "db-backup"
+    codec: Codec = field(default_factory=GzipCodec)
+
+    delete_batch_size = 1
 
     def __post_init__(self):
         self.backup_path = self.normalize_path(self.backup_path)
 
+    @property
+    def path(self) -> str:
+        return self.backup_path
+
+    @staticmethod
+    def get_timestamp(name: str) -> Union[str, bool]:
+        """
+        Gets the timestamp from a given file name
+        :param name: (string) Name of a file generated by AlchemyDumps
+        :return: (string) The backup numeric id (in case of success) or False
+        """
+        pattern = r"(.*)(-)(?P<timestamp>[\d]{10}(?:[\d]{4})?)(-)(.*)"
+        match = search(pattern, name)
+        return match.group("timestamp") if match else False
+
+    @staticmethod
+    def parse_timestamp(timestamp: str) -> str:
+        """Transforms a timestamp ID (epoch or %Y%m%d%H%M%S) in a date"""
+        if len(timestamp) == 14:
+            date_parsed = datetime.strptime(timestamp, "%Y%m%d%H%M%S")
+        else:
+            date_parsed = datetime.utcfromtimestamp(int(timestamp))
+        return date_parsed.strftime("%b %d, %Y at %H:%M:%S")
+
     @staticmethod
     def normalize_path(path: str) -> str:
         pass
 
-    def get_files(self) -> Generator:
+    def list_files(self) -> Generator:
+        """List every file in the backup directory"""
         pass
 
-    def create_file(self, name: str, contents: bytes) -> str:
+    def get_files(self) -> Generator:
+        """List the backup files (the ones named with a timestamp)"""
+        for name in self.list_files():
+            if self.get_timestamp(name):
+                yield name
+
+    def create_file(self, name: str,
+                    contents: Union[bytes, Iterable[bytes]]) -> str:
         pass
 
     def read_file(self, name: str):
         pass
 
+    def open_file(self, name: str) -> BinaryIO:
+        pass
+
     def delete_file(self, name: str) -> None:
         pass
 
+    def delete_files(self, names: Iterable[str]) -> List[Tuple]:
+        """
+        Deletes files; storages with a bulk delete request handle up to
+        `delete_batch_size` names per call
+        :param names: iterable of file names
+        :return: list of (name, exception or None) tuples, one per file
+        """
+        results = list()
+        for name in names:
+            try:
+                self.delete_file(name)
+            except Exception as error:
+                results.append((name, error))
+            else:
+                results.append((name, None))
+        return results
+
+    def has_file(self, name: str) -> bool:
+        pass
+
+    def rename_file(self, source: str, target: str) -> None:
+        """Renames a file, replacing `target` if it exists"""
+        pass
+
+    def get_details(self, name: str) -> Dict:
+        """Details of a file this storage created, to keep in the catalog"""
+        return dict()
+
+    def collect_garbage(self, files: Mapping = None) -> None:
+        """
+        Clean up what deleted backup files left behind (if anything)
+        :param files: the remaining backup files (names and their details
+        in the catalog), if known
+        """
+        pass
+
 
 @dataclass
 class LocalStorage(Storage):
@@ -65,69 +151,510 @@ class LocalStorage(Storage):
             mkdir(path)
         return op.abspath(path) + sep
 
-    def get_files(self) -> Generator:
+    def list_files(self) -> Generator:
         for name in listdir(self.backup_path):
-            is_file = op.isfile(op.join(self.local_path, name))
-            has_timestamp = self.get_timestamp(name)
-            if is_file and has_timestamp:
+            if op.isfile(op.join(self.local_path, name)):
                 yield name
 
-    def create_file(self, name: str, contents: bytes) -> str:
+    def create_file(self, name: str,
+                    contents: Union[bytes, Iterable[bytes]]) -> str:
         file_path = op.join(self.local_path, name)
-        with gzip.open(file_path, "wb") as handler:
-            handler.write(contents)
+        with self.codec.open(file_path, "wb") as handler:
+            for chunk in iter_contents(contents):
+                handler.write(chunk)
         return file_path
 
     def read_file(self, name: str) -> bytes:
         file_path = op.join(self.local_path, name)
-        with gzip.open(file_path, "rb") as handler:
+        with open_file(file_path) as handler:
             return handler.read()
 
+    def open_file(self, name: str) -> BinaryIO:
+        """Opens a backup file as a decompressed stream (caller closes it)"""
+        return open_file(op.join(self.local_path, name))
+
     def delete_file(self, name: str) -> None:
         remove(op.join(self.local_path, name))
 
+    def has_file(self, name: str) -> bool:
+        return op.isfile(op.join(self.local_path, name))
+
+    def rename_file(self, source: str, target: str) -> None:
+        replace(op.join(self.local_path, source),
+                op.join(self.local_path, target))
+
 
 @dataclass
 class FtpStorage(Storage):
+    """
+    Backup files on an FTP server. Commands go through `pool` (an `FtpPool`),
+    so concurrent transfers use concurrent sessions; a single session
+    opened elsewhere can be given as `ftp` instead.
+    """
+
+    ftp: FTP = None
     ftp_server: str = None
     ftp_user: str = None
     ftp_password: str = None
     ftp_path: str = None
+    blocksize: int = 8192
+    pool: FtpPool = None
+
+    def __post_init__(self):
+        if self.pool is None:
+            self.pool = FtpPool.wrap(self.ftp)
+        super().__post_init__()
 
-    def normalize_path(self):
+    def normalize_path(self, path: str = None) -> str:
         """Add missing slash to the end of the FTP url to be used in stdout"""
-        url = "ftp://{}{}".format(self.ftp.host, self.ftp.pwd())
+        url = self.pool.call(lambda ftp: "ftp://{}{}".format(ftp.host,
+                                                             ftp.pwd()))
         return url if url.endswith("/") else url + "/"
 
-    def get_files(self) -> Generator:
+    def list_files(self) -> Generator:
         """List all files in the backup directory"""
-        files = self.ftp.nlst()
-        for name in files:
+        yield from self.pool.call(lambda ftp: ftp.nlst())
+
+    def create_file(self, name: str,
+                    contents: Union[bytes, Iterable[bytes]]) -> str:
+        """Compresses `contents` while sending it to the FTP server"""
+        with self.pool.session() as ftp, \
+                CompressingReader(self.codec, contents) as handler:
+            ftp.storbinary("STOR {}".format(name), handler,
+                           blocksize=self.blocksize)
+        return "{}{}".format(self.backup_path, name)
+
+    def read_file(self, name: str) -> bytes:
+        with self.open_file(name) as handler:
+            return handler.read()
+
+    def open_file(self, name: str) -> BinaryIO:
+        """
+        Opens a backup file as a decompressed stream, decompressing blocks as
+        they arrive from the FTP server (the transfer runs in a thread).
+        Closing it before the end aborts the transfer, freeing its session.
+        """
+        pipe = PipeReader()
+
+        def download():
+            try:
+                with self.pool.session() as ftp:
+                    ftp.retrbinary("RETR {}".format(name), pipe.feed,
+                                   blocksize=self.blocksize)
+            except Exception as error:
+                pipe.finish(error)
+            else:
+                pipe.finish()
+
+        Thread(target=download, daemon=True).start()
+        try:
+            return ClosingReader(open_file(pipe), pipe)
+        except BaseException:
+            pipe.close()
+            raise
+
+    def delete_file(self, name: str) -> None:
+        self.pool.call(lambda ftp: ftp.delete(name))
+
+    def has_file(self, name: str) -> bool:
+        """
+        Asks the size of the file in binary mode (many servers refuse SIZE
+        in ASCII mode, the mode after a listing), else looks for it in the
+        listing of the directory
+        """
+        def check(ftp):
+            try:
+                ftp.voidcmd("TYPE I")
+                ftp.size(name)
+            except error_perm:  # missing, or SIZE not allowed
+                try:
+                    return name in ftp.nlst()
+                except error_perm:  # some servers refuse to list nothing
+                    return False
+            return True
+
+        return self.pool.call(check)
+
+    def rename_file(self, source: str, target: str) -> None:
+        def rename(ftp):
+            try:
+                ftp.rename(source, target)
+            except error_perm:  # some servers don't rename over a file
+                ftp.delete(target)
+                ftp.rename(source, target)
+
+        self.pool.call(rename)
+
+
+@dataclass
+class DedupStorage(Storage):
+    """
+    Deduplicating layer over another storage (`inner`): the contents of each
+    backup file are split in content-defined chunks, each chunk is saved once
+    (as `chunk-<sha256>`) and the backup file itself becomes a small manifest
+    listing its chunks. Backup files saved without this layer still read,
+    and the other files (catalog, journals) are saved as they are.
+
+    A chunk no backup file refers to is only deleted once it has been so for
+    `grace` seconds, as a backup being created may be about to refer to it.
+    """
+
+    inner: Storage = None
+    min_size: int = 2 ** 14
+    avg_size: int = 2 ** 16
+    max_size: int = 2 ** 18
+    grace: float = 24 * 3600.0
+    lock: Lock = field(default_factory=Lock)
+
+    MAGIC = b"ADMANIFEST1\n"
+    CHUNK_PREFIX = "chunk-"
+    ORPHANS = "alchemydumps-orphan-chunks.json"
+
+    def __post_init__(self):
+        super().__post_init__()
+        self.known_chunks = None
+        self.manifests = dict()  # chunks of the files created
+
+    def normalize_path(self, path: str) -> str:
+        return path
+
+    def list_files(self) -> Generator:
+        return self.inner.list_files()
+
+    def get_known_chunks(self) -> set:
+        with self.lock:
+            if self.known_chunks is None:
+                self.known_chunks = {
+                    name[len(self.CHUNK_PREFIX):]
+                    for name in self.inner.list_files()
+                    if name.startswith(self.CHUNK_PREFIX)
+                }
+        return self.known_chunks
+
+    def save_chunk(self, chunk: bytes) -> str:
+        """Saves a chunk unless it's already saved, returning its hash"""
+        digest = sha256(chunk).hexdigest()
+        known = self.get_known_chunks()
+        with self.lock:
+            is_new = digest not in known
+            known.add(digest)
+        if is_new:
+            self.inner.create_file(self.CHUNK_PREFIX + digest, chunk)
+        return digest
+
+    def create_file(self, name: str,
+                    contents: Union[bytes, Iterable[bytes]]) -> str:
+        if not self.get_timestamp(name):  # not a backup file
+            return self.inner.create_file(name, contents)
+
+        chunks = split_chunks(contents, self.min_size, self.avg_size,
+                              self.max_size)
+        manifest = {"version": 1, "chunks": [], "size": 0}
+        for chunk in chunks:
+            manifest["chunks"].append(self.save_chunk(chunk))
+            manifest["size"] += len(chunk)
+        contents = self.MAGIC + json.dumps(manifest).encode("utf-8")
+        path = self.inner.create_file(name, contents)
+        with self.lock:
+            self.manifests[name] = manifest["chunks"]
+        return path
+
+    def get_details(self, name: str) -> Dict:
+        with self.lock:
+            chunks = self.manifests.get(name)
+        return {"chunks": chunks} if chunks is not None else dict()
+
+    def read_manifest(self, name: str) -> Union[dict, None]:
+        """Reads the manifest of a backup file or None for regular files"""
+        with self.inner.open_file(name) as handler:
+            if handler.read(len(self.MAGIC)) != self.MAGIC:
+                return None
+            return json.loads(handler.read().decode("utf-8"))
+
+    def read_file(self, name: str) -> bytes:
+        with self.open_file(name) as handler:
+            return handler.read()
+
+    def open_file(self, name: str) -> BinaryIO:
+        manifest = self.read_manifest(name)
+        if manifest is None:
+            return self.inner.open_file(name)
+        chunks = (
+            self.inner.read_file(self.CHUNK_PREFIX + digest)
+            for digest in manifest["chunks"]
+        )
+        return IterReader(chunks)
+
+    def delete_file(self, name: str) -> None:
+        """Deletes the manifest; see `collect_garbage` for its chunks"""
+        self.inner.delete_file(name)
+        with self.lock:
+            self.manifests.pop(name, None)
+
+    @property
+    def delete_batch_size(self) -> int:
+        return self.inner.delete_batch_size
+
+    def delete_files(self, names: Iterable[str]) -> List[Tuple]:
+        return self.inner.delete_files(names)
+
+    def has_file(self, name: str) -> bool:
+        return self.inner.has_file(name)
+
+    def rename_file(self, source: str, target: str) -> None:
+        self.inner.rename_file(source, target)
+
+    def collect_garbage(self, files: Mapping = None) -> None:
+        """
+        Deletes the chunks no remaining backup file has referred to for
+        `grace` seconds. The chunks of each file come from its details in
+        the catalog, and only the manifests of files without them (saved
+        by older versions) are read.
+        :param files: the remaining backup files (names and their details in
+        the catalog), if not given the manifests of all files are read
+        """
+        if files is None:
+            files = {name: dict() for name in self.get_files()}
+        referenced = set()
+        for name, details in files.items():
+            chunks = details.get("chunks")
+            if chunks is None:
+                manifest = self.read_manifest(name)
+                chunks = manifest["chunks"] if manifest else ()
+            referenced.update(chunks)
+
+        # chunks found unreferenced before (and when)
+        orphans = dict()
+        if self.inner.has_file(self.ORPHANS):
+            orphans = json.loads(self.inner.read_file(self.ORPHANS))
+        now = time()
+        orphans = {
+            digest: orphans.get(digest, now)
+            for digest in self.get_known_chunks() - referenced
+        }
+
+        expired = [
+            self.CHUNK_PREFIX + digest
+            for digest, since in orphans.items() if now - since >= self.grace
+        ]
+        for batch in batched(expired, self.inner.delete_batch_size):
+            for name, error in self.inner.delete_files(batch):
+                if error is None:
+                    digest = name[len(self.CHUNK_PREFIX):]
+                    orphans.pop(digest)
+                    with self.lock:
+                        self.known_chunks.discard(digest)
+
+        if orphans:
+            contents = json.dumps(orphans, sort_keys=True).encode("utf-8")
+            self.inner.create_file(self.ORPHANS, contents)
+        elif self.inner.has_file(self.ORPHANS):
+            self.inner.delete_file(self.ORPHANS)
+
+
+@dataclass
+class S3Storage(Storage):
+    """
+    Backup files as objects of an S3 (or S3-compatible, e.g. MinIO) bucket,
+    under the `backup_path` key prefix. Files are uploaded in parts of
+    `part_size` bytes (S3 wants at least 5 MiB except for the last one) and
+    downloaded in ranges of the same size, `jobs` of them at a time.
+    """
+
+    bucket: str = None
+    endpoint_url: str = None
+    client: Any = None
+    part_size: int = 8 * 2 ** 20
+    jobs: int = 4
+
+    delete_batch_size = 1000  # limit of a DeleteObjects request
+
+    def __post_init__(self):
+        if self.client is None:
+            # optional dependency: pip install AlchemyDumps[s3] (imported
+            # here, as it takes a while)
+            try:
+                import boto3
+            except ImportError:
+                raise RuntimeError(
+                    "The S3 storage requires boto3 (pip install boto3)")
+            self.client = boto3.client("s3", endpoint_url=self.endpoint_url)
+        path = (self.backup_path or "").strip("/")
+        self.key_prefix = path + "/" if path else ""
+        super().__post_init__()
+
+    def normalize_path(self, path: str = None) -> str:
+        return "s3://{}/{}".format(self.bucket, self.key_prefix)
+
+    def get_key(self, name: str) -> str:
+        return self.key_prefix + name
+
+    def list_files(self, prefix: str = "") -> Generator:
+        """Lists the files (page by page) whose names start with `prefix`"""
+        paginator = self.client.get_paginator("list_objects_v2")
+        pages = paginator.paginate(Bucket=self.bucket,
+                                   Prefix=self.get_key(prefix))
+        for page in pages:
+            for item in page.get("Contents", ()):
+                yield item["Key"][len(self.key_prefix):]
+
+    def get_files(self) -> Generator:
+        """Lists only the objects named after `prefix`"""
+        for name in self.list_files(self.prefix + "-"):
             if self.get_timestamp(name):
                 yield name
 
-    def create_file(self, name: str, contents: bytes) -> str:
-        path = self.normalize_path()
-        tmp = NamedTemporaryFile()
-        with gzip.open(tmp.name, "wb") as handler:
-            handler.write(contents)
+    def create_file(self, name: str,
+                    contents: Union[bytes, Iterable[bytes]]) -> str:
+        """
+        Compresses `contents` while uploading it: small files take a single
+        request, larger ones a multipart upload sending up to `jobs` parts
+        in parallel (so at most `jobs` + 1 parts are held in memory)
+        """
+        key = self.get_key(name)
+        with CompressingReader(self.codec, contents) as handler:
+            part = handler.read(self.part_size)
+            next_part = handler.read(self.part_size) if part else b""
+            if not next_part:
+                self.client.put_object(Bucket=self.bucket, Key=key,
+                                       Body=part)
+                return "{}{}".format(self.backup_path, name)
+
+            upload = self.client.create_multipart_upload(Bucket=self.bucket,
+                                                         Key=key)
+            try:
+                bodies = chain((part, next_part),
+                               iter(partial(handler.read, self.part_size),
+                                    b""))
+                parts = self.upload_parts(key, upload["UploadId"], bodies)
+            except BaseException:
+                self.client.abort_multipart_upload(
+                    Bucket=self.bucket, Key=key, UploadId=upload["UploadId"])
+                raise
+
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=key, UploadId=upload["UploadId"],
+            MultipartUpload={"Parts": parts})
+        return "{}{}".format(self.backup_path, name)
+
+    def upload_parts(self, key: str, upload_id: str,
+                     bodies: Iterable[bytes]) -> List:
+        """Uploads the parts of a multipart upload, `jobs` at a time"""
+        parts, pending = list(), set()
 
-        # send it to the FTP server
-        self.ftp.storbinary("STOR {}".format(name), open(tmp.name, "rb"))
-        return "{}{}".format(path, name)
+        def upload(number, body):
+            response = self.client.upload_part(
+                Bucket=self.bucket, Key=key, UploadId=upload_id,
+                PartNumber=number, Body=body)
+            return {"PartNumber": number, "ETag": response["ETag"]}
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for number, body in enumerate(bodies, 1):
+                if len(pending) >= self.jobs:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    parts.extend(future.result() for future in done)
+                pending.add(executor.submit(upload, number, body))
+            parts.extend(future.result() for future in pending)
+        return sorted(parts, key=lambda item: item["PartNumber"])
+
+    def read_range(self, key: str, start: int, end: int) -> bytes:
+        response = self.client.get_object(
+            Bucket=self.bucket, Key=key,
+            Range="bytes={}-{}".format(start, end - 1))
+        return response["Body"].read()
+
+    def iter_ranges(self, key: str, size: int) -> Generator:
+        """Downloads an object in order, fetching `jobs` ranges ahead"""
+        starts = iter(range(0, size, self.part_size))
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+
+            def fetch(start):
+                end = min(start + self.part_size, size)
+                return executor.submit(self.read_range, key, start, end)
+
+            futures = deque(fetch(start) for start in islice(starts,
+                                                             self.jobs))
+            try:
+                while futures:
+                    data = futures.popleft().result()
+                    start = next(starts, None)
+                    if start is not None:
+                        futures.append(fetch(start))
+                    yield data
+            finally:  # e.g. closed early: don't fetch the next ranges
+                for future in futures:
+                    future.cancel()
 
     def read_file(self, name: str) -> bytes:
-        tmp = NamedTemporaryFile()
-        with open(tmp.name, "wb") as handler:
-            self.ftp.retrbinary("RETR {}".format(name), handler.write)
-        with gzip.open(tmp.name, "rb") as handler:
+        with self.open_file(name) as handler:
             return handler.read()
 
+    def open_file(self, name: str) -> BinaryIO:
+        """
+        Opens a backup file as a stream decompressed as ranges arrive.
+        Closing it before the end stops fetching the ranges ahead.
+        """
+        key = self.get_key(name)
+        head = self.client.head_object(Bucket=self.bucket, Key=key)
+        reader = IterReader(self.iter_ranges(key, head["ContentLength"]))
+        try:
+            return ClosingReader(open_file(reader), reader)
+        except BaseException:
+            reader.close()
+            raise
+
     def delete_file(self, name: str) -> None:
-        self.ftp.delete(name)
+        self.client.delete_object(Bucket=self.bucket, Key=self.get_key(name))
 
+    def delete_files(self, names: Iterable[str]) -> List[Tuple]:
+        """Deletes files with one request per `delete_batch_size` names"""
+        results = list()
+        for batch in batched(names, self.delete_batch_size):
+            response = self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={
+                    "Objects": [{"Key": self.get_key(n)} for n in batch],
+                    "Quiet": True,
+                },
+            )
+            errors = {
+                item["Key"][len(self.key_prefix):]: IOError(
+                    "{}: {}".format(item.get("Code"), item.get("Message")))
+                for item in response.get("Errors", ())
+            }
+            results.extend((name, errors.get(name)) for name in batch)
+        return results
 
-class S3Storage(Storage):
-    s3_bucket_name: str = None
-    s3_bucket_domain: str = None
-    s3_bucket_path: str = None
+    def has_file(self, name: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket,
+                                    Key=self.get_key(name))
+        except self.client.exceptions.ClientError as error:
+            code = error.response.get("Error", {}).get("Code")
+            if code in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    def rename_file(self, source: str, target: str) -> None:
+        """Copies the object over `target` and deletes `source`"""
+        self.client.copy_object(
+            Bucket=self.bucket, Key=self.get_key(target),
+            CopySource={"Bucket": self.bucket, "Key": self.get_key(source)})
+        self.delete_file(source)
+
+
+STORAGES = {
+    "local": LocalStorage,
+    "ftp": FtpStorage,
+    "s3": S3Storage,
+    "dedup": DedupStorage,
+}
+
+
+def get_storage_class(name=None):
+    """Gets a storage adaptor by the name the settings use (default: local)"""
+    try:
+        return STORAGES[name or "local"]
+    except KeyError:
+        raise ValueError("Unknown storage: {}".format(name))
@@ -0,0 +1,374 @@
+# coding: utf-8
+
+from hashlib import sha256
+from itertools import accumulate
+from operator import sub
+from queue import Empty, Queue
+from struct import Struct
+from typing import BinaryIO, Generator, Iterable, Union
+
+from alchemydumps.utils import get_numpy
+
+MAGIC = b"ADSTREAM1\n"
+FRAME_HEADER = Struct(">Q")
+
+
+def encode_frames(chunks: Iterable[bytes]) -> Generator:
+    """
+    Frames a sequence of serialized chunks so they can be written one by one
+    to a (compressed) stream
+    :param chunks: iterable of bytes, each one a serialized batch of rows
+    :return: generator of bytes (the magic header followed by length-prefixed
+    chunks)
+    """
+    yield MAGIC
+    for chunk in chunks:
+        yield FRAME_HEADER.pack(len(chunk))
+        yield chunk
+
+
+def decode_frames(handler: BinaryIO) -> Generator:
+    """
+    Reads framed chunks back from a file-like object, one at a time. Backups
+    created before streaming existed hold a single unframed dump, which is
+    yielded as one chunk.
+    :param handler: file-like object opened in binary mode
+    :return: generator of bytes (one serialized batch of rows per item)
+    """
+    head = handler.read(len(MAGIC))
+    if head != MAGIC:
+        contents = head + handler.read()
+        if contents:
+            yield contents
+        return None
+
+    while True:
+        header = handler.read(FRAME_HEADER.size)
+        if not header:
+            return None
+        if len(header) < FRAME_HEADER.size:
+            raise EOFError("Truncated frame header")
+        (size,) = FRAME_HEADER.unpack(header)
+        chunk = handler.read(size)
+        if len(chunk) < size:
+            raise EOFError("Truncated frame")
+        yield chunk
+
+
+def iter_contents(contents: Union[bytes, Iterable[bytes]]) -> Generator:
+    """Normalizes `contents` (bytes or an iterable of bytes) into chunks"""
+    if isinstance(contents, (bytes, bytearray)):
+        yield contents
+    else:
+        yield from contents
+
+
+class _Buffer(object):
+    """Write-only sink a compressor writes into; drained by `take`"""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data) -> int:
+        self.data.extend(data)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def take(self, size: int) -> bytes:
+        size = len(self.data) if size is None or size < 0 else size
+        data = bytes(self.data[:size])
+        del self.data[:size]
+        return data
+
+
+class CompressingReader(object):
+    """
+    File-like object compressing `chunks` on demand: each `read` pulls just
+    enough chunks through the codec to return `size` compressed bytes, so it
+    can be handed to `FTP.storbinary` without a temporary file.
+    """
+
+    def __init__(self, codec, chunks: Iterable[bytes]):
+        self.buffer = _Buffer()
+        self.writer = codec.open(self.buffer, "wb")
+        self.chunks = iter_contents(chunks)
+        self.finished = False
+
+    def read(self, size: int = -1) -> bytes:
+        while not self.finished and (size < 0 or size > len(self.buffer.data)):
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.writer.close()
+                self.finished = True
+            else:
+                self.writer.write(chunk)
+        return self.buffer.take(size)
+
+    def close(self) -> None:
+        if not self.finished:
+            self.writer.close()
+            self.finished = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class PipeReader(object):
+    """
+    File-like object fed by another thread (e.g. the callback of
+    `FTP.retrbinary`), holding at most `maxsize` pending blocks in memory.
+    The producer calls `feed` for each block and `finish` at the end (with
+    the exception that interrupted it, if any). Once the reader closes the
+    pipe, `feed` raises so the producer stops instead of waiting forever.
+    """
+
+    _END = object()
+
+    def __init__(self, maxsize: int = 64):
+        self.queue = Queue(maxsize=maxsize)
+        self.pending = bytearray()
+        self.finished = False
+        self.closed = False
+
+    def feed(self, data: bytes) -> None:
+        if self.closed:
+            raise ValueError("The reader closed the pipe")
+        self.queue.put(data)
+
+    def write(self, data: bytes) -> int:
+        """Same as `feed`, for producers writing to a file object"""
+        self.feed(bytes(data))
+        return len(data)
+
+    def finish(self, error: Exception = None) -> None:
+        if not self.closed:
+            self.queue.put(error if error is not None else self._END)
+
+    def _fill(self, size: int) -> None:
+        while not self.finished and (size < 0 or len(self.pending) < size):
+            item = self.queue.get()
+            if item is self._END:
+                self.finished = True
+            elif isinstance(item, Exception):
+                self.finished = True
+                raise item
+            else:
+                self.pending.extend(item)
+
+    def peek(self, size: int = 1) -> bytes:
+        self._fill(size)
+        return bytes(self.pending[:size])
+
+    def read(self, size: int = -1) -> bytes:
+        self._fill(size)
+        size = len(self.pending) if size < 0 else size
+        data = bytes(self.pending[:size])
+        del self.pending[:size]
+        return data
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def close(self) -> None:
+        """
+        Marks the pipe closed and drops the pending blocks, unblocking a
+        producer waiting to feed one (its next `feed` raises)
+        """
+        self.closed = self.finished = True
+        self.pending.clear()
+        while True:
+            try:
+                self.queue.get_nowait()
+            except Empty:
+                break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ClosingReader(object):
+    """
+    Reads from `handler` (e.g. a decompressor) and closes `source`, the file
+    object it reads from, along with it: decompressors opened on a file
+    object leave it open
+    """
+
+    def __init__(self, handler: BinaryIO, source: BinaryIO):
+        self.handler = handler
+        self.source = source
+
+    def read(self, size: int = -1) -> bytes:
+        return self.handler.read(size)
+
+    def close(self) -> None:
+        try:
+            self.handler.close()
+        finally:
+            self.source.close()
+
+    def __getattr__(self, name):
+        return getattr(self.handler, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class IterReader(object):
+    """Read-only file-like object over an iterable of bytes"""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self.chunks = iter_contents(chunks)
+        self.pending = bytearray()
+        self.finished = False
+
+    def _fill(self, size: int) -> None:
+        while not self.finished and (size < 0 or size > len(self.pending)):
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.finished = True
+            else:
+                self.pending.extend(chunk)
+
+    def peek(self, size: int = 1) -> bytes:
+        self._fill(size)
+        return bytes(self.pending[:size])
+
+    def read(self, size: int = -1) -> bytes:
+        self._fill(size)
+        size = len(self.pending) if size < 0 else size
+        data = bytes(self.pending[:size])
+        del self.pending[:size]
+        return data
+
+    def close(self) -> None:
+        self.finished = True
+        self.pending.clear()
+        self.chunks.close()  # e.g. stops downloads reading ahead
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# Table of 256 fixed pseudo-random 64-bit integers, one per byte value. It
+# must never change, otherwise chunk boundaries (and deduplication) change
+# with it.
+GEAR = tuple(
+    int.from_bytes(sha256(bytes([n])).digest()[:8], "big") for n in range(256)
+)
+WINDOW = 48
+
+
+def _find_cut(data: bytearray, start: int, end: int, mask: int) -> int:
+    """
+    Finds the first position from `start` to `end` where the sum of the
+    table values of the last `WINDOW` bytes (modulo 2 ** 64) has none of the
+    (high) bits of `mask` set; the sums are prefix sums differences, so
+    they're computed by NumPy or by C loops (map, accumulate) rather than
+    byte by byte in Python. Both give the same positions.
+    :return: (int) position after the cut, or -1
+    """
+    numpy = get_numpy()
+    if numpy is not None:
+        table = numpy.array(GEAR, dtype=numpy.uint64)
+        values = numpy.frombuffer(data, dtype=numpy.uint8, count=end)
+        sums = numpy.cumsum(table[values[start - WINDOW:end]],
+                            dtype=numpy.uint64)  # wraps around 2 ** 64
+        windows = sums[WINDOW:] - sums[:-WINDOW]
+        hits = numpy.flatnonzero(windows & numpy.uint64(mask) == 0)
+        return start + 1 + int(hits[0]) if hits.size else -1
+
+    sums = list(accumulate(map(GEAR.__getitem__,
+                               data[start - WINDOW:end])))
+    masked = list(map(mask.__and__, map(sub, sums[WINDOW:], sums)))
+    try:
+        return start + 1 + masked.index(0)
+    except ValueError:
+        return -1
+
+
+def _cut_point(data: bytearray, min_size: int, max_size: int,
+               mask: int) -> int:
+    """Finds where the first content-defined chunk of `data` ends"""
+    end = min(len(data), max_size)
+    if end <= min_size:
+        return end
+
+    # a cut needs a full window before it, and it's looked for in blocks so
+    # the bytes after an early cut aren't summed
+    start = max(min_size, WINDOW)
+    block = max(min_size, 2 ** 14)
+    while start < end:
+        cut = _find_cut(data, start, min(start + block, end), mask)
+        if cut > 0:
+            return cut
+        start += block
+    return end
+
+
+def split_chunks(contents: Union[bytes, Iterable[bytes]],
+                 min_size: int = 2 ** 14, avg_size: int = 2 ** 16,
+                 max_size: int = 2 ** 18) -> Generator:
+    """
+    Splits a stream of bytes in content-defined chunks (boundaries depend
+    on the last bytes before them only), so inserting or removing bytes
+    only changes the chunks around the change
+    :param contents: bytes or iterable of bytes
+    :param min_size: (int) minimum size of a chunk
+    :param avg_size: (int) expected size of a chunk (a power of 2), beyond
+    `min_size`
+    :param max_size: (int) maximum size of a chunk
+    :return: generator of bytes
+    """
+    # cut where the high bits of the sum are 0: the low bits of such sums
+    # depend on fewer bytes (e.g. the lowest bit on their parity only)
+    mask = (avg_size - 1) << (64 - avg_size.bit_length() + 1)
+    buffer = bytearray()
+    for piece in iter_contents(contents):
+        buffer.extend(piece)
+        while len(buffer) >= max_size:
+            cut = _cut_point(buffer, min_size, max_size, mask)
+            yield bytes(buffer[:cut])
+            del buffer[:cut]
+
+    while buffer:
+        cut = _cut_point(buffer, min_size, max_size, mask)
+        yield bytes(buffer[:cut])
+        del buffer[:cut]
+
+
+class Digest(object):
+    """Iterates over chunks of bytes counting and hashing them on the way"""
+
+    def __init__(self, chunks: Union[bytes, Iterable[bytes]]):
+        self.chunks = chunks
+        self.size = 0
+        self.hash = sha256()
+
+    def __iter__(self) -> Generator:
+        for chunk in iter_contents(self.chunks):
+            self.size += len(chunk)
+            self.hash.update(chunk)
+            yield chunk
+
+    def hexdigest(self) -> str:
+        return self.hash.hexdigest()
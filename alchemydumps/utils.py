@@ -1,5 +1,30 @@
+from itertools import islice
 from pprint import PrettyPrinter
+from typing import Generator, Iterable
 
 pprint = PrettyPrinter(indent=8).pprint
 
-ppformat = PrettyPrinter(indent=8).pformat
\ No newline at end of file
+ppformat = PrettyPrinter(indent=8).pformat
+
+
+def batched(iterable: Iterable, size: int) -> Generator:
+    """Splits an iterable in lists of (at most) `size` items"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return None
+        yield batch
+
+
+def get_numpy():
+    """
+    Imports NumPy when it's first needed (it takes a while), so commands not
+    using it start faster
+    :return: the numpy module, or None if it's not installed
+    """
+    try:
+        import numpy
+    except ImportError:  # optional dependency: pip install AlchemyDumps[numpy]
+        return None
+    return numpy
@@ -28,6 +28,14 @@ setup(
     maintainer_email="les@wedgwoodwebworks.com",
     license="BSD 3-Clause",
     include_package_data=True,
+    extras_require={
+        "msgpack": ["msgpack"],
+        "zstd": ["zstandard"],
+        "lz4": ["lz4"],
+        "s3": ["boto3"],
+        "numpy": ["numpy"],
+        "benchmark": ["pytest-benchmark", "pyftpdlib"],
+    },
     test_suite="pytest",
     entry_points={"console_scripts": [
         "alchemydumps=alchemydumps.cli:alchemydumps"]},
@@ -0,0 +1,110 @@
+# coding: utf-8
+"""
+Benchmarks of the backup hot paths, run with:
+
+    pip install AlchemyDumps[benchmark]
+    pytest tests/benchmarks --benchmark-autosave
+
+Each benchmark records `rows`, `rows_per_sec` and `peak_rss_mb` in its
+`extra_info`, so saved runs can be compared (`pytest-benchmark compare`).
+The synthetic dataset has ALCHEMYDUMPS_BENCHMARK_ROWS posts (default:
+10000), one user for every 10 posts and one comment per post.
+"""
+
+from os import environ
+from resource import RUSAGE_SELF, getrusage
+from sys import platform
+
+import pytest
+from sqlalchemy import delete, insert
+
+from ..integration.app import Comments, Post, User, app, db
+
+ROWS = int(environ.get("ALCHEMYDUMPS_BENCHMARK_ROWS", 10000))
+ROUNDS = int(environ.get("ALCHEMYDUMPS_BENCHMARK_ROUNDS", 3))
+MODELS = (User, Post, Comments)  # parents first
+
+
+def reset_peak_rss():
+    """Resets the peak resident memory (Linux only)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as handler:
+            handler.write("5")
+    except OSError:
+        pass  # elsewhere the peak is the one since the process started
+
+
+def get_peak_rss() -> int:
+    """
+    :return: (int) peak resident memory of the process, in bytes
+    """
+    try:
+        with open("/proc/self/status") as handler:
+            for line in handler:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = getrusage(RUSAGE_SELF).ru_maxrss
+    return peak if platform == "darwin" else peak * 1024
+
+
+def populate(rows=ROWS):
+    """Fills the tables with `rows` posts, their authors and comments"""
+    users = max(rows // 10, 1)
+    db.session.execute(insert(User), [
+        {"id": n, "email": "user{}@example.etc".format(n)}
+        for n in range(1, users + 1)])
+    db.session.execute(insert(Post), [
+        {"id": n, "title": "Post {}".format(n), "content": "Lorem " * 40,
+         "author_id": n % users + 1}
+        for n in range(1, rows + 1)])
+    db.session.execute(insert(Comments), [
+        {"id": n, "name": "Commenter {}".format(n),
+         "content": "Ipsum " * 10, "post_id": n}
+        for n in range(1, rows + 1)])
+    db.session.commit()
+
+
+def truncate():
+    for model in reversed(MODELS):
+        db.session.execute(delete(model))
+    db.session.commit()
+
+
+@pytest.fixture
+def dataset():
+    """
+    :return: (int) total number of rows in the synthetic dataset
+    """
+    with app.app_context():
+        db.create_all()
+        populate()
+        yield sum(db.session.query(model).count() for model in MODELS)
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def measure(benchmark):
+    """
+    Benchmarks `func` (after `setup`, which isn't timed) and records the
+    throughput (in rows and, given the `size` of the data, in bytes) and the
+    peak memory of the process
+    """
+
+    def run(func, rows, setup=None, rounds=ROUNDS, size=None):
+        reset_peak_rss()
+        result = benchmark.pedantic(func, setup=setup, rounds=rounds)
+        benchmark.extra_info["rows"] = rows
+        benchmark.extra_info["peak_rss_mb"] = round(get_peak_rss() / 2 ** 20,
+                                                    1)
+        if benchmark.stats:  # not run with --benchmark-disable
+            benchmark.extra_info["rows_per_sec"] = round(
+                rows / benchmark.stats["mean"])
+            if size is not None:
+                benchmark.extra_info["mb_per_sec"] = round(
+                    size / 2 ** 20 / benchmark.stats["mean"], 1)
+        return result
+
+    return run
@@ -0,0 +1,24 @@
+# coding: utf-8
+
+from datetime import date
+
+import pytest
+
+from alchemydumps.autoclean import BackupAutoClean, RetentionPolicy
+
+pytest.importorskip("pytest_benchmark")
+
+POLICIES = {
+    "default": None,
+    "gfs": RetentionPolicy(last=24, daily=7, weekly=4, monthly=12, yearly=10),
+}
+
+
+@pytest.mark.parametrize("count", (1000, 10000, 100000))
+@pytest.mark.parametrize("policy", sorted(POLICIES))
+def test_autoclean(measure, count, policy):
+    ids = [str(1262304000 + n * 1800) for n in range(count)]  # twice an hour
+    today = date(2016, 1, 1)
+    cleaning = measure(lambda: BackupAutoClean(ids, today, POLICIES[policy]),
+                       count)
+    assert count == len(cleaning.white_list) + len(cleaning.black_list)
@@ -0,0 +1,80 @@
+# coding: utf-8
+
+from io import BytesIO
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import pytest
+
+from alchemydumps.compression import get_codec
+from alchemydumps.database import AlchemyDumpsDatabase
+from alchemydumps.formats import get_format, load_chunks
+from alchemydumps.storage import LocalStorage
+from alchemydumps.stream import Digest, decode_frames, encode_frames
+
+from .conftest import MODELS, truncate
+
+pytest.importorskip("pytest_benchmark")
+
+FORMATS = ("pickle", "msgpack", "copy")
+CODECS = ("none", "gzip", "zstd", "lz4")
+
+
+def get_codec_or_skip(name):
+    codec = get_codec(name)
+    try:
+        codec.open(BytesIO(), "wb").close()
+    except RuntimeError as error:
+        pytest.skip(str(error))
+    return codec
+
+
+@pytest.fixture
+def storage(request):
+    path = mkdtemp()
+    request.addfinalizer(lambda: rmtree(path))
+    return LocalStorage(path, local_path=path)
+
+
+def dump(backup_format, alchemy=None):
+    """Serializes every table as `create` does, without saving it"""
+    alchemy = alchemy or AlchemyDumpsDatabase()
+    return {model: list(encode_frames(backup_format.dump(alchemy, model)))
+            for model in MODELS}
+
+
+@pytest.mark.parametrize("format_name", FORMATS)
+def test_dump(dataset, measure, format_name):
+    backup_format = get_format(format_name)
+    measure(lambda: dump(backup_format), dataset)
+
+
+@pytest.mark.parametrize("codec_name", CODECS)
+def test_create(dataset, measure, storage, codec_name):
+    storage.codec = get_codec_or_skip(codec_name)
+    backup_format = get_format("msgpack")
+
+    def create():
+        alchemy = AlchemyDumpsDatabase()
+        for model in MODELS:
+            rows = backup_format.dump(alchemy, model)
+            storage.create_file("db-1562000000-{}.bin".format(
+                model.__name__), Digest(encode_frames(rows)))
+
+    measure(create, dataset)
+
+
+@pytest.mark.parametrize("fast", (False, True), ids=("portable", "fast"))
+@pytest.mark.parametrize("format_name", FORMATS)
+def test_restore(dataset, measure, format_name, fast):
+    dumped = dump(get_format(format_name))
+    alchemy = AlchemyDumpsDatabase(fast=fast)
+
+    def restore():
+        for model in MODELS:
+            chunks = decode_frames(BytesIO(b"".join(dumped[model])))
+            rows = load_chunks(alchemy, model, chunks)
+            assert not list(alchemy.restore_rows(model, rows))
+
+    measure(restore, dataset, setup=truncate)
+
@@ -0,0 +1,88 @@
+# coding: utf-8
+
+from ftplib import FTP
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Thread
+
+import pytest
+
+from alchemydumps.compression import NoCodec
+from alchemydumps.database import AlchemyDumpsDatabase
+from alchemydumps.formats import get_format
+from alchemydumps.storage import DedupStorage, FtpStorage, LocalStorage
+from alchemydumps.stream import encode_frames
+
+from ..integration.app import Post
+from .conftest import ROWS
+
+pytest.importorskip("pytest_benchmark")
+
+NAME = "db-1562000000-Post.bin"
+
+
+@pytest.fixture
+def payload(dataset):
+    """The Post table as `create` streams it to the storage"""
+    backup_format = get_format("msgpack")
+    return list(encode_frames(backup_format.dump(AlchemyDumpsDatabase(),
+                                                 Post)))
+
+
+@pytest.fixture
+def directory(request):
+    path = mkdtemp()
+    request.addfinalizer(lambda: rmtree(path))
+    return path
+
+
+@pytest.fixture
+def ftp_server(directory):
+    """A pyftpdlib server on localhost serving `directory`"""
+    authorizers = pytest.importorskip("pyftpdlib.authorizers")
+    handlers = pytest.importorskip("pyftpdlib.handlers")
+    servers = pytest.importorskip("pyftpdlib.servers")
+
+    authorizer = authorizers.DummyAuthorizer()
+    authorizer.add_user("bench", "bench", directory, perm="elradfmw")
+    handler = type("Handler", (handlers.FTPHandler,), {
+        "authorizer": authorizer})
+    server = servers.ThreadedFTPServer(("127.0.0.1", 0), handler)
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.address
+    server.close_all()
+    thread.join()
+
+
+def get_storage(backend, directory, ftp_server=None):
+    if backend == "ftp":
+        ftp = FTP()
+        ftp.connect(*ftp_server)
+        ftp.login("bench", "bench")
+        return FtpStorage("/", codec=NoCodec(), ftp=ftp)
+    local = LocalStorage(directory, codec=NoCodec(), local_path=directory)
+    if backend == "dedup":
+        return DedupStorage(directory, codec=NoCodec(), inner=local)
+    return local
+
+
+@pytest.fixture(params=("local", "dedup", "ftp"))
+def storage(request, directory):
+    ftp_server = None
+    if request.param == "ftp":
+        ftp_server = request.getfixturevalue("ftp_server")
+    return get_storage(request.param, directory, ftp_server)
+
+
+def test_create_file(measure, payload, storage):
+    size = sum(len(chunk) for chunk in payload)
+    measure(lambda: storage.create_file(NAME, iter(payload)), ROWS,
+            size=size)
+
+
+def test_read_file(measure, payload, storage):
+    size = sum(len(chunk) for chunk in payload)
+    storage.create_file(NAME, payload)
+    contents = measure(lambda: storage.read_file(NAME), ROWS, size=size)
+    assert size == len(contents)
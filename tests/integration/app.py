@@ -16,6 +16,7 @@ alchemydumps = AlchemyDumps(app, db)
 # create models
 class Base(db.Model):
     __abstract__ = True
+    __alchemydumps_track__ = 'updated_on'
     created_on = db.Column(db.DateTime, default=db.func.now())
     updated_on = db.Column(db.DateTime,
                            default=db.func.now(),
@@ -0,0 +1,69 @@
+# coding: utf-8
+
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from click.testing import CliRunner
+
+from alchemydumps import alchemydumps
+from alchemydumps.backup import Backup
+from alchemydumps.catalog import Catalog
+from alchemydumps.compression import NoCodec
+from alchemydumps.config import Settings
+from alchemydumps.storage import LocalStorage
+
+from ..integration.app import app
+
+try:
+    from unittest.mock import MagicMock, patch
+except ImportError:
+    from mock import MagicMock, patch
+
+
+class CommandTestCase(TestCase):
+    """
+    Runs the commands through click, with the backups in a temporary
+    directory (their ID is always 1700000000) and the journals of restore
+    in another one
+    """
+
+    settings = dict()
+    codec = NoCodec
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.workdir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.dir)
+        rmtree(self.workdir)
+
+    @patch.object(Backup, '__post_init__', MagicMock())
+    def get_backup(self, **settings):
+        settings = dict(self.settings, prefix='bkp', **settings)
+        backup = Backup(conf=Settings.from_mapping(settings))
+        backup.target = LocalStorage(self.dir, local_path=self.dir,
+                                     codec=self.codec())
+        backup.catalog = Catalog(backup.target)
+        backup.ftp = False
+        backup.new_timestamp = lambda: '1700000000'
+        return backup
+
+    def invoke(self, *args, settings=None, exit_code=0):
+        """
+        Runs `alchemydumps <args>`, raising the errors other than click's
+        :param settings: (dict) settings to add to the class ones
+        :param exit_code: (int) expected exit code
+        :return: (tuple) the backup used and the output of the command
+        """
+        backup = self.get_backup(**(settings or dict()))
+        with patch('alchemydumps.Backup', return_value=backup), \
+                patch('alchemydumps.getcwd', return_value=self.workdir), \
+                app.app_context():
+            result = CliRunner().invoke(alchemydumps,
+                                        [str(arg) for arg in args])
+        if not isinstance(result.exception, (SystemExit, type(None))):
+            raise result.exception
+        self.assertEqual(exit_code, result.exit_code, result.output)
+        return backup, result.output
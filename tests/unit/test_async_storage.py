@@ -0,0 +1,67 @@
+# coding: utf-8
+
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Barrier
+from unittest import TestCase
+from warnings import catch_warnings, simplefilter
+
+from alchemydumps.async_storage import AsyncStorage, run
+from alchemydumps.storage import LocalStorage
+
+
+class TestAsyncStorage(TestCase):
+
+    FILES = (
+        'BRA-19940704123000-USA.gz',
+        'BRA-19940709163000-NED.gz',
+        'BRA-19940713163000-SWE.gz',
+    )
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.storage = LocalStorage(self.dir, local_path=self.dir)
+        self.async_storage = AsyncStorage(self.storage, concurrency=3)
+
+    def tearDown(self):
+        self.async_storage.close()
+        rmtree(self.dir)
+
+    def test_create_read_and_list(self):
+        async def create_all():
+            for name in self.FILES:
+                await self.async_storage.create_file(name, [b'4', b'2'])
+            return await self.async_storage.get_files()
+
+        self.assertEqual(sorted(self.FILES), sorted(run(create_all())))
+        contents = run(self.async_storage.read_file(self.FILES[0]))
+        self.assertEqual(b'42', contents)
+
+    def test_runs_without_deprecated_loops(self):
+        with catch_warnings():
+            simplefilter('error', DeprecationWarning)
+            for _ in range(2):  # each run has its own (closed) event loop
+                self.assertEqual([], run(self.async_storage.get_files()))
+
+    def test_delete_files_concurrently(self):
+        for name in self.FILES:
+            self.storage.create_file(name, b'42')
+
+        # every delete must be running at the same time to pass the barrier
+        barrier = Barrier(len(self.FILES), timeout=5)
+        delete_file = self.storage.delete_file
+
+        def wait_and_delete(name):
+            barrier.wait()
+            delete_file(name)
+
+        self.storage.delete_file = wait_and_delete
+        names = self.FILES + ('BRA-19940717123000-ITA.gz',)
+        results = run(self.async_storage.delete_files(names[:3]))
+        self.assertEqual([(name, None) for name in names[:3]], results)
+        self.assertEqual([], os.listdir(self.dir))
+
+        self.storage.delete_file = delete_file
+        results = dict(run(self.async_storage.delete_files(names[3:])))
+        self.assertIsInstance(results[names[3]], FileNotFoundError)
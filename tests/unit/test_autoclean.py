@@ -1,9 +1,41 @@
 # coding: utf-8
 
-from datetime import date
-from unittest import TestCase
+from datetime import date, datetime, timedelta, timezone
+from random import Random
+from unittest import TestCase, skipIf
 
-from alchemydumps.autoclean import BackupAutoClean
+from alchemydumps.autoclean import (BackupAutoClean, RetentionPolicy,
+                                    civil_from_days, parse_ids)
+from alchemydumps.utils import get_numpy
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+
+def legacy_white_list(dates, today):
+    """The rules of the first versions, to compare the engine against"""
+    number = {'week': lambda day: day.isocalendar()[1],
+              'month': lambda day: day.month, 'year': lambda day: day.year}
+    limits = (today - timedelta(days=7),
+              today - timedelta(days=BackupAutoClean(
+                  [], today).get_last_month_length()),
+              today - timedelta(days=BackupAutoClean(
+                  [], today).get_last_year_length()))
+    groups = ([], [], [], [])
+    for as_string in sorted(dates, reverse=True):
+        day = datetime.strptime(as_string, '%Y%m%d%H%M%S').date()
+        groups[sum(day < limit for limit in limits)].append(as_string)
+    white_list = groups[0]
+    for group, period in zip(groups[1:], ('week', 'month', 'year')):
+        reference = today
+        for as_string in group:
+            day = datetime.strptime(as_string, '%Y%m%d%H%M%S').date()
+            if number[period](day) != number[period](reference):
+                reference = day
+                white_list.append(as_string)
+    return white_list
 
 
 class TestAutocleanHelper(TestCase):
@@ -16,20 +48,25 @@ class TestAutocleanHelper(TestCase):
         backup_list = BackupAutoClean([], date(2013, 3, 1))
         self.assertEqual(366, backup_list.get_last_year_length())
 
-    def test_filter_dates(self):
-        backup_list = BackupAutoClean()
-        dates_none = []
-        dates_w = ['20141120000000', '20141119000000']
-        dates_m = ['20131101000000', '20131130000000']
-        dates_y = ['20111231000000', '20110101000000']
-        calc_none = list(backup_list.filter_dates(dates_none, 'week'))
-        calc_w = list(backup_list.filter_dates(dates_w, 'week'))
-        calc_m = list(backup_list.filter_dates(dates_m, 'month'))
-        calc_y = list(backup_list.filter_dates(dates_y, 'year'))
-        self.assertEqual(calc_none, [])
-        self.assertEqual(calc_w, ['20141120000000'])
-        self.assertEqual(calc_m, ['20131101000000'])
-        self.assertEqual(calc_y, ['20111231000000'])
+    def test_most_recent_of_the_month_of_today(self):
+        dates = ['20180605000000', '20180510000000', '20170630000000',
+                 '20170610000000', '20170531000000', '20160701000000']
+        backup_list = BackupAutoClean(dates, date(2018, 6, 7))
+        self.assertEqual(['20180605000000', '20180510000000',
+                          '20170531000000', '20160701000000'],
+                         backup_list.white_list)
+
+    def test_same_as_the_legacy_rules(self):
+        randomizer = Random(42)
+        for _ in range(300):
+            today = date(2010, 1, 1) + timedelta(randomizer.randrange(3000))
+            dates = [
+                (today - timedelta(randomizer.randrange(900))).strftime(
+                    '%Y%m%d%H%M%S') for _ in range(randomizer.randrange(40))
+            ]
+            self.assertEqual(legacy_white_list(dates, today),
+                             BackupAutoClean(dates, today).white_list,
+                             today)
 
     def test_run(self):
         date_ids = [
@@ -81,3 +118,88 @@ class TestAutocleanHelper(TestCase):
         self.assertEqual(len(backup_list.black_list), 9)
         self.assertEqual(backup_list.white_list, white_list)
         self.assertEqual(backup_list.black_list, black_list)
+
+
+def epoch(*args):
+    return str(int(datetime(*args, tzinfo=timezone.utc).timestamp()))
+
+
+class TestRetentionEngine(TestCase):
+
+    def test_parse_ids(self):
+        ids = ['20140425202739', epoch(2014, 4, 25, 20, 27, 39),
+               '19691231235959']
+        self.assertEqual([1398457659, 1398457659, -1], list(parse_ids(ids)))
+
+    def test_civil_from_days(self):
+        for day in (date(1970, 1, 1), date(2000, 2, 29), date(2100, 3, 1),
+                    date(1900, 12, 31)):
+            days = (day - date(1970, 1, 1)).days
+            self.assertEqual((day.year, day.month, day.day),
+                             tuple(civil_from_days(days)))
+
+    def test_run_with_epoch_ids(self):
+        ids = [epoch(2014, 4, 24), '20140423000000', epoch(2014, 4, 1),
+               epoch(2014, 3, 31)]
+        backup_list = BackupAutoClean(ids, date(2014, 4, 25))
+        self.assertEqual([ids[0], ids[1], ids[2]], backup_list.white_list)
+        self.assertEqual([ids[3]], backup_list.black_list)
+
+    def test_policy(self):
+        ids = [epoch(2014, 4, 25, hour) for hour in (23, 12, 1)]
+        ids += [epoch(2014, 4, day) for day in range(24, 0, -1)]
+        ids += [epoch(2014, 3, 10), epoch(2013, 12, 1), epoch(2012, 6, 1)]
+        policy = RetentionPolicy(last=2, daily=3, monthly=3, yearly=2)
+        backup_list = BackupAutoClean(list(reversed(ids)), policy=policy)
+        expected = [
+            ids[0], ids[1],  # last 2
+            ids[3], ids[4],  # 2 more days
+            ids[-3],  # 2 more months
+            ids[-2],  # 1 more year
+        ]
+        self.assertEqual(expected, backup_list.white_list)
+        self.assertEqual(len(ids) - 6, len(backup_list.black_list))
+
+    def test_policy_from_settings(self):
+        class Settings(object):
+            keep_last = '3'
+            keep_weekly = 4
+            keep_yearly = None
+
+        policy = RetentionPolicy.from_settings(Settings())
+        self.assertEqual(RetentionPolicy(last=3, weekly=4), policy)
+        self.assertTrue(RetentionPolicy.from_settings(object()).is_empty())
+
+    def test_many_ids(self):
+        ids = [str(1262304000 + n * 3600) for n in range(50000)]  # 2010-2015
+        policy = RetentionPolicy(daily=7, weekly=4, monthly=12, yearly=10)
+        backup_list = BackupAutoClean(ids, policy=policy)
+
+        periods = (
+            (7, lambda d: d.date()),
+            (4, lambda d: d.isocalendar()[:2]),
+            (12, lambda d: (d.year, d.month)),
+            (10, lambda d: d.year),
+        )
+        expected = set()
+        for count, key in periods:
+            newest = dict()
+            for date_id in reversed(ids):
+                moment = datetime.fromtimestamp(int(date_id), timezone.utc)
+                newest.setdefault(key(moment), date_id)
+            expected.update(list(newest.values())[:count])
+
+        self.assertEqual(sorted(expected, reverse=True),
+                         backup_list.white_list)
+        self.assertEqual(50000 - len(expected), len(backup_list.black_list))
+
+    @skipIf(get_numpy() is None, 'NumPy is not installed')
+    def test_numpy_matches_pure_python(self):
+        ids = [str(1262304000 + n * 7919) for n in range(20000)]
+        ids += ['20091231235959', '20080229120000']
+        for policy in (None, RetentionPolicy(last=5, hourly=24, weekly=8)):
+            vectorized = BackupAutoClean(ids, date(2014, 4, 25), policy)
+            with patch.dict('sys.modules', {'numpy': None}):
+                pure = BackupAutoClean(ids, date(2014, 4, 25), policy)
+            self.assertEqual(pure.white_list, vectorized.white_list)
+            self.assertEqual(pure.black_list, vectorized.black_list)
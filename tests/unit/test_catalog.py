@@ -0,0 +1,88 @@
+# coding: utf-8
+
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from alchemydumps.catalog import Catalog
+from alchemydumps.storage import LocalStorage
+
+
+class TestCatalog(TestCase):
+
+    FILES = (
+        'BRA-19940704123000-USA.gz',
+        'BRA-19940709163000-NED.gz',
+        'BRA-19940709163000-SWE.gz',
+    )
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.storage = LocalStorage(self.dir, local_path=self.dir)
+        for name in self.FILES:
+            self.storage.create_file(name, b'42')
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def test_rebuild(self):
+        catalog = Catalog(self.storage)
+        self.assertEqual(['19940709163000', '19940704123000'],
+                         catalog.get_timestamps())
+        self.assertEqual(['BRA-19940709163000-NED.gz',
+                          'BRA-19940709163000-SWE.gz'],
+                         list(catalog.get_files('19940709163000')))
+        self.assertTrue(self.storage.has_file(catalog.name))
+        self.assertFalse(self.storage.has_file(catalog.name + '.tmp'))
+
+    def test_persistence(self):
+        catalog = Catalog(self.storage)
+        catalog.add_file('19940717123000', 'BRA-19940717123000-ITA.gz',
+                         size=42, rows=7, sha256='foobar')
+        catalog.remove_file('BRA-19940704123000-USA.gz')
+        catalog.save()
+
+        # files not listed in the catalog are not listed
+        os.remove(os.path.join(self.dir, 'BRA-19940709163000-SWE.gz'))
+
+        catalog = Catalog(self.storage)
+        self.assertEqual(['19940717123000', '19940709163000'],
+                         catalog.get_timestamps())
+        self.assertEqual(3, len(list(catalog.get_files())))
+        details = catalog.get_details('BRA-19940717123000-ITA.gz')
+        self.assertEqual({'size': 42, 'rows': 7, 'sha256': 'foobar'}, details)
+
+        catalog.rebuild()
+        self.assertEqual(['BRA-19940704123000-USA.gz',
+                          'BRA-19940709163000-NED.gz'],
+                         sorted(catalog.get_files()))
+
+    def test_concurrent_changes(self):
+        creating, cleaning = Catalog(self.storage), Catalog(self.storage)
+        self.assertEqual(3, len(list(cleaning.get_files())))
+        creating.add_file('19940717123000', 'BRA-19940717123000-ITA.gz',
+                          size=42)
+        creating.save()
+        cleaning.remove_file('BRA-19940704123000-USA.gz')
+        cleaning.save()
+        creating.add_file('19940717123000', 'BRA-19940717123000-ITA.gz',
+                          rows=7)
+        creating.save()
+
+        for catalog in (Catalog(self.storage), creating, cleaning):
+            self.assertEqual(['19940717123000', '19940709163000'],
+                             catalog.get_timestamps())
+        self.assertEqual({'size': 42, 'rows': 7},
+                         creating.get_details('BRA-19940717123000-ITA.gz'))
+
+    def test_not_replaced_when_wrongly_missing(self):
+        catalog = Catalog(self.storage)
+        catalog.add_file('19940717123000', 'BRA-19940717123000-ITA.gz',
+                         size=42, rows=7)
+        catalog.save()
+
+        self.storage.has_file = lambda name: False
+        catalog = Catalog(self.storage)
+        self.assertEqual({'size': 42, 'rows': 7},
+                         catalog.get_details('BRA-19940717123000-ITA.gz'))
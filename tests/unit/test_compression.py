@@ -0,0 +1,77 @@
+# coding: utf-8
+
+import os
+from io import BytesIO
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, skipIf
+
+from alchemydumps.compression import (GzipCodec, Lz4Codec, NoCodec, ZstdCodec,
+                                      detect_codec, get_codec, open_file)
+from alchemydumps.storage import LocalStorage
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+
+class TestCodecs(TestCase):
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.path = os.path.join(self.dir, 'foobar')
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def round_trip(self, codec):
+        with codec.open(self.path, 'wb') as handler:
+            handler.write(b'42' * 1024)
+        with open_file(self.path) as handler:
+            self.assertEqual(b'42' * 1024, handler.read())
+        with open(self.path, 'rb') as handler:
+            self.assertEqual(codec.name, detect_codec(handler.read(4)).name)
+
+    def test_get_codec(self):
+        self.assertIsInstance(get_codec(), GzipCodec)
+        self.assertEqual(1, get_codec('gzip', level=1).level)
+        self.assertIsInstance(get_codec('none'), NoCodec)
+        with self.assertRaises(ValueError):
+            get_codec('foobar')
+
+    def test_gzip(self):
+        self.round_trip(GzipCodec(level=1))
+
+    def test_none(self):
+        self.round_trip(NoCodec())
+
+    @skipIf(zstandard is None, 'zstandard is not installed')
+    def test_zstd(self):
+        self.round_trip(ZstdCodec(level=1, threads=2))
+
+    @skipIf(lz4_frame is None, 'lz4 is not installed')
+    def test_lz4(self):
+        self.round_trip(Lz4Codec())
+
+    def test_open_file_object(self):
+        contents = BytesIO()
+        with GzipCodec().open(contents, 'wb') as handler:
+            handler.write(b'42')
+        contents.seek(0)
+        with open_file(contents) as handler:
+            self.assertEqual(b'42', handler.read())
+
+    def test_storage_reads_any_codec(self):
+        gzip_storage = LocalStorage(self.dir, local_path=self.dir)
+        none_storage = LocalStorage(self.dir, local_path=self.dir,
+                                    codec=NoCodec())
+        gzip_storage.create_file('foo.gz', b'42')
+        none_storage.create_file('bar.bin', [b'4', b'2'])
+        self.assertEqual(b'42', none_storage.read_file('foo.gz'))
+        self.assertEqual(b'42', gzip_storage.read_file('bar.bin'))
@@ -0,0 +1,135 @@
+# coding: utf-8
+
+import os
+from dataclasses import FrozenInstanceError
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from click.testing import CliRunner
+
+from alchemydumps import alchemydumps
+from alchemydumps.backup import Backup
+from alchemydumps.config import (DefaultLoader, EnvLoader, Settings,
+                                 YamlLoader, read_settings_file)
+from alchemydumps.storage import DedupStorage, LocalStorage
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+
+class TestSettings(TestCase):
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.path = os.path.join(self.dir, 'settings.yml')
+        self.write('prefix: bkp\nftp_tls: yes\nsplit_rows: 1000\n'
+                   'include: [User, Post]\nfilters:\n  Post: id > 3\n')
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def write(self, contents, mtime=None):
+        with open(self.path, 'w') as handler:
+            handler.write(contents)
+        if mtime:
+            os.utime(self.path, (mtime, mtime))
+
+    def test_load(self):
+        settings = YamlLoader(settings_file=self.path).load()
+        self.assertEqual('bkp', settings.prefix)
+        self.assertIs(True, settings.ftp_tls)
+        self.assertEqual(1000, settings.split_rows)
+        self.assertEqual(('User', 'Post'), settings.include)
+        self.assertEqual({'Post': 'id > 3'}, dict(settings.filters))
+        self.assertIsNone(settings.storage)
+        with self.assertRaises(FrozenInstanceError):
+            settings.prefix = 'other'
+        with self.assertRaises(TypeError):
+            settings.filters['User'] = 'id > 1'
+
+    def test_missing_file(self):
+        path = os.path.join(self.dir, 'missing.yml')
+        self.assertEqual(Settings(), YamlLoader(settings_file=path).load())
+        self.assertFalse(os.path.exists(path))
+
+    def test_parsed_once_until_modified(self):
+        with patch('alchemydumps.config.read_yaml',
+                   return_value={'prefix': 'bkp'}) as read_yaml:
+            first = read_settings_file(self.path)
+            self.assertIs(first, read_settings_file(self.path))
+            self.assertEqual(1, read_yaml.call_count)
+
+            self.write('prefix: other\n', mtime=2000000000)
+            read_settings_file(self.path)
+            self.assertEqual(2, read_yaml.call_count)
+
+    def test_invalid_settings(self):
+        for num, contents in enumerate(('prefx: bkp\n', 'split_rows: many\n',
+                                        'ftp_tls: maybe\n',
+                                        'compression: rar\n',
+                                        'storage: dropbox\n')):
+            self.write(contents, mtime=1600000000 + num)
+            with self.assertRaises(ValueError):
+                YamlLoader(settings_file=self.path).load()
+
+    def test_environment_overrides(self):
+        environ = {'ALCHEMYDUMPS_PREFIX': 'env', 'ALCHEMYDUMPS_FTP_TLS': 'no',
+                   'ALCHEMYDUMPS_EXCLUDE': 'Comments, SomeControl',
+                   'ALCHEMYDUMPS_COLUMNS': '{"Post": ["title"]}',
+                   'ALCHEMYDUMPS_IMPORT_BUDGET_MS': '100'}
+        settings = DefaultLoader(self.path, environ).load()
+        self.assertEqual('env', settings.prefix)
+        self.assertIs(False, settings.ftp_tls)
+        self.assertEqual(1000, settings.split_rows)
+        self.assertEqual(('Comments', 'SomeControl'), settings.exclude)
+        self.assertEqual({'Post': ('title',)}, dict(settings.columns))
+
+        settings = EnvLoader(self.path, environ).load()
+        self.assertEqual('env', settings.prefix)
+        self.assertIsNone(settings.split_rows)
+
+    @patch.object(Backup, 'ftp_connect', return_value=False)
+    def test_backup_uses_the_settings(self, _):
+        self.write('local_path: {}\nprefix: bkp\n'.format(self.dir),
+                   mtime=1500000000)
+        backup = Backup(settings=lambda: YamlLoader(settings_file=self.path))
+        self.assertEqual('bkp', backup.conf.prefix)
+        self.assertEqual(os.path.join(self.dir, ''),
+                         backup.target.backup_path)
+        self.assertTrue(backup.get_name('Post', '1').startswith('bkp-1-Post'))
+
+    @patch.object(Backup, 'ftp_connect', return_value=False)
+    def test_backup_uses_the_storage_setting(self, _):
+        def get_backup(**settings):
+            conf = Settings.from_mapping(dict(local_path=self.dir,
+                                              **settings))
+            return Backup(conf=conf)
+
+        target = get_backup(storage='dedup').target
+        self.assertIsInstance(target, DedupStorage)
+        self.assertIsInstance(target.inner, LocalStorage)
+        with self.assertRaisesRegex(ValueError, 'No FTP server'):
+            get_backup(storage='ftp')
+        with self.assertRaisesRegex(ValueError, 'No S3 bucket'):
+            get_backup(storage='s3')
+
+    def test_local_storage_ignores_the_ftp_settings(self):
+        conf = Settings.from_mapping({'storage': 'local', 'ftp_server': 'f.oo',
+                                      'ftp_user': 'me',
+                                      'local_path': self.dir})
+        with patch('alchemydumps.backup.get_pool') as get_pool:
+            backup = Backup(conf=conf)
+        get_pool.assert_not_called()
+        self.assertIsInstance(backup.target, LocalStorage)
+
+    def test_command_with_invalid_settings(self):
+        result = CliRunner().invoke(alchemydumps, ['history'],
+                                    env={'ALCHEMYDUMPS_SPLIT_ROWS': 'many'})
+        self.assertEqual(1, result.exit_code)
+        self.assertIsInstance(result.exception, SystemExit)
+        self.assertEqual("Error: Invalid setting split_rows: 'many' "
+                         "(invalid literal for int() with base 10: 'many')\n",
+                         result.output)
@@ -0,0 +1,171 @@
+# coding: utf-8
+
+from os import environ
+from unittest import TestCase, skipIf
+
+from flask import Flask
+from sqlalchemy import text
+
+from alchemydumps import AlchemyDumps
+from alchemydumps.database import AlchemyDumpsDatabase
+from alchemydumps.formats import CopyFormat, load_chunks
+
+from ..integration.app import Comments, Post, SomeControl, User, app, db
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+
+class TestBatchedRestore(TestCase):
+
+    def setUp(self):
+        with app.app_context():
+            db.create_all()
+            db.session.add(User(email=u'me@example.etc'))
+            for num in range(5):
+                db.session.add(Post(title=u'Post {}'.format(num), author_id=1))
+            db.session.commit()
+            alchemy = AlchemyDumpsDatabase()
+            self.chunks = {
+                'User': list(alchemy.dump_chunks(User)),
+                'Post': list(alchemy.dump_chunks(Post)),
+            }
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def restore(self, model, fast=False, low_memory=False, **kwargs):
+        alchemy = AlchemyDumpsDatabase(batch_size=2, fast=fast,
+                                       low_memory=low_memory)
+        rows = alchemy.parse_chunks(self.chunks[model.__name__])
+        return list(alchemy.restore_rows(model, rows, **kwargs))
+
+    def test_restore_into_empty_tables(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            self.assertEqual([], self.restore(User))
+            self.assertEqual([], self.restore(Post))
+            self.assertEqual(1, User.query.count())
+            titles = [post.title for post in Post.query.order_by(Post.id)]
+            self.assertEqual([u'Post {}'.format(n) for n in range(5)], titles)
+
+    def test_conflicting_batches_fall_back_to_merge(self):
+        with app.app_context():
+            Post.query.filter(Post.id > 3).delete()
+            Post.query.filter_by(id=1).update({'title': u'Changed'})
+            db.session.commit()
+            self.assertEqual([], self.restore(Post))
+            self.assertEqual(5, Post.query.count())
+            self.assertEqual(u'Post 0', db.session.get(Post, 1).title)
+
+    def test_upsert(self):
+        with app.app_context():
+            Post.query.filter_by(id=1).update({'title': u'Changed'})
+            db.session.commit()
+            self.assertEqual([], self.restore(Post, upsert=True))
+            self.assertEqual(5, Post.query.count())
+            self.assertEqual(u'Post 0', db.session.get(Post, 1).title)
+
+    def test_fast_sqlite(self):
+        with app.app_context():
+            Post.query.filter(Post.id > 3).delete()
+            Post.query.filter_by(id=1).update({'title': u'Changed'})
+            db.session.commit()
+            synchronous = db.session.execute(
+                text('PRAGMA synchronous')).scalar()
+
+            self.assertEqual([], self.restore(Post, fast=True))
+            self.assertEqual(5, Post.query.count())
+            self.assertEqual(u'Post 0', db.session.get(Post, 1).title)
+            self.assertEqual(synchronous, db.session.execute(
+                text('PRAGMA synchronous')).scalar())
+
+    def test_low_memory(self):
+        with app.app_context():
+            Post.query.filter(Post.id > 3).delete()
+            Post.query.filter_by(id=1).update({'title': u'Changed'})
+            db.session.commit()
+            db.session.expunge_all()
+
+            self.assertEqual([], self.restore(Post, low_memory=True))
+            self.assertEqual(0, len(db.session.identity_map))
+            self.assertEqual(5, Post.query.count())
+            self.assertEqual(u'Post 0', db.session.get(Post, 1).title)
+
+    def test_memory_limit(self):
+        alchemy = AlchemyDumpsDatabase(memory_limit=100)
+        with patch('alchemydumps.database.get_rss', return_value=100):
+            self.assertEqual(8, alchemy.check_memory(8))
+        with patch('alchemydumps.database.get_rss', return_value=101):
+            self.assertEqual(4, alchemy.check_memory(8))
+            self.assertEqual(1, alchemy.check_memory(3))
+            with self.assertRaises(MemoryError):
+                alchemy.check_memory(1)
+        self.assertEqual(2, alchemy.metrics.get('throttled'))
+
+    def test_memory_limit_shrinks_batches(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            self.assertEqual([], self.restore(User))
+            alchemy = AlchemyDumpsDatabase(batch_size=2, memory_limit=1)
+            rows = alchemy.parse_chunks(self.chunks['Post'])
+            committed = list()
+            with patch('alchemydumps.database.get_rss',
+                       side_effect=[0, 2, 2, 0, 0, 0]):
+                self.assertEqual([], list(alchemy.restore_rows(
+                    Post, rows, checkpoint=committed.append)))
+            self.assertEqual([2, 1, 1, 1], committed)
+            self.assertEqual(5, Post.query.count())
+
+    def test_levels(self):
+        with app.app_context():
+            levels = AlchemyDumpsDatabase().get_levels()
+            self.assertEqual(3, len(levels))
+            self.assertEqual({User, SomeControl}, set(levels[0]))
+            self.assertEqual([Post], levels[1])
+            self.assertEqual([Comments], levels[2])
+
+
+@skipIf(not environ.get('ALCHEMYDUMPS_POSTGRES_URL'),
+        'set ALCHEMYDUMPS_POSTGRES_URL to test against PostgreSQL')
+class TestPostgresCopy(TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = environ[
+            'ALCHEMYDUMPS_POSTGRES_URL']
+        db.init_app(self.app)
+        AlchemyDumps(self.app, db)
+        with self.app.app_context():
+            db.create_all()
+            db.session.add(User(email=u'me@example.etc'))
+            for num in range(5):
+                db.session.add(Post(title=u'Post\t{}'.format(num),
+                                    author_id=1))
+            db.session.commit()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_copy_to_and_from(self):
+        with self.app.app_context():
+            alchemy = AlchemyDumpsDatabase(batch_size=2, fast=True)
+            chunks = list(CopyFormat().dump(alchemy, Post))
+            self.assertEqual(5, alchemy.row_counts['Post'])
+
+            Post.query.filter(Post.id > 3).delete()
+            Post.query.filter_by(id=1).update({'title': u'Changed'})
+            db.session.commit()
+            rows = load_chunks(alchemy, Post, chunks)
+            self.assertEqual([], list(alchemy.restore_rows(Post, rows)))
+            titles = [post.title for post in Post.query.order_by(Post.id)]
+            self.assertEqual([u'Post\t{}'.format(n) for n in range(5)],
+                             titles)
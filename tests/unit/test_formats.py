@@ -0,0 +1,164 @@
+# coding: utf-8
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import TestCase, skipIf
+
+from sqlalchemy import ARRAY, JSON, Column, Integer
+from sqlalchemy.orm import declarative_base
+
+from alchemydumps.checksum import RowChecksum
+from alchemydumps.database import AlchemyDumpsDatabase
+from alchemydumps.formats import (CopyFormat, MsgpackFormat, PickleFormat,
+                                  get_format, load_chunks, msgpack)
+
+from ..integration.app import Post, User, app, db
+
+# not a db.Model, so the backups of the other tests don't include it
+Base = declarative_base()
+
+
+class Document(Base):
+    __tablename__ = 'document'
+    id = Column(Integer, primary_key=True)
+    data = Column(JSON)
+
+
+class Vector(Base):
+    __tablename__ = 'vector'
+    id = Column(Integer, primary_key=True)
+    values = Column(ARRAY(Integer))
+
+
+class TestFormats(TestCase):
+
+    def setUp(self):
+        with app.app_context():
+            db.create_all()
+            db.session.add(User(email=u'me@example.etc'))
+            for num in range(3):
+                db.session.add(Post(title=u'Post {}'.format(num),
+                                    content=u'Lorem ipsum...',
+                                    author_id=1))
+            db.session.commit()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_get_format(self):
+        self.assertIsInstance(get_format(), PickleFormat)
+        self.assertIsInstance(get_format('pickle'), PickleFormat)
+        with self.assertRaises(ValueError):
+            get_format('foobar')
+
+    def test_pickle_round_trip(self):
+        with app.app_context():
+            alchemy = AlchemyDumpsDatabase(chunk_size=2)
+            chunks = list(PickleFormat().dump(alchemy, Post))
+            rows = list(load_chunks(alchemy, Post, chunks))
+            self.assertEqual(3, alchemy.row_counts['Post'])
+            self.assertEqual(u'Post 2', rows[2].title)
+
+    @skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack_round_trip(self):
+        with app.app_context():
+            alchemy = AlchemyDumpsDatabase(chunk_size=2)
+            chunks = list(MsgpackFormat().dump(alchemy, Post))
+            self.assertEqual(3, len(chunks))  # header + 2 column batches
+            self.assertEqual(3, alchemy.row_counts['Post'])
+
+            rows = list(load_chunks(alchemy, Post, chunks))
+            self.assertEqual(3, len(rows))
+            self.assertEqual(u'Post 2', rows[2]['title'])
+            self.assertEqual(1, rows[2]['author_id'])
+            self.assertIsInstance(rows[2]['created_on'], datetime)
+
+            db.drop_all()
+            db.create_all()
+            self.assertEqual([], list(alchemy.restore_rows(Post, rows)))
+            self.assertEqual(3, Post.query.count())
+            self.assertEqual(u'Lorem ipsum...', Post.query.first().content)
+
+    @skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack_schema(self):
+        schema = MsgpackFormat.get_schema(User)
+        self.assertEqual('user', schema['table'])
+        self.assertEqual(['id', 'email'], [c[0] for c in schema['columns']])
+
+    def test_copy_round_trip(self):
+        with app.app_context():
+            Post.query.filter_by(id=2).update(
+                {'content': u'Tab\tnew line\n\\N back\\slash', 'title': None})
+            db.session.commit()
+            alchemy = AlchemyDumpsDatabase(chunk_size=2)
+            chunks = list(CopyFormat().dump(alchemy, Post))
+            self.assertEqual(3, len(chunks))  # header + 2 batches of lines
+            self.assertEqual(3, alchemy.row_counts['Post'])
+
+            # lines may be split anywhere between chunks
+            data = b''.join(chunks[1:])
+            chunks = [chunks[0], data[:7], data[7:50], data[50:]]
+            rows = list(load_chunks(alchemy, Post, chunks))
+            self.assertEqual(3, len(rows))
+            self.assertIsNone(rows[1]['title'])
+            self.assertEqual(u'Tab\tnew line\n\\N back\\slash',
+                             rows[1]['content'])
+            self.assertEqual(1, rows[1]['author_id'])
+            self.assertIsInstance(rows[2]['created_on'], datetime)
+
+            db.drop_all()
+            db.create_all()
+            alchemy.fast = True
+            self.assertEqual([], list(alchemy.restore_rows(Post, rows)))
+            self.assertEqual(3, Post.query.count())
+            self.assertEqual(u'Post 2', db.session.get(Post, 3).title)
+
+    def test_copy_values(self):
+        values = [None, True, b'\x00\xff', timedelta(hours=1, seconds=1.5),
+                  Decimal('4.20'), u'ç\r\\']
+        line = CopyFormat.encode_rows([values]).decode('utf-8')
+        self.assertEqual(u'\\N\tt\t\\\\x00ff\t3601.5 seconds\t4.20\t'
+                         u'ç\\r\\\\\n', line)
+        decoded = [CopyFormat.decode_value(text)
+                   for text in line[:-1].split('\t')]
+        self.assertEqual([None, 't', '\\x00ff', '3601.5 seconds', '4.20',
+                          u'ç\r\\'], decoded)
+        self.assertEqual(u'1\t0\n', CopyFormat.encode_rows(
+            [[True, False]], 'mysql').decode('utf-8'))
+        self.assertEqual(timedelta(days=-1, hours=2, minutes=30),
+                         CopyFormat.parse_interval('-1 days 02:30:00'))
+        self.assertEqual(u'A\x01', CopyFormat.decode_value(r'\x41\001'))
+
+    def test_copy_json_round_trip(self):
+        values = [{'a': [1, 2], 'b': u'x\ty'}, [u'ç', None], u'text', 4]
+        with app.app_context():
+            Document.__table__.create(db.engine)
+            for value in values:
+                db.session.add(Document(data=value))
+            db.session.commit()
+            try:
+                alchemy = AlchemyDumpsDatabase()
+                chunks = list(CopyFormat().dump(alchemy, Document))
+                dumped = alchemy.checksums['Document']
+                rows = list(load_chunks(alchemy, Document, chunks))
+                self.assertEqual(values, [row['data'] for row in rows])
+
+                loaded = RowChecksum.of(Document)
+                loaded.update_dicts(map(alchemy.get_values, rows))
+                self.assertEqual(dumped.hexdigest(), loaded.hexdigest())
+
+                db.session.execute(Document.__table__.delete())
+                self.assertEqual([], list(alchemy.restore_rows(Document,
+                                                               rows)))
+                restored = db.session.query(Document).order_by(Document.id)
+                self.assertEqual(values, [doc.data for doc in restored])
+            finally:
+                db.session.remove()
+                Document.__table__.drop(db.engine)
+
+    def test_copy_refuses_arrays(self):
+        with app.app_context():
+            with self.assertRaises(ValueError):
+                list(CopyFormat().dump(AlchemyDumpsDatabase(), Vector))
@@ -0,0 +1,97 @@
+# coding: utf-8
+
+from ftplib import error_perm, error_temp
+from threading import Thread
+from unittest import TestCase
+
+from alchemydumps.ftp_pool import FtpPool, get_pool
+
+try:
+    from unittest.mock import MagicMock, patch
+except ImportError:
+    from mock import MagicMock, patch
+
+
+class TestFtpPool(TestCase):
+
+    def setUp(self):
+        patcher = patch('alchemydumps.ftp_pool.FTP')
+        self.FTP = patcher.start()
+        self.FTP.side_effect = lambda **kwargs: MagicMock()
+        self.addCleanup(patcher.stop)
+        self.pool = FtpPool('f.oo', 'user', 'secret', '/bar', size=2)
+
+    def test_connect(self):
+        with self.pool.session() as ftp:
+            ftp.connect.assert_called_once_with('f.oo')
+            ftp.login.assert_called_once_with('user', 'secret')
+            ftp.cwd.assert_called_once_with('/bar')
+
+    def test_sessions_are_reused(self):
+        with self.pool.session() as first:
+            pass
+        with self.pool.session() as second:
+            pass
+        self.assertIs(first, second)
+        self.assertEqual(1, self.FTP.call_count)
+        self.assertFalse(second.voidcmd.called)
+
+    def test_size_limit(self):
+        first, second = self.pool.acquire(), self.pool.acquire()
+        self.assertIsNot(first, second)
+        acquired = list()
+        thread = Thread(target=lambda: acquired.append(self.pool.acquire()))
+        thread.start()
+        thread.join(0.1)
+        self.assertEqual([], acquired)  # waiting for a free session
+
+        self.pool.release(second)
+        thread.join(5)
+        self.assertEqual([second], acquired)
+        self.assertEqual(2, self.FTP.call_count)
+
+    def test_health_check(self):
+        self.pool.max_idle = -1
+        with self.pool.session() as first:
+            first.voidcmd.side_effect = EOFError
+        with self.pool.session() as second:
+            pass
+        first.voidcmd.assert_called_once_with('NOOP')
+        first.close.assert_called_once_with()
+        self.assertIsNot(first, second)
+
+    def test_reconnect_on_error_temp(self):
+        sessions = list()
+
+        def nlst(ftp):
+            sessions.append(ftp)
+            if len(sessions) == 1:
+                raise error_temp('421 Timeout')
+            return ['foo.gz']
+
+        self.assertEqual(['foo.gz'], self.pool.call(nlst))
+        self.assertIsNot(*sessions)
+        sessions[0].close.assert_called_once_with()
+        self.assertEqual(1, self.pool.opened)
+
+    def test_error_perm_keeps_session(self):
+        def delete(ftp):
+            raise error_perm('550 No such file')
+
+        with self.assertRaises(error_perm):
+            self.pool.call(delete)
+        self.assertEqual(1, len(self.pool.idle))
+        self.assertEqual(1, self.FTP.call_count)
+
+    def test_close(self):
+        with self.pool.session() as ftp:
+            pass
+        self.pool.close()
+        ftp.quit.assert_called_once_with()
+        self.assertEqual(0, self.pool.opened)
+
+    def test_get_pool(self):
+        pool = get_pool('f.oo', 'user', 'secret', '/bar')
+        self.assertIs(pool, get_pool('f.oo', 'user', 'secret', '/bar', size=8))
+        self.assertEqual(8, pool.size)
+        self.assertIsNot(pool, get_pool('f.oo', 'admin', 'secret', '/bar'))
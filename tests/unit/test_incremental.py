@@ -0,0 +1,171 @@
+# coding: utf-8
+
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import TestCase
+
+from alchemydumps.backup import _decode_mark, _encode_mark
+from alchemydumps.database import AlchemyDumpsDatabase
+
+from ..integration.app import Post, User, app, db
+from . import CommandTestCase
+
+
+class TestChangeTracking(TestCase):
+
+    def setUp(self):
+        with app.app_context():
+            db.create_all()
+            db.session.add(User(email=u'me@example.etc'))
+            old = datetime(2019, 1, 1)
+            for num in range(3):
+                db.session.add(Post(title=u'Post {}'.format(num), author_id=1,
+                                    updated_on=old + timedelta(days=num)))
+            db.session.commit()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_tracking_column(self):
+        alchemy = AlchemyDumpsDatabase()
+        self.assertEqual('updated_on',
+                         alchemy.get_tracking_column(Post).name)
+        self.assertIsNone(alchemy.get_tracking_column(User))
+
+    def test_changes(self):
+        with app.app_context():
+            alchemy = AlchemyDumpsDatabase()
+            self.assertEqual(datetime(2019, 1, 3), alchemy.get_mark(Post))
+            self.assertIsNone(alchemy.get_mark(User))
+
+            criteria = alchemy.get_changes_criteria(Post, datetime(2019, 1, 2))
+            list(alchemy.dump_chunks(Post, criteria=criteria))
+            self.assertEqual(2, alchemy.row_counts['Post'])
+            self.assertEqual([], alchemy.get_changes_criteria(User, 42))
+
+    def test_changes_in_the_same_second(self):
+        with app.app_context():
+            Post.query.filter_by(id=3).update({'updated_on': db.func.now()})
+            db.session.commit()
+            alchemy = AlchemyDumpsDatabase()
+            mark = alchemy.get_mark(Post)
+            criteria = alchemy.get_changes_criteria(Post, mark)
+            self.assertEqual(1, alchemy.count_rows(Post, criteria))
+
+            mark = mark.replace(microsecond=500000)  # a mark from elsewhere
+            criteria = alchemy.get_changes_criteria(Post, mark)
+            self.assertEqual(1, alchemy.count_rows(Post, criteria))
+
+    def test_marks_encoding(self):
+        for mark in (datetime(2019, 1, 3, 4, 5), Decimal('4.2'), 42, u'foo'):
+            self.assertEqual(mark, _decode_mark(_encode_mark(mark)))
+
+
+class TestChain(CommandTestCase):
+
+    FILES = (
+        'bkp-1500000000-Post.bin',
+        'bkp-1500000000-_marks.bin',
+        'bkp-1600000000-Post-delta.bin',
+        'bkp-1700000000-Post.bin',
+        'bkp-1800000000-Post-delta.bin',
+        'bkp-1900000000-Post-delta.bin',
+        'bkp-1900000000-_marks.bin',
+    )
+
+    def setUp(self):
+        super().setUp()
+        self.backup = self.get_backup()
+        self.backup.files = self.FILES
+
+    def test_find_chain(self):
+        self.assertEqual(
+            ['bkp-1700000000-Post.bin', 'bkp-1800000000-Post-delta.bin'],
+            self.backup.find_chain('Post', '1800000000'))
+        self.assertEqual(
+            ['bkp-1500000000-Post.bin', 'bkp-1600000000-Post-delta.bin'],
+            self.backup.find_chain('Post', '1650000000'))
+        self.assertEqual([], self.backup.find_chain('Post', '1400000000'))
+        self.assertEqual([], self.backup.find_chain('User', '1900000000'))
+
+    def test_broken_chain(self):
+        files = ['bkp-1700000000-Post.bin', 'bkp-1800000000-Post-delta.bin',
+                 'bkp-1900000000-Post-delta.bin']
+        for timestamp, base in (('1800000000', '1700000000'),
+                                ('1900000000', '1800000000')):
+            files.append(os.path.basename(
+                self.backup.save_marks(timestamp, {'Post': 42}, base)))
+        self.backup.files = tuple(files)
+        self.assertEqual(files[:3],
+                         self.backup.find_chain('Post', '1900000000'))
+
+        for removed in ('1800000000', '1700000000'):
+            self.backup.files = tuple(name for name in files
+                                      if removed not in name)
+            with self.assertRaises(ValueError):
+                self.backup.find_chain('Post', '1900000000')
+
+    def test_get_bases(self):
+        for timestamp, base in (('1800000000', '1700000000'),
+                                ('1900000000', '1800000000')):
+            self.backup.save_marks(timestamp, {'Post': 42}, base)
+        self.assertEqual(['1700000000'],
+                         self.backup.get_bases(['1800000000']))
+        self.assertEqual(['1800000000', '1700000000'],
+                         self.backup.get_bases(['1900000000']))
+        self.assertEqual(['1500000000'],
+                         self.backup.get_bases(['1600000000', '1900000000',
+                                                '1800000000', '1700000000']))
+        self.assertEqual([], self.backup.get_bases(['1700000000']))
+
+    def test_marks(self):
+        marks = {'Post': datetime(2019, 1, 3)}
+        name = self.backup.save_marks('1900000000', marks)
+        self.assertEqual('bkp-1900000000-_marks.bin', os.path.basename(name))
+        timestamp, marks = self.backup.get_last_marks()
+        self.assertEqual('1900000000', timestamp)
+        self.assertEqual({'Post': datetime(2019, 1, 3)}, marks)
+        self.assertIsNone(self.backup.get_base('1900000000'))
+
+        with open(name, 'w') as handler:  # saved before bases were recorded
+            handler.write('{"Post": {"type": null, "value": 42}}')
+        self.assertEqual(('1900000000', {'Post': 42}),
+                         self.backup.get_last_marks())
+
+
+class TestCleaning(CommandTestCase):
+
+    settings = {'keep_last': 2}
+
+    def setUp(self):
+        super().setUp()
+        now = datetime.now().timestamp()
+        self.old, self.full, self.delta, self.last = (
+            str(int(now - days * 86400)) for days in (20, 14, 12, 1))
+        backup = self.get_backup()
+        for timestamp, suffix in ((self.old, ''), (self.full, ''),
+                                  (self.delta, '-delta'), (self.last, '')):
+            backup.target.create_file(
+                'bkp-{}-Post{}.bin'.format(timestamp, suffix), b'42')
+        backup.save_marks(self.delta, {'Post': 42}, self.full)
+
+    def test_autoclean_keeps_the_bases(self):
+        _, output = self.invoke('autoclean', '-y')
+        self.assertIn('3 backups will be kept', output)
+        self.assertIn('1 backups will be deleted', output)
+        self.assertEqual(['bkp-{}-Post.bin'.format(self.full)],
+                         [name for name in os.listdir(self.dir)
+                          if self.full in name])
+        self.assertFalse([name for name in os.listdir(self.dir)
+                          if self.old in name])
+
+    def test_remove_refuses_bases(self):
+        _, output = self.invoke('remove', '-d', self.full, '-y',
+                                exit_code=1)
+        self.assertIn('is the base of the incremental backups {}'.format(
+            self.delta), output)
+        self.invoke('remove', '-d', self.delta, '-y')
+        self.invoke('remove', '-d', self.full, '-y')
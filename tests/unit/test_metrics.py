@@ -0,0 +1,119 @@
+# coding: utf-8
+
+import json
+import os
+import socket
+from io import StringIO
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import sleep
+from unittest import TestCase, skipIf
+
+from alchemydumps.database import AlchemyDumpsDatabase
+from alchemydumps.formats import get_format
+from alchemydumps.metrics import (Metrics, Progress, export_metrics,
+                                  get_rss, resource, to_prometheus)
+
+from ..integration.app import Post, User, app, db
+
+
+class Terminal(StringIO):
+
+    def isatty(self):
+        return True
+
+
+class TestMetrics(TestCase):
+
+    def setUp(self):
+        self.dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def test_nested_phases_are_exclusive(self):
+        metrics = Metrics('create')
+
+        def produce():
+            sleep(0.05)
+            yield b'foo'
+            sleep(0.05)
+            yield b'bar'
+
+        with metrics.phase('store'):
+            for _ in metrics.timed('serialize', produce(), counter='bytes'):
+                sleep(0.02)
+        self.assertGreaterEqual(metrics.timers['serialize'], 0.1)
+        self.assertLess(metrics.timers['store'], 0.09)
+        self.assertGreaterEqual(metrics.timers['store'], 0.04)
+        self.assertEqual({'bytes': 6}, metrics.counters)
+
+    def test_dump_counts_rows_and_queries(self):
+        with app.app_context():
+            db.create_all()
+            db.session.add(User(email=u'me@example.etc'))
+            for num in range(5):
+                db.session.add(Post(title=u'Post {}'.format(num)))
+            db.session.commit()
+
+            metrics = Metrics('create')
+            alchemy = AlchemyDumpsDatabase(chunk_size=2, metrics=metrics)
+            list(get_format('msgpack').dump(alchemy, Post))
+            db.session.remove()
+            db.drop_all()
+        self.assertEqual(5, metrics.get('rows'))
+        self.assertEqual(5, alchemy.row_counts['Post'])
+        self.assertIn('query', metrics.timers)
+
+    def test_export(self):
+        metrics = Metrics('restore')
+        metrics.add('rows', 42)
+        metrics.account('insert', 1.5)
+        summary_path = os.path.join(self.dir, 'summary.json')
+        textfile = os.path.join(self.dir, 'alchemydumps.prom')
+
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(receiver.close)
+        receiver.bind(('127.0.0.1', 0))
+        receiver.settimeout(5)
+        statsd = '127.0.0.1:{}'.format(receiver.getsockname()[1])
+
+        summary = export_metrics(metrics, summary_path, textfile, statsd)
+        with open(summary_path) as handler:
+            self.assertEqual(summary, json.load(handler))
+        self.assertEqual({'insert': 1.5}, summary['phases'])
+        self.assertEqual({'rows': 42}, summary['counters'])
+        if resource is not None:
+            self.assertGreater(summary['peak_rss'], 0)
+
+        with open(textfile) as handler:
+            self.assertEqual(to_prometheus(summary), handler.read())
+        self.assertIn('alchemydumps_phase_seconds{command="restore",'
+                      'phase="insert"} 1.5', to_prometheus(summary))
+        self.assertIn('alchemydumps_rows_total{command="restore"} 42',
+                      to_prometheus(summary))
+        self.assertIn('alchemydumps_peak_rss_bytes{{command="restore"}} {}'
+                      .format(summary['peak_rss']), to_prometheus(summary))
+
+        lines = {receiver.recv(512).decode('utf-8') for _ in range(3)}
+        self.assertIn('alchemydumps.restore.phase.insert:1500|ms', lines)
+        self.assertIn('alchemydumps.restore.rows:42|g', lines)
+
+    @skipIf(resource is None, 'no resource module on this platform')
+    def test_rss(self):
+        self.assertGreater(get_rss(), 0)
+        self.assertGreaterEqual(Metrics().summary()['peak_rss'], get_rss())
+
+    def test_progress(self):
+        metrics = Metrics('restore')
+        metrics.add('rows', 250)
+        metrics.add('files')
+        stream = Terminal()
+        status_line = Progress(metrics, 4, 1000, stream=stream)
+        self.assertIn('1/4 files, 250 of 1,000 rows (25%)',
+                      status_line.render())
+        with status_line:
+            status_line.echo('==> done')
+        self.assertTrue(stream.getvalue().endswith('\r\x1b[K'))
+
+        self.assertFalse(Progress(metrics, stream=StringIO()).enabled)
@@ -0,0 +1,60 @@
+# coding: utf-8
+
+from io import BytesIO
+from threading import get_ident
+from unittest import TestCase
+
+from flask import current_app
+
+from alchemydumps.database import AlchemyDumpsDatabase
+from alchemydumps.parallel import run_jobs
+from alchemydumps.stream import decode_frames, encode_frames
+
+from ..integration.app import Post, User, app, db
+
+
+class TestRunJobs(TestCase):
+
+    def test_serial(self):
+        results = list(run_jobs(lambda x: x * 2, range(3)))
+        self.assertEqual([(0, 0), (1, 2), (2, 4)], results)
+
+    def test_parallel(self):
+        with app.app_context():
+            main = get_ident()
+
+            def job(item):
+                return current_app.name, get_ident() != main, item * 2
+
+            results = sorted(run_jobs(job, range(4), jobs=2))
+            expected = [(n, (app.name, True, n * 2)) for n in range(4)]
+            self.assertEqual(expected, results)
+
+
+class TestParallelDump(TestCase):
+
+    def setUp(self):
+        with app.app_context():
+            db.create_all()
+            db.session.add(User(email=u'me@example.etc'))
+            for num in range(3):
+                db.session.add(Post(title=u'Post {}'.format(num), author_id=1))
+            db.session.commit()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_dump_tables_concurrently(self):
+        with app.app_context():
+            alchemy = AlchemyDumpsDatabase(chunk_size=2)
+
+            def dump(model):
+                alchemy.begin_snapshot()
+                return b''.join(encode_frames(alchemy.dump_chunks(model)))
+
+            dumps = dict(run_jobs(dump, (User, Post), jobs=2))
+            self.assertEqual({'User': 1, 'Post': 3}, alchemy.row_counts)
+            rows = alchemy.parse_chunks(decode_frames(BytesIO(dumps[Post])))
+            self.assertEqual(3, len(list(rows)))
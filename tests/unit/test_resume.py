@@ -0,0 +1,162 @@
+# coding: utf-8
+
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from alchemydumps.compression import NoCodec
+from alchemydumps.database import AlchemyDumpsDatabase
+from alchemydumps.journal import Journal
+from alchemydumps.storage import LocalStorage
+
+from ..integration.app import Post, User, app, db
+from . import CommandTestCase
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+
+class TestJournal(TestCase):
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.storage = LocalStorage(self.dir, local_path=self.dir,
+                                    codec=NoCodec())
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def test_save_load_and_delete(self):
+        journal = Journal(self.storage, 'journal.json', interval=60)
+        self.assertFalse(journal.load())
+        journal.set('rows', 'User', 2)
+        journal.set('rows', 'User', 4, force=False)  # too soon to save
+        journal.set('bounds', 'Post', [Journal.encode(n) for n in (3, 5)],
+                    force=False)
+
+        saved = Journal(self.storage, 'journal.json')
+        self.assertTrue(saved.load())
+        self.assertEqual(2, saved.get('rows', 'User'))
+        self.assertIsNone(saved.get('bounds', 'Post'))
+
+        journal.save()
+        saved.load()
+        self.assertEqual(4, saved.get('rows', 'User'))
+        self.assertEqual([3, 5], [Journal.decode(bound) for bound
+                                  in saved.get('bounds', 'Post')])
+
+        journal.delete()
+        self.assertEqual([], os.listdir(self.dir))
+
+    def test_restore_rows_checkpoint(self):
+        with app.app_context():
+            db.create_all()
+            rows = [{'id': n, 'title': u'Post {}'.format(n)}
+                    for n in range(1, 6)]
+            committed = list()
+            alchemy = AlchemyDumpsDatabase(batch_size=2)
+            list(alchemy.restore_rows(Post, rows,
+                                      checkpoint=committed.append))
+            db.session.remove()
+            db.drop_all()
+        self.assertEqual([2, 2, 1], committed)
+
+
+class TestResume(CommandTestCase):
+
+    settings = {'format': 'msgpack', 'split_rows': 3}
+
+    def setUp(self):
+        super().setUp()
+        with app.app_context():
+            db.create_all()
+            db.session.add(User(email=u'me@example.etc'))
+            for num in range(7):
+                db.session.add(Post(title=u'Post {}'.format(num), author_id=1))
+            db.session.commit()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+        super().tearDown()
+
+    def test_resume_create(self):
+        create_file = LocalStorage.create_file
+        created = list()
+
+        def fail_on_third_file(storage, name, contents):
+            if '-Post-part' in name:
+                created.append(name)
+                if len(created) == 3:
+                    raise IOError('connection lost')
+            return create_file(storage, name, contents)
+
+        with patch.object(LocalStorage, 'create_file', fail_on_third_file):
+            with self.assertRaises(IOError):
+                self.invoke('create')
+        journal = Journal(LocalStorage(self.dir, local_path=self.dir),
+                          Journal.CREATE.format('1700000000'))
+        self.assertTrue(journal.load())
+        self.assertEqual(2, len([name for name in journal.data['files']
+                                 if '-Post-part' in name]))
+
+        with app.app_context():  # rows added meanwhile go in the last range
+            db.session.add(Post(title=u'Post 7', author_id=1))
+            db.session.commit()
+        created.clear()
+        with patch.object(LocalStorage, 'create_file', fail_on_third_file):
+            backup, _ = self.invoke('create', '--resume', '1700000000')
+        self.assertEqual(['bkp-1700000000-Post-part0003.bin'], created)
+        self.assertFalse(journal.load())
+        files = list(backup.catalog.get_files('1700000000'))
+        self.assertIn('bkp-1700000000-Post-part0001.bin', files)
+        self.assertEqual(3, backup.catalog.get_details(
+            'bkp-1700000000-Post-part0001.bin')['rows'])
+        self.assertEqual(2, backup.catalog.get_details(
+            'bkp-1700000000-Post-part0003.bin')['rows'])
+
+    def test_journal_saves(self):
+        with patch.object(Journal, 'save', autospec=True,
+                          side_effect=Journal.save) as save:
+            backup, _ = self.invoke('create')
+        files = [name for name in backup.catalog.get_files()
+                 if '_marks' not in name]
+        self.assertEqual(1 + len(files), save.call_count)
+
+    def test_resume_restore(self):
+        self.invoke('create')
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+        get_values = AlchemyDumpsDatabase.get_values
+        calls = list()
+
+        def fail_on_seventh_row(row):
+            calls.append(row)
+            if len(calls) == 7:
+                raise RuntimeError('out of memory')
+            return get_values(row)
+
+        with patch.object(AlchemyDumpsDatabase, 'get_values',
+                          staticmethod(fail_on_seventh_row)):
+            with self.assertRaises(RuntimeError):
+                self.invoke('restore', '-d', '1700000000', '-b', 2)
+        with app.app_context():
+            self.assertEqual(1, User.query.count())
+            # part 1 and the first batch of part 2
+            self.assertEqual(5, Post.query.count())
+
+        calls.clear()
+        with patch.object(AlchemyDumpsDatabase, 'get_values',
+                          staticmethod(lambda row: calls.append(row) or
+                                       get_values(row))):
+            self.invoke('restore', '-d', '1700000000', '-b', 2, '--resume')
+        with app.app_context():
+            self.assertEqual(7, Post.query.count())
+        self.assertEqual(2, len(calls))  # only the rows left of Post
+        self.assertEqual([], os.listdir(self.workdir))
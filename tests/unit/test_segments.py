@@ -0,0 +1,91 @@
+# coding: utf-8
+
+from unittest import TestCase
+
+from alchemydumps.database import AlchemyDumpsDatabase
+
+from ..integration.app import Post, User, app, db
+from . import CommandTestCase
+
+
+class TestSplitRanges(TestCase):
+
+    def setUp(self):
+        with app.app_context():
+            db.create_all()
+            db.session.add(User(email=u'me@example.etc'))
+            for num in range(10):
+                db.session.add(Post(title=u'Post {}'.format(num), author_id=1))
+            db.session.commit()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def get_ids(self, model, ranges):
+        ids = list()
+        for criteria in ranges:
+            query = db.session.query(model.id).filter(*criteria)
+            ids.append([row.id for row in query.order_by(model.id)])
+        return ids
+
+    def test_integer_key(self):
+        with app.app_context():
+            alchemy = AlchemyDumpsDatabase()
+            ranges = alchemy.split_ranges(Post, 3)
+            self.assertEqual([[1, 2, 3, 4], [5, 6, 7, 8], [9, 10]],
+                             self.get_ids(Post, ranges))
+
+            # rows added meanwhile still fall in the last range
+            db.session.add(Post(id=42))
+            db.session.commit()
+            self.assertEqual([9, 10, 42], self.get_ids(Post, ranges)[-1])
+
+    def test_no_split(self):
+        with app.app_context():
+            alchemy = AlchemyDumpsDatabase()
+            self.assertEqual([[]], alchemy.split_ranges(Post, 1))
+            self.assertEqual([[1]], self.get_ids(
+                User, alchemy.split_ranges(User, 4)))
+
+    def test_count_rows(self):
+        with app.app_context():
+            alchemy = AlchemyDumpsDatabase()
+            self.assertEqual(10, alchemy.count_rows(Post))
+            self.assertEqual(3, alchemy.count_rows(Post, [Post.id > 7]))
+
+
+class TestSegmentNames(CommandTestCase):
+
+    FILES = (
+        'bkp-1700000000-Post-part0002.bin',
+        'bkp-1700000000-Post-part0001.bin',
+        'bkp-1700000000-User.bin',
+        'bkp-1800000000-Post-delta.bin',
+        'bkp-1900000000-Post-delta-part0001.bin',
+        'bkp-1900000000-Post-delta-part0002.bin',
+    )
+
+    def setUp(self):
+        super().setUp()
+        self.backup = self.get_backup()
+        self.backup.files = self.FILES
+
+    def test_get_name(self):
+        self.assertEqual('bkp-1700000000-Post-part0002.bin',
+                         self.backup.get_name('Post', '1700000000', part=2))
+        self.assertEqual(
+            'bkp-1900000000-Post-delta-part0001.bin',
+            self.backup.get_name('Post', '1900000000', delta=True, part=1))
+
+    def test_find_chain(self):
+        self.assertEqual(['bkp-1700000000-User.bin'],
+                         self.backup.find_chain('User', '1900000000'))
+        self.assertEqual([
+            'bkp-1700000000-Post-part0001.bin',
+            'bkp-1700000000-Post-part0002.bin',
+            'bkp-1800000000-Post-delta.bin',
+            'bkp-1900000000-Post-delta-part0001.bin',
+            'bkp-1900000000-Post-delta-part0002.bin',
+        ], self.backup.find_chain('Post', '1900000000'))
@@ -0,0 +1,137 @@
+# coding: utf-8
+
+import os
+from unittest import TestCase
+
+import click
+
+from alchemydumps import get_selection
+from alchemydumps.config import Settings
+from alchemydumps.database import AlchemyDumpsDatabase
+
+from ..integration.app import Comments, Post, SomeControl, User, app, db
+from . import CommandTestCase
+
+
+class TestSelection(TestCase):
+
+    def test_include_and_exclude(self):
+        with app.app_context():
+            alchemy = AlchemyDumpsDatabase(do_not_backup=['Comm*'])
+            self.assertEqual({User, Post, SomeControl},
+                             set(alchemy.get_mapped_classes()))
+            alchemy = AlchemyDumpsDatabase(include=['user', 'Some*'])
+            self.assertEqual({User, SomeControl},
+                             set(alchemy.get_mapped_classes()))
+            alchemy = AlchemyDumpsDatabase(include=['*o*'],
+                                           do_not_backup=['post'])
+            self.assertEqual({SomeControl, Comments},
+                             set(alchemy.get_mapped_classes()))
+
+    def test_columns(self):
+        alchemy = AlchemyDumpsDatabase(columns={'Post': ['title']})
+        self.assertEqual(['id', 'title'],
+                         [column.name for column in alchemy.get_columns(Post)])
+        self.assertEqual(['id', 'email'],
+                         [column.name for column in alchemy.get_columns(User)])
+        alchemy.columns['Post'] = ['title', 'body']
+        with self.assertRaises(ValueError):
+            alchemy.get_columns(Post)
+
+    def test_get_selection(self):
+        conf = Settings.from_mapping({
+            'include': ['User', 'Post'], 'exclude': ['Comments'],
+            'filters': {'Post': 'id > 1', 'User': 'id > 2'},
+            'columns': {'Post': 'title, author_id'},
+        })
+        selection = get_selection(conf, exclude=['Some*'],
+                                  where=['Post: id > 3'],
+                                  columns=['User:email'])
+        self.assertEqual({
+            'include': ['User', 'Post'],
+            'do_not_backup': ['Some*', 'Comments'],
+            'filters': {'Post': 'id > 3', 'User': 'id > 2'},
+            'columns': {'Post': ['title', 'author_id'], 'User': ['email']},
+        }, selection)
+        self.assertEqual(['Post'], get_selection(conf, ['Post'])['include'])
+        self.assertEqual({'include': [], 'do_not_backup': [], 'filters': {},
+                          'columns': {}}, get_selection(Settings()))
+        with self.assertRaises(click.BadParameter):
+            get_selection(conf, where=['id > 3'])
+
+
+class TestPartialBackup(CommandTestCase):
+
+    def setUp(self):
+        super().setUp()
+        with app.app_context():
+            db.create_all()
+            db.session.add(User(email=u'me@example.etc'))
+            for num in range(5):
+                db.session.add(Post(title=u'Post {}'.format(num),
+                                    content=u'Content', author_id=1))
+            db.session.commit()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+        super().tearDown()
+
+    def test_partial_backup(self):
+        settings = {'format': 'msgpack', 'exclude': ['Comments'],
+                    'filters': {'Post': 'id % 2 = 1'}}
+        backup, _ = self.invoke('create', '-x', 'SomeControl',
+                                '--columns', 'Post:title', settings=settings)
+        self.assertEqual(['bkp-1700000000-Post.bin',
+                          'bkp-1700000000-User.bin',
+                          'bkp-1700000000-_marks.bin'],
+                         list(backup.catalog.get_files()))
+        details = backup.catalog.get_details('bkp-1700000000-Post.bin')
+        self.assertEqual(3, details['rows'])
+        self.assertEqual('id % 2 = 1', details['where'])
+        self.assertEqual(['title'], details['columns'])
+
+        _, output = self.invoke('verify', '--against-db')
+        self.assertIn('bkp-1700000000-Post.bin OK (3 rows)', output)
+        self.assertIn('User matches the database', output)
+        self.assertIn('Post not compared', output)
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+        self.invoke('restore', '-d', '1700000000')
+        with app.app_context():
+            posts = Post.query.order_by(Post.id).all()
+            self.assertEqual([1, 3, 5], [post.id for post in posts])
+            self.assertEqual([u'Post 0', u'Post 2', u'Post 4'],
+                             [post.title for post in posts])
+            self.assertEqual({None}, {post.content for post in posts})
+            self.assertEqual({None}, {post.author_id for post in posts})
+
+    def test_upsert_keeps_the_columns_not_saved(self):
+        self.invoke('create', '-I', 'Post', '--columns', 'Post:title',
+                    settings={'format': 'msgpack'})
+        with app.app_context():
+            Post.query.update({'title': u'Changed', 'content': u'Kept'})
+            db.session.commit()
+        self.invoke('restore', '-d', '1700000000', '--upsert')
+        with app.app_context():
+            posts = Post.query.order_by(Post.id).all()
+            self.assertEqual([u'Post {}'.format(num) for num in range(5)],
+                             [post.title for post in posts])
+            self.assertEqual({u'Kept'}, {post.content for post in posts})
+            self.assertEqual({1}, {post.author_id for post in posts})
+
+    def test_restore_needs_a_valid_id(self):
+        self.invoke('create', '-I', 'Post', settings={'format': 'msgpack'})
+        for args in ((), ('-d', 'abc'), ('-d', '1600000000')):
+            _, output = self.invoke('restore', *args)
+            self.assertIn('Invalid id', output)
+            self.assertFalse(os.listdir(self.workdir))  # no journal
+
+    def test_columns_need_a_columnar_format(self):
+        _, output = self.invoke('create', '--columns', 'Post:title',
+                                settings={'format': 'pickle'}, exit_code=2)
+        self.assertIn('Only the msgpack and copy formats', output)
+
@@ -0,0 +1,63 @@
+# coding: utf-8
+
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from alchemydumps.database import AlchemyDumpsDatabase
+
+from ..integration.app import Post, User, app, db
+
+
+class TestSnapshot(TestCase):
+
+    def setUp(self):
+        with app.app_context():
+            db.create_all()
+            db.session.add(User(email=u'me@example.etc'))
+            for num in range(5):
+                db.session.add(Post(title=u'Post {}'.format(num), author_id=1))
+            db.session.commit()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def count_selects(self, alchemy, model, core=False):
+        statements = list()
+
+        def before_execute(conn, cursor, statement, *args):
+            if statement.startswith('SELECT'):
+                statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_execute)
+        try:
+            chunks = list(alchemy.iter_rows(model, 2, core=core))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_execute)
+        return [len(chunk) for chunk in chunks], len(statements)
+
+    def test_keyset_pagination(self):
+        with app.app_context():
+            alchemy = AlchemyDumpsDatabase()
+            self.assertEqual(([2, 2, 1], 3), self.count_selects(alchemy, Post))
+
+    def test_stream_results(self):
+        with app.app_context():
+            alchemy = AlchemyDumpsDatabase(stream_results=True)
+            self.assertEqual(([2, 2, 1], 1), self.count_selects(alchemy, Post))
+            self.assertEqual(([2, 2, 1], 1),
+                             self.count_selects(alchemy, Post, core=True))
+
+    def test_begin_and_end_snapshot(self):
+        with app.app_context():
+            alchemy = AlchemyDumpsDatabase(stream_results=True)
+            alchemy.begin_snapshot()
+            connection = db.session.connection()
+            driver_connection = connection.connection.driver_connection
+            self.assertTrue(driver_connection.in_transaction)
+            self.assertEqual(5, Post.query.count())
+
+            alchemy.end_snapshot()
+            self.assertFalse(driver_connection.in_transaction)
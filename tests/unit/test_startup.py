@@ -0,0 +1,81 @@
+# coding: utf-8
+
+import json
+import os
+import subprocess
+import sys
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from alchemydumps.config import YamlLoader
+from alchemydumps.storage import (FtpStorage, LocalStorage, STORAGES,
+                                  get_storage_class)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+
+# cumulative import time of the package, see `python -X importtime`
+BUDGET = int(os.environ.get('ALCHEMYDUMPS_IMPORT_BUDGET_MS', 250))
+
+HEAVY = ('flask', 'sqlalchemy', 'arrow', 'yaml', 'yamlordereddictloader',
+         'pyclbr', 'asyncio', 'boto3', 'numpy', 'zstandard', 'lz4')
+
+
+def run_python(code, *options):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    result = subprocess.run([sys.executable] + list(options) + ['-c', code],
+                            capture_output=True, text=True, env=env,
+                            check=True)
+    return result
+
+
+class TestStartup(TestCase):
+
+    def test_storage_commands_skip_heavy_modules(self):
+        code = ('import sys, json, alchemydumps\n'
+                'from alchemydumps import autoclean, history, remove\n'
+                'from alchemydumps.autoclean import BackupAutoClean\n'
+                'from alchemydumps.catalog import Catalog\n'
+                'print(json.dumps(sorted(sys.modules)))')
+        modules = set(json.loads(run_python(code).stdout))
+        self.assertEqual(set(), {name for name in modules
+                                 if name.split('.')[0] in HEAVY})
+
+    def test_import_time_budget(self):
+        stderr = run_python('import alchemydumps', '-X', 'importtime').stderr
+        for line in stderr.splitlines():
+            _, cumulative, name = line.split('|')
+            if name.strip() == 'alchemydumps':
+                self.assertLess(int(cumulative) / 1000, BUDGET)
+                break
+        else:
+            self.fail('alchemydumps is not in the import time report')
+
+
+class TestStorageRegistry(TestCase):
+
+    def setUp(self):
+        self.dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def test_get_storage_class(self):
+        self.assertIs(LocalStorage, get_storage_class())
+        self.assertIs(FtpStorage, get_storage_class('ftp'))
+        self.assertEqual({'local', 'ftp', 's3', 'dedup'}, set(STORAGES))
+        with self.assertRaises(ValueError):
+            get_storage_class('dropbox')
+
+    def test_settings_name_a_known_storage(self):
+        path = os.path.join(self.dir, 'settings.yml')
+        with open(path, 'w') as handler:
+            handler.write('storage: ftp\nprefix: db-bkp\n')
+        settings = YamlLoader(settings_file=path).load()
+        self.assertIs(FtpStorage, get_storage_class(settings.storage))
+        self.assertEqual('db-bkp', settings.prefix)
+
+        with open(path, 'w') as handler:
+            handler.write('storage: dropbox\n')
+        with self.assertRaises(ValueError):
+            YamlLoader(settings_file=path).load()
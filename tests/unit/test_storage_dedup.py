@@ -0,0 +1,130 @@
+# coding: utf-8
+
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, skipIf
+
+from alchemydumps.storage import DedupStorage, LocalStorage
+from alchemydumps.stream import split_chunks
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class TestSplitChunks(TestCase):
+
+    def test_chunks_are_content_defined(self):
+        data = os.urandom(2 ** 19)
+        pieces = [data[n:n + 1000] for n in range(0, len(data), 1000)]
+        chunks = list(split_chunks(pieces, 2 ** 10, 2 ** 12, 2 ** 14))
+        self.assertEqual(data, b''.join(chunks))
+        self.assertTrue(all(len(chunk) <= 2 ** 14 for chunk in chunks))
+
+        # inserting a byte only changes the chunks around it
+        changed = data[:2 ** 18] + b'42' + data[2 ** 18:]
+        other = list(split_chunks(changed, 2 ** 10, 2 ** 12, 2 ** 14))
+        self.assertGreater(len(set(chunks) & set(other)), len(chunks) - 4)
+
+    @skipIf(numpy is None, 'NumPy is not installed')
+    def test_same_chunks_without_numpy(self):
+        data = os.urandom(2 ** 20)
+        chunks = list(split_chunks(data))
+        self.assertGreater(len(chunks), 4)
+        with patch.dict('sys.modules', {'numpy': None}):
+            self.assertEqual(chunks, list(split_chunks(data)))
+
+    def test_small_contents(self):
+        self.assertEqual([b'42'], list(split_chunks(b'42')))
+        self.assertEqual([], list(split_chunks(b'')))
+
+
+class TestDedupStorage(TestCase):
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        inner = LocalStorage(self.dir, local_path=self.dir)
+        self.storage = DedupStorage(self.dir, inner=inner, min_size=2 ** 10,
+                                    avg_size=2 ** 12, max_size=2 ** 14)
+        self.data = os.urandom(2 ** 17)
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def chunk_files(self):
+        return [n for n in os.listdir(self.dir) if n.startswith('chunk-')]
+
+    def test_create_and_read(self):
+        self.storage.create_file('bkp-1500000000-Post.gz', self.data)
+        self.assertEqual(self.data,
+                         self.storage.read_file('bkp-1500000000-Post.gz'))
+        self.assertEqual(['bkp-1500000000-Post.gz'],
+                         list(self.storage.get_files()))
+
+    def test_deduplication(self):
+        self.storage.create_file('bkp-1500000000-Post.gz', self.data)
+        count = len(self.chunk_files())
+        self.storage.create_file('bkp-1600000000-Post.gz',
+                                 [self.data, b'42'])
+        self.assertLess(len(self.chunk_files()), count + 3)
+        self.assertEqual(self.data + b'42',
+                         self.storage.read_file('bkp-1600000000-Post.gz'))
+
+    def test_collect_garbage(self):
+        self.storage.create_file('bkp-1500000000-Post.gz', self.data)
+        self.storage.create_file('bkp-1600000000-User.gz', b'42')
+        count = len(self.chunk_files())
+        self.storage.delete_file('bkp-1500000000-Post.gz')
+
+        # unreferenced chunks are kept for a while (a backup being created
+        # may refer to them), then deleted
+        self.storage.collect_garbage()
+        self.assertEqual(count, len(self.chunk_files()))
+        self.assertIn(DedupStorage.ORPHANS, os.listdir(self.dir))
+        self.storage.grace = 0
+        self.storage.collect_garbage()
+        self.assertEqual(1, len(self.chunk_files()))
+        self.assertNotIn(DedupStorage.ORPHANS, os.listdir(self.dir))
+        self.assertEqual(b'42',
+                         self.storage.read_file('bkp-1600000000-User.gz'))
+
+    def test_collect_garbage_with_the_catalog(self):
+        self.storage.grace = 0
+        self.storage.create_file('bkp-1500000000-Post.gz', self.data)
+        details = self.storage.get_details('bkp-1500000000-Post.gz')
+        self.assertEqual(len(self.chunk_files()), len(details['chunks']))
+
+        # a backup created meanwhile by another process: its chunks are
+        # known from the catalog only
+        other = DedupStorage(self.dir, inner=self.storage.inner,
+                             min_size=2 ** 10, avg_size=2 ** 12,
+                             max_size=2 ** 14)
+        other.create_file('bkp-1600000000-User.gz', b'42')
+        files = {
+            'bkp-1500000000-Post.gz': details,
+            'bkp-1600000000-User.gz': other.get_details(
+                'bkp-1600000000-User.gz'),
+        }
+        with patch.object(DedupStorage, 'read_manifest') as read_manifest:
+            self.storage.collect_garbage(files)
+        read_manifest.assert_not_called()
+        self.assertEqual(len(files['bkp-1500000000-Post.gz']['chunks']) + 1,
+                         len(self.chunk_files()))
+
+    def test_other_files_are_not_deduplicated(self):
+        self.storage.create_file('alchemydumps-catalog.json', b'{}')
+        self.assertEqual([], self.chunk_files())
+        self.assertEqual(b'{}', self.storage.inner.read_file(
+            'alchemydumps-catalog.json'))
+
+    def test_regular_files(self):
+        self.storage.inner.create_file('bkp-1500000000-Post.gz', b'42')
+        self.assertEqual(b'42',
+                         self.storage.read_file('bkp-1500000000-Post.gz'))
@@ -0,0 +1,164 @@
+# coding: utf-8
+
+import os
+from ftplib import error_perm
+from threading import Thread
+from unittest import TestCase
+
+from alchemydumps.compression import GzipCodec, NoCodec
+from alchemydumps.ftp_pool import FtpPool
+from alchemydumps.storage import FtpStorage
+from alchemydumps.stream import CompressingReader, PipeReader
+
+try:
+    from unittest.mock import MagicMock
+except ImportError:
+    from mock import MagicMock
+
+
+class FakeFTP(object):
+    """Stores files in memory, transferring them in `blocksize` blocks"""
+
+    host = 'f.oo'
+
+    def __init__(self):
+        self.files = dict()
+        self.blocks = list()
+        self.binary = False
+
+    def voidcmd(self, cmd):
+        self.binary = cmd == 'TYPE I'
+
+    def size(self, name):
+        if not self.binary:
+            raise error_perm('550 SIZE not allowed in ASCII mode')
+        if name not in self.files:
+            raise error_perm('550 No such file or directory')
+        return len(self.files[name])
+
+    def nlst(self):
+        self.binary = False
+        return list(self.files)
+
+    def pwd(self):
+        return '/bar'
+
+    def close(self):
+        pass
+
+    def storbinary(self, cmd, fp, blocksize=8192):
+        data = bytearray()
+        while True:
+            block = fp.read(blocksize)
+            if not block:
+                break
+            self.blocks.append(len(block))
+            data.extend(block)
+        self.files[cmd.split(' ', 1)[1]] = bytes(data)
+
+    def retrbinary(self, cmd, callback, blocksize=8192):
+        data = self.files[cmd.split(' ', 1)[1]]
+        for start in range(0, len(data), blocksize):
+            callback(data[start:start + blocksize])
+
+
+class TestStreams(TestCase):
+
+    def test_compressing_reader(self):
+        reader = CompressingReader(NoCodec(), [b'foo', b'bar', b'42'])
+        self.assertEqual(b'fo', reader.read(2))
+        self.assertEqual(b'obar42', reader.read())
+        self.assertEqual(b'', reader.read(2))
+
+    def test_pipe_reader(self):
+        pipe = PipeReader()
+        pipe.feed(b'foo')
+        pipe.feed(b'bar')
+        pipe.finish()
+        self.assertEqual(b'fo', pipe.peek(2))
+        self.assertEqual(b'foob', pipe.read(4))
+        self.assertEqual(b'ar', pipe.read())
+
+    def test_pipe_reader_closed(self):
+        pipe = PipeReader(maxsize=2)
+        fed = list()
+
+        def produce():
+            try:
+                for num in range(10):
+                    pipe.feed(b'x')
+                    fed.append(num)
+            except ValueError:
+                pass
+            pipe.finish()
+
+        producer = Thread(target=produce, daemon=True)
+        producer.start()
+        self.assertEqual(b'x', pipe.read(1))
+        pipe.close()
+        producer.join(5)
+        self.assertFalse(producer.is_alive())
+        self.assertLess(len(fed), 10)
+
+    def test_pipe_reader_error(self):
+        pipe = PipeReader()
+        pipe.feed(b'foo')
+        pipe.finish(IOError('connection lost'))
+        with self.assertRaises(IOError):
+            pipe.read()
+
+
+class TestFtpStorage(TestCase):
+
+    def setUp(self):
+        self.ftp = FakeFTP()
+        self.storage = FtpStorage('/bar', ftp=self.ftp, blocksize=64)
+
+    def test_normalize_path(self):
+        self.assertEqual('ftp://f.oo/bar/', self.storage.backup_path)
+
+    def test_create_and_read_file(self):
+        contents = [bytes([n]) * 100 for n in range(256)]
+        created = self.storage.create_file('foobar.gz', iter(contents))
+        self.assertEqual('ftp://f.oo/bar/foobar.gz', created)
+        self.assertTrue(self.ftp.files['foobar.gz'].startswith(b'\x1f\x8b'))
+        self.assertTrue(all(size <= 64 for size in self.ftp.blocks))
+
+        with self.storage.open_file('foobar.gz') as handler:
+            self.assertEqual(b'\x00' * 100, handler.read(100))
+        read = self.storage.read_file('foobar.gz')
+        self.assertEqual(b''.join(contents), read)
+
+    def test_read_missing_file(self):
+        with self.assertRaises(KeyError):
+            self.storage.read_file('missing.gz')
+
+    def test_has_file(self):
+        self.storage.create_file('foobar.gz', b'42')
+        self.assertEqual(['foobar.gz'], list(self.storage.list_files()))
+        self.assertTrue(self.storage.has_file('foobar.gz'))
+        self.assertFalse(self.storage.has_file('missing.gz'))
+
+    def test_delete_file(self):
+        ftp = MagicMock()
+        storage = FtpStorage('/bar', ftp=ftp)
+        storage.delete_file('foobar.gz')
+        ftp.delete.assert_called_once_with('foobar.gz')
+
+    def test_close_before_the_end(self):
+        pool = FtpPool('f.oo', size=1)
+        pool.connect = lambda: self.ftp
+        for codec in (NoCodec(), GzipCodec(level=0)):
+            storage = FtpStorage('/bar', pool=pool, codec=codec, blocksize=64)
+            contents = os.urandom(64 * 200)  # more blocks than the pipe holds
+            storage.create_file('foobar', contents)
+            with storage.open_file('foobar') as handler:
+                self.assertEqual(contents[:12], handler.read(12))
+
+            # the transfer stopped and gave the only session back
+            read = list()
+            reader = Thread(target=lambda: read.append(
+                storage.read_file('foobar')), daemon=True)
+            reader.start()
+            reader.join(5)
+            self.assertEqual([contents], read)
@@ -0,0 +1,202 @@
+# coding: utf-8
+
+from io import BytesIO
+from os import urandom
+from threading import Lock, enumerate as enumerate_threads
+from unittest import TestCase, skipIf
+
+from alchemydumps.compression import GzipCodec, NoCodec
+from alchemydumps.storage import S3Storage
+
+try:
+    import boto3
+    try:
+        from moto import mock_aws
+    except ImportError:  # moto < 5
+        from moto import mock_s3 as mock_aws
+except ImportError:
+    boto3 = mock_aws = None
+
+
+class ClientError(Exception):
+
+    def __init__(self, code):
+        self.response = {'Error': {'Code': code}}
+
+
+class FakeS3(object):
+    """Keeps objects in memory, listing them 2 keys per page"""
+
+    class exceptions(object):
+        ClientError = ClientError
+
+    def __init__(self):
+        self.objects = dict()
+        self.uploads = dict()
+        self.requests = list()
+        self.lock = Lock()
+
+    def log(self, name, **kwargs):
+        with self.lock:
+            self.requests.append((name, kwargs))
+
+    def get_paginator(self, name):
+        fake = self
+
+        class Paginator(object):
+            def paginate(self, Bucket, Prefix):
+                keys = sorted(k for k in fake.objects if k.startswith(Prefix))
+                for start in range(0, len(keys), 2):
+                    fake.log('list_objects_v2', Prefix=Prefix)
+                    yield {'Contents': [{'Key': k}
+                                        for k in keys[start:start + 2]]}
+
+        return Paginator()
+
+    def put_object(self, Bucket, Key, Body):
+        self.log('put_object', Key=Key)
+        self.objects[Key] = Body
+
+    def create_multipart_upload(self, Bucket, Key):
+        self.uploads['42'] = dict()
+        return {'UploadId': '42'}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.log('upload_part', PartNumber=PartNumber)
+        self.uploads[UploadId][PartNumber] = Body
+        return {'ETag': 'etag-{}'.format(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId,
+                                  MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        numbers = [p['PartNumber'] for p in MultipartUpload['Parts']]
+        self.objects[Key] = b''.join(parts[n] for n in numbers)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId)
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError('404')
+        return {'ContentLength': len(self.objects[Key])}
+
+    def get_object(self, Bucket, Key, Range):
+        self.log('get_object', Range=Range)
+        start, end = map(int, Range[len('bytes='):].split('-'))
+        return {'Body': BytesIO(self.objects[Key][start:end + 1])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+    def delete_objects(self, Bucket, Delete):
+        self.log('delete_objects', Count=len(Delete['Objects']))
+        for item in Delete['Objects']:
+            self.objects.pop(item['Key'], None)
+        return {}
+
+    def copy_object(self, Bucket, Key, CopySource):
+        self.objects[Key] = self.objects[CopySource['Key']]
+
+
+class TestS3Storage(TestCase):
+
+    def setUp(self):
+        self.client = FakeS3()
+        self.storage = S3Storage('/backups/', prefix='db', codec=NoCodec(),
+                                 bucket='foo', client=self.client,
+                                 part_size=64, jobs=3)
+
+    def requests(self, name):
+        return [kw for name_, kw in self.client.requests if name_ == name]
+
+    def test_normalize_path(self):
+        self.assertEqual('s3://foo/backups/', self.storage.backup_path)
+
+    def test_get_files(self):
+        for name in ('db-1562000000-User.gz', 'db-1562000000-Post.gz',
+                     'db-1563000000-User.gz', 'chunk-42', 'other-file'):
+            self.storage.create_file(name, b'42')
+        self.assertEqual(['db-1562000000-Post.gz', 'db-1562000000-User.gz',
+                          'db-1563000000-User.gz'],
+                         list(self.storage.get_files()))
+        self.assertEqual(2, len(self.requests('list_objects_v2')))
+        self.assertEqual(5, len(list(self.storage.list_files())))
+
+    def test_small_file(self):
+        self.storage.create_file('db-1562000000-User.gz', [b'4', b'2'])
+        self.assertEqual(b'42', self.client.objects[
+            'backups/db-1562000000-User.gz'])
+        self.assertEqual([], self.requests('upload_part'))
+
+    def test_multipart_upload_and_ranged_download(self):
+        contents = [bytes([n]) * 10 for n in range(50)]
+        self.storage.create_file('db-1562000000-User.gz', iter(contents))
+        self.assertEqual(8, len(self.requests('upload_part')))
+
+        read = self.storage.read_file('db-1562000000-User.gz')
+        self.assertEqual(b''.join(contents), read)
+        ranges = sorted(kw['Range'] for kw in self.requests('get_object'))
+        self.assertEqual(8, len(ranges))
+        self.assertIn('bytes=448-499', ranges)
+
+    def test_close_before_the_end(self):
+        self.storage.codec = GzipCodec(level=0)
+        self.storage.part_size = 2 ** 12
+        self.storage.create_file('db-1562000000-User.gz', urandom(2 ** 18))
+        threads = set(enumerate_threads())
+        with self.storage.open_file('db-1562000000-User.gz') as handler:
+            self.assertEqual(12, len(handler.read(12)))
+        # the ranges the decompressor read, and at most `jobs` ahead, out of
+        # the 65 ranges of the file, and the downloads stopped
+        self.assertLessEqual(len(self.requests('get_object')), 8)
+        self.assertEqual(set(), set(enumerate_threads()) - threads)
+
+    def test_failed_upload_is_aborted(self):
+        def contents():
+            yield b'x' * 200
+            raise IOError('database went away')
+
+        with self.assertRaises(IOError):
+            self.storage.create_file('db-1562000000-User.gz', contents())
+        self.assertEqual({}, self.client.uploads)
+        self.assertEqual({}, self.client.objects)
+
+    def test_batch_delete(self):
+        names = ['db-{}-User.gz'.format(n) for n in range(1562000000,
+                                                          1562001500)]
+        for name in names:
+            self.client.objects['backups/' + name] = b'42'
+        results = self.storage.delete_files(names)
+        self.assertEqual([(name, None) for name in names], results)
+        self.assertEqual([{'Count': 1000}, {'Count': 500}],
+                         self.requests('delete_objects'))
+        self.assertEqual({}, self.client.objects)
+
+    def test_has_and_rename_file(self):
+        self.assertFalse(self.storage.has_file('catalog.json'))
+        self.storage.create_file('catalog.json.tmp', b'{}')
+        self.storage.rename_file('catalog.json.tmp', 'catalog.json')
+        self.assertTrue(self.storage.has_file('catalog.json'))
+        self.assertFalse(self.storage.has_file('catalog.json.tmp'))
+
+
+@skipIf(mock_aws is None, 'boto3 and moto are not installed')
+class TestS3StorageWithMoto(TestCase):
+
+    def setUp(self):
+        self.mock = mock_aws()
+        self.mock.start()
+        self.addCleanup(self.mock.stop)
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket='foo')
+        self.storage = S3Storage('backups', prefix='db', bucket='foo',
+                                 client=client, part_size=5 * 2 ** 20)
+
+    def test_round_trip(self):
+        contents = [urandom(2 ** 20) for _ in range(12)]  # 3 parts
+        name = 'db-1562000000-User.gz'
+        self.storage.create_file(name, iter(contents))
+        self.assertEqual([name], list(self.storage.get_files()))
+        self.assertEqual(b''.join(contents), self.storage.read_file(name))
+        self.assertEqual([(name, None)], self.storage.delete_files([name]))
+        self.assertFalse(self.storage.has_file(name))
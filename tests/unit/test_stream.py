@@ -0,0 +1,56 @@
+# coding: utf-8
+
+from io import BytesIO
+from unittest import TestCase
+
+from alchemydumps.database import AlchemyDumpsDatabase
+from alchemydumps.stream import MAGIC, decode_frames, encode_frames
+
+from ..integration.app import Post, User, app, db
+
+
+class TestFrames(TestCase):
+
+    def test_round_trip(self):
+        chunks = [b'42', b'', b'foobar']
+        encoded = b''.join(encode_frames(chunks))
+        self.assertTrue(encoded.startswith(MAGIC))
+        self.assertEqual(chunks, list(decode_frames(BytesIO(encoded))))
+
+    def test_legacy_dump(self):
+        self.assertEqual([b'42'], list(decode_frames(BytesIO(b'42'))))
+        self.assertEqual([], list(decode_frames(BytesIO(b''))))
+
+    def test_truncated_frame(self):
+        encoded = b''.join(encode_frames([b'foobar']))
+        with self.assertRaises(EOFError):
+            list(decode_frames(BytesIO(encoded[:-1])))
+
+
+class TestStreamedDump(TestCase):
+
+    def setUp(self):
+        with app.app_context():
+            db.create_all()
+            db.session.add(User(email=u'me@example.etc'))
+            for num in range(5):
+                db.session.add(Post(title=u'Post {}'.format(num), author_id=1))
+            db.session.commit()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_dump_chunks(self):
+        with app.app_context():
+            alchemy = AlchemyDumpsDatabase(chunk_size=2)
+            chunks = list(alchemy.dump_chunks(Post))
+            self.assertEqual(3, len(chunks))
+            self.assertEqual(5, alchemy.row_counts['Post'])
+
+            encoded = BytesIO(b''.join(encode_frames(chunks)))
+            rows = list(alchemy.parse_chunks(decode_frames(encoded)))
+            titles = [row.title for row in rows]
+            expected = [u'Post {}'.format(num) for num in range(5)]
+            self.assertEqual(expected, titles)
@@ -0,0 +1,115 @@
+# coding: utf-8
+
+import os
+from unittest import TestCase
+
+from alchemydumps.checksum import RowChecksum
+from alchemydumps.compression import GzipCodec
+from alchemydumps.database import AlchemyDumpsDatabase
+from alchemydumps.formats import get_format, load_chunks
+
+from ..integration.app import Post, User, app, db
+from . import CommandTestCase
+
+
+class TestRowChecksum(TestCase):
+
+    def setUp(self):
+        with app.app_context():
+            db.create_all()
+            db.session.add(User(email=u'me@example.etc'))
+            for num in range(5):
+                db.session.add(Post(title=u'Post\t{}'.format(num),
+                                    content=None if num else u'ção',
+                                    author_id=1))
+            db.session.commit()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_same_checksum_in_every_format(self):
+        with app.app_context():
+            alchemy = AlchemyDumpsDatabase(chunk_size=2)
+            expected = alchemy.checksum_rows(Post)
+            self.assertEqual(5, expected.rows)
+            for name in ('pickle', 'msgpack', 'copy'):
+                chunks = list(get_format(name).dump(alchemy, Post))
+                dumped = alchemy.checksums['Post']
+                self.assertEqual(expected.hexdigest(), dumped.hexdigest())
+
+                loaded = RowChecksum.of(Post)
+                rows = load_chunks(alchemy, Post, chunks)
+                loaded.update_dicts(map(alchemy.get_values, rows))
+                self.assertEqual(expected.hexdigest(), loaded.hexdigest())
+
+    def test_order_and_ranges(self):
+        with app.app_context():
+            alchemy = AlchemyDumpsDatabase(chunk_size=2)
+            whole = alchemy.checksum_rows(Post)
+            parts = [alchemy.checksum_rows(Post, criteria)
+                     for criteria in reversed(alchemy.split_ranges(Post, 3))]
+            combined = parts[0]
+            for part in parts[1:]:
+                combined = combined.combine(part)
+            self.assertEqual((5, whole.total), (combined.rows, combined.total))
+
+            Post.query.filter_by(id=2).update({'title': u'Changed'})
+            db.session.commit()
+            self.assertNotEqual(whole.total,
+                                alchemy.checksum_rows(Post).total)
+
+
+class TestVerify(CommandTestCase):
+
+    settings = {'format': 'msgpack', 'split_rows': 2}
+    codec = GzipCodec
+
+    def setUp(self):
+        super().setUp()
+        with app.app_context():
+            db.create_all()
+            db.session.add(User(email=u'me@example.etc'))
+            for num in range(5):
+                db.session.add(Post(title=u'Post {}'.format(num), author_id=1))
+            db.session.commit()
+        self.invoke('create')
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+        super().tearDown()
+
+    def test_verify(self):
+        _, output = self.invoke('verify', '-j', 2)
+        self.assertIn('Verifying backup 1700000000 (6 files)', output)
+        self.assertIn('bkp-1700000000-Post-part0002.gz OK (2 rows)', output)
+        self.assertNotIn('FAILED', output)
+
+    def test_corrupted_files(self):
+        path = os.path.join(self.dir, 'bkp-1700000000-Post-part0001.gz')
+        with open(path, 'r+b') as handler:
+            handler.seek(-12, os.SEEK_END)
+            handler.write(b'\0' * 4)
+        os.remove(os.path.join(self.dir, 'bkp-1700000000-User.gz'))
+
+        _, output = self.invoke('verify', '-d', '1700000000', exit_code=1)
+        self.assertIn('Error: 2 of 6 files failed verification', output)
+
+    def test_against_db(self):
+        _, output = self.invoke('verify', '-d', '1700000000', '-j', 2,
+                                '--against-db')
+        self.assertIn('User matches the database (1 rows)', output)
+        self.assertIn('Post matches the database (5 rows)', output)
+
+        with app.app_context():
+            Post.query.filter_by(id=2).update({'title': u'Changed'})
+            User.query.delete()
+            db.session.commit()
+        _, output = self.invoke('verify', '--against-db')
+        self.assertIn('User differs from the database: 1 rows saved, 0 in '
+                      'the database', output)
+        self.assertIn('Post differs from the database: same number of rows, '
+                      'different content', output)